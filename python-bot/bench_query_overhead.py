@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк накладных расходов на запрос в Database:
+трансляция плейсхолдеров $n -> ? (re.sub на каждый вызов против кэша)
+и полный путь fetchrow на SQLite.
+"""
+
+import asyncio
+import os
+import re
+import tempfile
+import time
+
+from bot.db import Database, to_sqlite_params
+
+QUERIES = [
+    "select * from users where telegram_id=$1",
+    "select * from user_active_promocodes where user_id=$1",
+    "update orders set status=$2 where id=$1",
+    "insert into user_active_promocodes (user_id, promo_code, discount_percent, min_amount) values ($1, $2, $3, $4)",
+    "select o.*, u.telegram_id, t.location, t.specs, t.price from orders o "
+    "left join users u on u.id = o.user_id left join tariffs t on t.id = o.tariff_id where o.invoice_id=$1",
+]
+N = 200_000
+
+
+def adapt_uncached(query: str) -> str:
+    # Прежняя реализация Database._adapt_query
+    def repl(m):
+        return "?"
+
+    return re.sub(r"\$\d+", repl, query)
+
+
+def bench(fn) -> float:
+    start = time.perf_counter()
+    for i in range(N):
+        fn(QUERIES[i % len(QUERIES)])
+    return (time.perf_counter() - start) / N * 1e9
+
+
+async def bench_fetchrow(label: str, adapt) -> None:
+    path = os.path.join(tempfile.mkdtemp(), "bench.sqlite3")
+    db = Database(f"sqlite:///{path}", sqlite_read_pool_size=0)
+    db._adapt_query = adapt
+    await db.connect()
+    await db.ensure_schema()
+    await db.execute("insert into users(username, telegram_id) values($1, $2)", "bench", 1)
+    n = 20_000
+    start = time.perf_counter()
+    for _ in range(n):
+        await db.fetchrow("select * from users where telegram_id=$1", 1)
+    per_call = (time.perf_counter() - start) / n * 1e6
+    await db.close()
+    print(f"   fetchrow ({label}): {per_call:.1f} µs/запрос")
+
+
+async def main():
+    before = bench(adapt_uncached)
+    to_sqlite_params.cache_clear()
+    after = bench(to_sqlite_params)
+    print("📊 Трансляция плейсхолдеров на запрос:")
+    print(f"   до (re.sub каждый раз): {before:.0f} нс")
+    print(f"   после (lru_cache):      {after:.0f} нс  (x{before / after:.1f})")
+    print("📊 Полный путь SQLite:")
+    await bench_fetchrow("до", adapt_uncached)
+    await bench_fetchrow("после", to_sqlite_params)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
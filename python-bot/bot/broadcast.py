@@ -0,0 +1,85 @@
+import asyncio
+
+from .jobs import JobQueue
+from .models import Broadcasts, Users
+from .notify import Notifier
+
+
+class Broadcaster:
+    # Mass mailing as a durable job: the cursor (last user id) and counters are
+    # persisted after every page, so a restarted job continues where it stopped
+    def __init__(
+        self,
+        broadcasts: Broadcasts,
+        users: Users,
+        notifier: Notifier,
+        jobs: JobQueue,
+        page_size: int = 200,
+        progress_every: int = 5000,
+    ):
+        self.broadcasts = broadcasts
+        self.users = users
+        self.notifier = notifier
+        self.jobs = jobs
+        self.page_size = page_size
+        self.progress_every = progress_every
+        jobs.register("broadcast", self._run)
+
+    async def start(self, text: str, admin_chat_id: int):
+        total = await self.users.count_reachable()
+        row = await self.broadcasts.create(text, admin_chat_id, total)
+        await self.jobs.enqueue("broadcast", {"id": row["id"]})
+        return row
+
+    async def cancel(self, broadcast_id: int):
+        await self.broadcasts.finish(broadcast_id, "cancelled")
+
+    async def _run(self, payload: dict):
+        b = await self.broadcasts.get(payload["id"])
+        if b is None:
+            return
+        cursor = b["last_user_id"]
+        done = b["sent"] + b["failed"] + b["blocked"]
+        next_report = (done // self.progress_every + 1) * self.progress_every
+        while True:
+            b = await self.broadcasts.get(b["id"])
+            if b["status"] != "running":
+                return
+            page = await self.users.reachable_page(cursor, self.page_size)
+            if not page:
+                break
+            # The page goes out concurrently; the notifier's buckets set the pace
+            results = await asyncio.gather(
+                *(self.notifier.deliver(u["telegram_id"], b["text"], parse_mode="HTML") for u in page),
+                return_exceptions=True,
+            )
+            blocked = [u["telegram_id"] for u, r in zip(page, results) if r == "forbidden"]
+            sent = sum(1 for r in results if r == "sent")
+            failed = len(page) - sent - len(blocked)
+            cursor = page[-1]["id"]
+            async with self.broadcasts.db.transaction():
+                await self.users.mark_blocked(blocked)
+                await self.broadcasts.advance(b["id"], cursor, sent, failed, len(blocked))
+            done += len(page)
+            if done >= next_report:
+                next_report += self.progress_every
+                await self._report(b["id"], "⏳ Рассылка")
+        await self.broadcasts.finish(b["id"], "done")
+        await self._report(b["id"], "✅ Рассылка завершена")
+
+    async def _report(self, broadcast_id: int, title: str):
+        b = await self.broadcasts.get(broadcast_id)
+        if not b or not b["admin_chat_id"]:
+            return
+        try:
+            await self.notifier.send(b["admin_chat_id"], f"{title} #{b['id']}\n{progress_line(b)}")
+        except Exception:
+            pass
+
+
+def progress_line(b) -> str:
+    done = b["sent"] + b["failed"] + b["blocked"]
+    return (
+        f"{done}/{b['total']} • доставлено: {b['sent']} • "
+        f"заблокировали бота: {b['blocked']} • ошибок: {b['failed']}"
+    )
@@ -0,0 +1,67 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    # Bounded LRU mapping with per-entry expiry; counts hits/misses for diagnostics.
+    # on_evict(key, value) runs whenever an entry leaves (LRU, expiry, pop, clear).
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0, on_evict=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict = OrderedDict()
+        self._on_evict = on_evict
+
+    def _evicted(self, key, value):
+        if self._on_evict is not None:
+            self._on_evict(key, value)
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None:
+            self.misses += 1
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self._evicted(key, value)
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            evicted_key, (_, evicted) = self._data.popitem(last=False)
+            self._evicted(evicted_key, evicted)
+
+    def pop(self, key, default=None):
+        item = self._data.pop(key, None)
+        if item is None:
+            return default
+        self._evicted(key, item[1])
+        return item[1]
+
+    def clear(self):
+        items, self._data = self._data, OrderedDict()
+        for key, (_, value) in items.items():
+            self._evicted(key, value)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,177 @@
+import asyncio
+import csv
+import io
+import json
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING
+
+from aiogram import types
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+if TYPE_CHECKING:
+    from .models import Tariffs
+
+# (substrings of the lowercased location name, flag); first match wins
+LOCATION_FLAGS = [
+    (("рос",), "🇷🇺"),
+    (("сша", "usa"), "🇺🇸"),
+    (("сингап", "singap"), "🇸🇬"),
+    (("фин", "finland"), "🇫🇮"),
+    (("гер", "germ"), "🇩🇪"),
+    (("франц", "france"), "🇫🇷"),
+    (("нидер", "neder", "nether"), "🇳🇱"),
+    (("болгар", "bulgar"), "🇧🇬"),
+    (("испан", "spain"), "🇪🇸"),
+]
+
+
+def location_flag(location: str) -> str:
+    low = location.lower()
+    for keys, flag in LOCATION_FLAGS:
+        if any(k in low for k in keys):
+            return flag
+    return "📍"
+
+
+def apply_markup(price_rub: float, markup_percent: float) -> int:
+    # Return integer RUB price with markup applied
+    try:
+        return int(round(price_rub * (1.0 + (markup_percent or 0) / 100.0)))
+    except Exception:
+        return int(round(price_rub))
+
+
+def parse_price_list(data: bytes, filename: str = "") -> list[tuple[str, str, float]]:
+    # Supplier price list: JSON [{"location", "specs", "price"}, ...] or [[location, specs, price], ...],
+    # otherwise CSV with location, specs, price columns (",", ";", tab or "|", optional header).
+    # Any bad row rejects the whole file; the ValueError names the row and the reason.
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError as e:
+        raise ValueError(f"file is not UTF-8 text (byte {e.start})")
+    is_json = filename.lower().endswith(".json") or text.lstrip().startswith("[")
+    if is_json:
+        raw = json.loads(text)
+        if not isinstance(raw, list):
+            raise ValueError("JSON price list must be an array")
+        rows = []
+        for n, r in enumerate(raw, 1):
+            if isinstance(r, dict):
+                missing = [k for k in ("location", "specs", "price") if k not in r]
+                if missing:
+                    raise ValueError(f"row {n}: missing {', '.join(missing)}")
+                rows.append((r["location"], r["specs"], r["price"]))
+            elif isinstance(r, list):
+                rows.append(tuple(r))
+            else:
+                raise ValueError(f"row {n}: expected an object or [location, specs, price], got {type(r).__name__}")
+    else:
+        try:
+            dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t|")
+        except csv.Error:
+            dialect = csv.excel
+        rows = [tuple(r) for r in csv.reader(io.StringIO(text), dialect) if any(c.strip() for c in r)]
+    items = []
+    for n, row in enumerate(rows, 1):
+        if len(row) != 3:
+            raise ValueError(f"row {n}: expected location, specs, price")
+        location, specs, price = (str(v).strip() if v is not None else "" for v in row)
+        try:
+            price_val = float(price.replace(",", "."))
+        except ValueError:
+            if n == 1 and not is_json:
+                continue  # CSV header
+            raise ValueError(f"row {n}: bad price {price!r}")
+        if not location or not specs or price_val <= 0:
+            raise ValueError(f"row {n}: empty location/specs or non-positive price")
+        items.append((location, specs, price_val))
+    return items
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    locations: list[str] = field(default_factory=list)
+    # location -> tariff rows (cheapest first), each with "price_marked" added
+    tariffs_by_location: dict[str, list[dict]] = field(default_factory=dict)
+    locations_markup: types.InlineKeyboardMarkup | None = None
+    back_markup: types.InlineKeyboardMarkup | None = None
+    location_markups: dict[str, types.InlineKeyboardMarkup] = field(default_factory=dict)
+
+
+class Catalog:
+    # Immutable in-memory view of the tariff catalog with prebuilt keyboards.
+    # Readers never touch the DB; rebuild() swaps in a new snapshot atomically.
+    def __init__(self, tariffs: "Tariffs", markup_percent: float = 0):
+        self._tariffs = tariffs
+        self._markup_percent = markup_percent
+        self._snapshot = CatalogSnapshot()
+        self._lock = asyncio.Lock()
+        self._refresh_task: asyncio.Task | None = None
+
+    @property
+    def snapshot(self) -> CatalogSnapshot:
+        return self._snapshot
+
+    def price(self, price_rub: float) -> int:
+        return apply_markup(price_rub, self._markup_percent)
+
+    def start_refresh(self, interval: float):
+        # Other processes change tariffs too (worker mode); pick their changes up periodically
+        async def loop():
+            while True:
+                await asyncio.sleep(interval)
+                try:
+                    await self.rebuild()
+                except Exception as e:
+                    print(f"Catalog refresh failed: {e}")
+
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(loop())
+
+    async def close(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+    async def rebuild(self) -> CatalogSnapshot:
+        async with self._lock:
+            # Rows come ordered by location, price; dicts keep that order
+            rows = await self._tariffs.all()
+            by_location: dict[str, list[dict]] = {}
+            for r in rows:
+                t = dict(r, price_marked=self.price(float(r["price"])))
+                by_location.setdefault(t["location"], []).append(t)
+            locations = list(by_location)
+
+            kb = InlineKeyboardBuilder()
+            for loc in locations:
+                kb.button(text=f"{location_flag(loc)} {loc}", callback_data=f"loc:{loc}")
+            kb.adjust(2)
+            back = InlineKeyboardBuilder()
+            for loc in locations:
+                back.button(text=loc, callback_data=f"loc:{loc}")
+            back.adjust(1)
+
+            location_markups = {}
+            for loc, ts in by_location.items():
+                lk = InlineKeyboardBuilder()
+                for t in ts:
+                    label_full = f"{t['price_marked']} RUB • {t['specs']}"
+                    label = (label_full[:60] + '…') if len(label_full) > 60 else label_full
+                    lk.button(text=label, callback_data=f"buy:{t['id']}")
+                lk.button(text="↩️ Назад", callback_data="back:catalog")
+                lk.adjust(1)
+                location_markups[loc] = lk.as_markup()
+
+            self._snapshot = CatalogSnapshot(
+                locations=locations,
+                tariffs_by_location=by_location,
+                locations_markup=kb.as_markup(),
+                back_markup=back.as_markup(),
+                location_markups=location_markups,
+            )
+            return self._snapshot
@@ -0,0 +1,245 @@
+import asyncio
+from dataclasses import dataclass
+
+from .catalog import Catalog
+from .cryptobot import CryptoBot
+from .db import Database
+from .models import Orders, Promocodes, Users
+
+
+class CheckoutError(Exception):
+    # Message is shown to the user as is
+    pass
+
+
+@dataclass(frozen=True)
+class Quote:
+    # Everything checkout needs, read in one query
+    user_id: int
+    tariff_id: int
+    location: str
+    specs: str
+    price: int  # RUB, markup applied
+    bonus_balance: int
+    promo_code: str | None = None
+    discount_percent: int = 0
+    min_amount: int = 0
+    promo_is_active: bool = False  # came from user_active_promocodes, cleared once used
+
+    @property
+    def promo_applies(self) -> bool:
+        return self.promo_code is not None and (self.min_amount <= 0 or self.price >= self.min_amount)
+
+    @property
+    def promo_discount(self) -> int:
+        return int(self.price * self.discount_percent / 100)
+
+
+@dataclass(frozen=True)
+class Placed:
+    order: dict
+    invoice: dict
+    discount: int
+    bonus: int
+    final_price: int
+    amount_usdt: float
+
+
+class CheckoutService:
+    # quote(): one joined read of tariff, user balance and promo.
+    # place(): the order ('pending') with its discount fields, the bonus debit (ledger entry)
+    # and the promo usage commit together or not at all; only then is the invoice created
+    # (network) and attached. A failed invoice or attach releases the reservation (and
+    # deletes the invoice), so no payable invoice is left without its order. Reservations
+    # of a process that died midway are released by the stale sweep (start_sweep).
+    def __init__(
+        self,
+        db: Database,
+        orders: Orders,
+        users: Users,
+        promos: Promocodes,
+        catalog: Catalog,
+        cryptobot: CryptoBot | None,
+        rub_usdt_rate: float = 0,
+    ):
+        self.db = db
+        self.orders = orders
+        self.users = users
+        self.promos = promos
+        self.catalog = catalog
+        self.cryptobot = cryptobot
+        self.rub_usdt_rate = rub_usdt_rate
+        self._sweep_task: asyncio.Task | None = None
+
+    async def quote(
+        self, user_id: int, tariff_id: int, promo_code: str | None = None, promo_id: int | None = None
+    ) -> Quote | None:
+        args = [tariff_id, user_id]
+        if promo_id:
+            # Promo picked from the catalogue by id, must still have uses left
+            args.append(promo_id)
+            promo_cols = "p.code as promo_code, p.discount_percent, p.min_amount, 0 as promo_is_active"
+            promo_join = (
+                "left join promocodes p on p.id=$3 and p.is_active=1 "
+                "and (p.max_uses=0 or p.used_count < p.max_uses)"
+            )
+        else:
+            promo_cols = "ap.promo_code, ap.discount_percent, ap.min_amount, 1 as promo_is_active"
+            promo_join = "left join user_active_promocodes ap on ap.user_id=u.id"
+            if promo_code:
+                args.append(promo_code)
+                promo_join += " and ap.promo_code=$3"
+        row = await self.db.fetchrow(
+            f"""
+            select t.id as tariff_id, t.location, t.specs, t.price, u.id as user_id, u.bonus_balance, {promo_cols}
+            from tariffs t
+            join users u on u.id=$2
+            {promo_join}
+            where t.id=$1
+            """,
+            *args,
+        )
+        if row is None:
+            return None
+        has_promo = row["promo_code"] is not None
+        return Quote(
+            user_id=row["user_id"],
+            tariff_id=row["tariff_id"],
+            location=row["location"],
+            specs=row["specs"],
+            price=self.catalog.price(float(row["price"])),
+            bonus_balance=int(row["bonus_balance"] or 0),
+            promo_code=row["promo_code"],
+            discount_percent=int(row["discount_percent"] or 0) if has_promo else 0,
+            min_amount=int(row["min_amount"] or 0) if has_promo else 0,
+            promo_is_active=has_promo and bool(row["promo_is_active"]),
+        )
+
+    async def amount_usdt(self, amount_rub: float) -> float:
+        # Live CryptoBot rate when available, RUB_USDT_RATE otherwise
+        if self.cryptobot:
+            try:
+                return max(0.01, round(await self.cryptobot.rub_to_usdt(amount_rub), 2))
+            except Exception:
+                pass
+        return max(0.01, round(amount_rub / self.rub_usdt_rate, 2)) if self.rub_usdt_rate else 1
+
+    async def place(self, quote: Quote, use_promo: bool = False, use_bonus: bool = False) -> Placed:
+        if use_promo and not quote.promo_applies:
+            raise CheckoutError("Промокод не применим к этому заказу")
+        discount = quote.promo_discount if use_promo else 0
+        bonus = min(quote.bonus_balance, quote.price - discount) if use_bonus else 0
+        if use_bonus and bonus <= 0:
+            raise CheckoutError("У вас нет бонусов для использования")
+        final_price = max(0, quote.price - discount - bonus)
+        amount_usdt = await self.amount_usdt(final_price)
+
+        if use_promo:
+            description = f"Order for tariff #{quote.tariff_id} with promo {quote.promo_code}"
+        elif use_bonus:
+            description = f"Order for tariff #{quote.tariff_id} (bonus used)"
+        else:
+            description = f"Order for tariff #{quote.tariff_id}"
+
+        async with self.db.transaction():
+            order = await self.orders.create(
+                quote.user_id,
+                quote.tariff_id,
+                None,
+                promo_code=quote.promo_code if use_promo else None,
+                discount_amount=discount + bonus,
+                final_price=final_price,
+                status="pending",
+            )
+            # The quote's balance may be stale (double tap, another checkout): the debit is conditional
+            if bonus and await self.users.debit_bonus(quote.user_id, bonus, "checkout", order["id"]) is None:
+                raise CheckoutError("Недостаточно бонусов на балансе")
+            if use_promo:
+                # Last use taken by a concurrent checkout: nothing of this order is kept
+                if not await self.promos.consume(quote.promo_code):
+                    raise CheckoutError("Промокод больше недоступен")
+                if quote.promo_is_active:
+                    await self.promos.clear_user_active(quote.user_id, quote.promo_code)
+
+        promo_code = quote.promo_code if use_promo else None
+        try:
+            invoice = await self.cryptobot.create_invoice(
+                asset="USDT",
+                amount=amount_usdt,
+                description=description,
+                payload={"tariffId": quote.tariff_id, "userId": quote.user_id},
+            )
+        except Exception as e:
+            print(f"Invoice for order {order['id']} failed: {e}")
+            await self._release(order["id"], quote.user_id, bonus, promo_code, quote)
+            raise CheckoutError("Не удалось создать счет, попробуйте позже")
+        try:
+            attached = await self.orders.attach_invoice(order["id"], invoice["invoice_id"])
+        except Exception as e:
+            print(f"Attaching invoice {invoice['invoice_id']} to order {order['id']} failed: {e}")
+            attached = None
+        if attached is None:
+            # The reservation was cancelled meanwhile (stale sweep, admin) or the update failed
+            await self._drop_invoice(invoice["invoice_id"], order["id"])
+            try:
+                await self._release(order["id"], quote.user_id, bonus, promo_code, quote)
+            except Exception as e:
+                print(f"Releasing order {order['id']} failed, the stale sweep will retry: {e}")
+            raise CheckoutError("Не удалось оформить заказ, попробуйте еще раз")
+        return Placed(attached, invoice, discount, bonus, final_price, amount_usdt)
+
+    async def _drop_invoice(self, invoice_id: int, order_id: int):
+        try:
+            await self.cryptobot.delete_invoice(invoice_id)
+        except Exception as e:
+            print(f"Invoice {invoice_id} has no order (order {order_id}) and could not be deleted, cancel it by hand: {e}")
+
+    async def _release(
+        self, order_id: int, user_id: int, bonus: int, promo_code: str | None, quote: Quote | None = None
+    ) -> bool:
+        # Undo a reservation: cancel the 'pending' order, refund the bonus, give back the promo use.
+        # The conditional cancel makes a second release (checkout and sweep racing) a no-op.
+        async with self.db.transaction():
+            if not await self.orders.cancel_pending(order_id):
+                return False
+            if bonus:
+                await self.users.credit_bonus(user_id, bonus, "checkout_refund", order_id)
+            if promo_code:
+                await self.promos.release(promo_code)
+                if quote is not None and quote.promo_is_active:
+                    await self.promos.set_user_active(
+                        user_id,
+                        {"code": quote.promo_code, "discount_percent": quote.discount_percent, "min_amount": quote.min_amount},
+                    )
+        return True
+
+    async def release_stale(self, max_age: float) -> int:
+        # Reservations left 'pending' by a process that died between reserving and attaching
+        released = 0
+        for row in await self.orders.stale_pending(max_age):
+            if await self._release(row["id"], row["user_id"], int(row["bonus"] or 0), row["promo_code"]):
+                released += 1
+        return released
+
+    def start_sweep(self, max_age: float, interval: float = 60.0):
+        async def loop():
+            while True:
+                try:
+                    released = await self.release_stale(max_age)
+                    if released:
+                        print(f"Released {released} stale checkout reservations")
+                except Exception as e:
+                    print(f"Checkout sweep failed: {e}")
+                await asyncio.sleep(interval)
+
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(loop())
+
+    async def close(self):
+        if self._sweep_task:
+            self._sweep_task.cancel()
+            try:
+                await self._sweep_task
+            except asyncio.CancelledError:
+                pass
+            self._sweep_task = None
@@ -13,6 +13,37 @@ class Settings:
     webhook_secret: str | None
     log_channel_id: int | None
     support_contact: str | None
+    user_cache_size: int = 10000
+    user_cache_ttl: float = 300.0
+    profile_cache_ttl: float = 30.0
+    rate_refresh_interval: float = 60.0
+    rate_max_staleness: float = 600.0
+    sqlite_profile: str = "balanced"
+    sqlite_group_commit_ms: float = 0.0
+    sqlite_group_commit_max_writes: int = 100
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_read_pool_size: int = 4
+    pg_pool_min_size: int = 1
+    pg_pool_max_size: int = 5
+    pg_statement_cache_size: int = 256
+    pg_command_timeout: float | None = None
+    pg_max_inactive_lifetime: float = 300.0
+    metrics_token: str | None = None
+    job_workers: int = 4
+    job_max_attempts: int = 5
+    job_lease: float = 60.0
+    checkout_pending_ttl: float = 600.0
+    notify_global_rate: float = 25.0
+    notify_per_chat_rate: float = 1.0
+    telegram_webhook_url: str | None = None
+    telegram_webhook_path: str = "/telegram-webhook"
+    telegram_webhook_secret: str | None = None
+    telegram_max_concurrency: int = 64
+    bot_role: str = "all"
+    worker_shards: int = 1
+    worker_shard: int = 0
+    update_queue_path: str = "updates.sqlite3"
+    catalog_refresh_interval: float = 10.0
 
 
 def load_settings() -> Settings:
@@ -39,6 +70,35 @@ def load_settings() -> Settings:
         log_channel_id=int(os.getenv("LOG_CHANNEL_ID")) if os.getenv("LOG_CHANNEL_ID") else None,
         # Default support contact can be overridden with SUPPORT_CONTACT env var
         support_contact=os.getenv("SUPPORT_CONTACT", "@jdkfkdsk"),
+        user_cache_size=int(os.getenv("USER_CACHE_SIZE", "10000")),
+        user_cache_ttl=float(os.getenv("USER_CACHE_TTL", "300")),
+        profile_cache_ttl=float(os.getenv("PROFILE_CACHE_TTL", "30")),
+        rate_refresh_interval=float(os.getenv("RATE_REFRESH_INTERVAL", "60")),
+        rate_max_staleness=float(os.getenv("RATE_MAX_STALENESS", "600")),
+        sqlite_profile=os.getenv("SQLITE_PROFILE", "balanced"),
+        sqlite_group_commit_ms=float(os.getenv("SQLITE_GROUP_COMMIT_MS", "0")),
+        sqlite_group_commit_max_writes=int(os.getenv("SQLITE_GROUP_COMMIT_MAX_WRITES", "100")),
+        sqlite_busy_timeout_ms=int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+        sqlite_read_pool_size=int(os.getenv("SQLITE_READ_POOL_SIZE", "4")),
+        pg_pool_min_size=int(os.getenv("PG_POOL_MIN_SIZE", "1")),
+        pg_pool_max_size=int(os.getenv("PG_POOL_MAX_SIZE", "5")),
+        pg_statement_cache_size=int(os.getenv("PG_STATEMENT_CACHE_SIZE", "256")),
+        pg_command_timeout=float(os.getenv("PG_COMMAND_TIMEOUT")) if os.getenv("PG_COMMAND_TIMEOUT") else None,
+        pg_max_inactive_lifetime=float(os.getenv("PG_MAX_INACTIVE_LIFETIME", "300")),
+        metrics_token=os.getenv("METRICS_TOKEN"),
+        job_workers=int(os.getenv("JOB_WORKERS", "4")),
+        job_max_attempts=int(os.getenv("JOB_MAX_ATTEMPTS", "5")),
+        job_lease=float(os.getenv("JOB_LEASE", "60")),
+        checkout_pending_ttl=float(os.getenv("CHECKOUT_PENDING_TTL", "600")),
+        notify_global_rate=float(os.getenv("NOTIFY_GLOBAL_RATE", "25")),
+        notify_per_chat_rate=float(os.getenv("NOTIFY_PER_CHAT_RATE", "1")),
+        telegram_webhook_url=os.getenv("TELEGRAM_WEBHOOK_URL") or None,
+        telegram_webhook_path=os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram-webhook"),
+        telegram_webhook_secret=os.getenv("TELEGRAM_WEBHOOK_SECRET") or None,
+        telegram_max_concurrency=int(os.getenv("TELEGRAM_MAX_CONCURRENCY", "64")),
+        bot_role=os.getenv("BOT_ROLE", "all"),
+        worker_shards=int(os.getenv("WORKER_SHARDS", "1")),
+        worker_shard=int(os.getenv("WORKER_SHARD", "0")),
+        update_queue_path=os.getenv("UPDATE_QUEUE_PATH", "updates.sqlite3"),
+        catalog_refresh_interval=float(os.getenv("CATALOG_REFRESH_INTERVAL", "10")),
     )
-
-
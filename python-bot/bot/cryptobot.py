@@ -1,78 +1,184 @@
+import asyncio
+import json
+import random
+import time
+
 import httpx
 
+try:
+    import h2  # noqa: F401  # enables HTTP/2 in httpx when installed
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
 
 class CryptoBot:
-    def __init__(self, token: str):
+    def __init__(
+        self,
+        token: str,
+        timeout: float = 20.0,
+        max_connections: int = 20,
+        max_keepalive: int = 10,
+        retries: int = 3,
+        backoff_base: float = 0.5,
+        fallback_rub_usdt_rate: float | None = None,
+        max_rate_staleness: float = 600.0,
+        transport: httpx.AsyncBaseTransport | None = None,
+    ):
         self._token = token
         self._base = "https://pay.crypt.bot/api"
+        self._timeout = timeout
+        self._retries = retries
+        self._backoff_base = backoff_base
+        # One long-lived client so calls reuse TCP/TLS connections
+        self._client = httpx.AsyncClient(
+            base_url=self._base,
+            headers={"Crypto-Pay-API-Token": token},
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+            timeout=timeout,
+            http2=_HTTP2,
+            transport=transport,  # httpx.MockTransport in tests
+        )
+        # Exchange-rate cache: (SOURCE, TARGET) -> rate, refreshed in the background
+        self._rates: dict[tuple[str, str], float] = {}
+        self._rates_at = 0.0
+        self._max_rate_staleness = max_rate_staleness
+        # RUB per USDT from Settings; used when live rates are missing or stale
+        self._fallback_rub_usdt_rate = fallback_rub_usdt_rate
+        self._refresh_task: asyncio.Task | None = None
 
-    async def create_invoice(self, asset: str, amount: float, description: str, payload: dict | None = None):
-        headers = {
-            "Content-Type": "application/json",
-            "Crypto-Pay-API-Token": self._token,
-        }
+    async def close(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+        await self._client.aclose()
+
+    def _backoff(self, attempt: int, response: httpx.Response | None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Full jitter: uniform in [0, base * 2^attempt]
+        return random.uniform(0, self._backoff_base * (2 ** attempt))
+
+    async def _call(
+        self,
+        method: str,
+        endpoint: str,
+        payload: dict | None = None,
+        timeout: float | None = None,
+        idempotent: bool = True,
+    ):
+        # Non-idempotent calls (createInvoice) are retried only when the request
+        # surely was not processed: 429 or a failed connect
+        retry_statuses = RETRY_STATUSES if idempotent else {429}
+        retry_errors = (httpx.TransportError,) if idempotent else (httpx.ConnectError, httpx.ConnectTimeout)
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = await self._client.request(
+                    method,
+                    f"/{endpoint}",
+                    json=payload,
+                    timeout=timeout if timeout is not None else self._timeout,
+                )
+                if response.status_code not in retry_statuses:
+                    response.raise_for_status()
+                    j = response.json()
+                    if not j.get("ok"):
+                        raise RuntimeError("CryptoBot API error")
+                    return j["result"]
+                if attempt >= self._retries:
+                    response.raise_for_status()
+            except retry_errors:
+                if attempt >= self._retries:
+                    raise
+            await asyncio.sleep(self._backoff(attempt, response))
+            attempt += 1
+
+    async def create_invoice(self, asset: str, amount: float, description: str, payload: dict | None = None, timeout: float | None = None):
         data = {
             "asset": asset,
             "amount": amount,
             "description": description,
-            "payload": payload and __import__("json").dumps(payload),
-        }
-        async with httpx.AsyncClient() as client:
-            r = await client.post(f"{self._base}/createInvoice", headers=headers, json=data, timeout=20)
-            r.raise_for_status()
-            j = r.json()
-            if not j.get("ok"):
-                raise RuntimeError("CryptoBot API error")
-            return j["result"]
-
-    async def get_exchange_rates(self):
-        headers = {
-            "Crypto-Pay-API-Token": self._token,
+            "payload": payload and json.dumps(payload),
         }
-        async with httpx.AsyncClient() as client:
-            r = await client.get(f"{self._base}/getExchangeRates", headers=headers, timeout=20)
-            r.raise_for_status()
-            j = r.json()
-            if not j.get("ok"):
-                raise RuntimeError("CryptoBot API error")
-            return j["result"]
+        return await self._call("POST", "createInvoice", data, timeout=timeout, idempotent=False)
+
+    async def get_exchange_rates(self, timeout: float | None = None):
+        return await self._call("GET", "getExchangeRates", timeout=timeout)
+
+    async def refresh_rates(self):
+        rates: dict[tuple[str, str], float] = {}
+        for r in await self.get_exchange_rates():
+            source = str(r.get("source")).upper()
+            target = str(r.get("target")).upper()
+            try:
+                value = float(r.get("rate"))
+            except (TypeError, ValueError):
+                continue
+            if not value:
+                continue
+            rates[(source, target)] = value
+            # Inverse pairs never override a direct quote
+            rates.setdefault((target, source), 1.0 / value)
+        self._rates = rates
+        self._rates_at = time.monotonic()
+
+    def start_rate_refresh(self, interval: float = 60.0):
+        async def loop():
+            while True:
+                try:
+                    await self.refresh_rates()
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"CryptoBot rate refresh failed: {e}")
+                await asyncio.sleep(interval)
+
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(loop())
+
+    def rates_age(self) -> float | None:
+        return time.monotonic() - self._rates_at if self._rates_at else None
+
+    def rate(self, source: str, target: str) -> float | None:
+        age = self.rates_age()
+        if age is None or age > self._max_rate_staleness:
+            return None
+        return self._rates.get((source.upper(), target.upper()))
 
     async def rub_to_usdt(self, amount_rub: float) -> float:
-        rates = await self.get_exchange_rates()
-        # The API returns a list of {source, target, rate}
-        rate = None
-        for r in rates:
-            if str(r.get("source")).upper() == "RUB" and str(r.get("target")).upper() == "USDT":
-                rate = float(r.get("rate"))
-                break
+        rate = self.rate("RUB", "USDT")
+        if rate is None and self._fallback_rub_usdt_rate:
+            rate = 1.0 / self._fallback_rub_usdt_rate
         if rate is None:
-            # Fallback: try inverse path USDT->RUB
-            for r in rates:
-                if str(r.get("source")).upper() == "USDT" and str(r.get("target")).upper() == "RUB":
-                    inv = float(r.get("rate"))
-                    rate = 1.0 / inv if inv else None
-                    break
+            # No usable cache and no fallback configured: fetch inline once;
+            # with the API down, the last good rate beats no rate at all
+            try:
+                await self.refresh_rates()
+                rate = self.rate("RUB", "USDT")
+            except Exception as e:
+                print(f"CryptoBot rate refresh failed: {e}")
+                rate = self._rates.get(("RUB", "USDT"))
         if rate is None:
             raise RuntimeError("RUB→USDT rate not available")
         return amount_rub * rate
 
-    async def get_invoice(self, invoice_id: int):
-        headers = {
-            "Content-Type": "application/json",
-            "Crypto-Pay-API-Token": self._token,
-        }
-        async with httpx.AsyncClient() as client:
-            r = await client.post(
-                f"{self._base}/getInvoices",
-                headers=headers,
-                json={"invoice_ids": [invoice_id]},
-                timeout=20,
-            )
-            r.raise_for_status()
-            j = r.json()
-            if not j.get("ok"):
-                raise RuntimeError("CryptoBot API error")
-            items = j.get("result") or []
-            return items[0] if items else None
-
+    async def get_invoice(self, invoice_id: int, timeout: float | None = None):
+        items = await self._call("POST", "getInvoices", {"invoice_ids": [invoice_id]}, timeout=timeout) or []
+        return items[0] if items else None
 
+    async def delete_invoice(self, invoice_id: int, timeout: float | None = None):
+        # Withdraws an unpaid invoice so it can no longer be paid
+        return await self._call("POST", "deleteInvoice", {"invoice_id": invoice_id}, timeout=timeout, idempotent=False)
@@ -1,22 +1,115 @@
+import asyncio
 import os
 import re
+import sqlite3
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
 import asyncpg
 import aiosqlite
 
+from .metrics import Histogram
+from .migrations import EXPECTED_COLUMNS, MIGRATIONS, Migration
+
+
+# SQLite durability profiles: (journal_mode, synchronous)
+SQLITE_PROFILES = {
+    "durable": ("delete", "full"),
+    "balanced": ("wal", "normal"),
+    "fast": ("wal", "off"),
+}
+
+
+# datetime parameters are stored as text in the format of SQLite's datetime('now')
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+
+_PG_PARAM = re.compile(r"\$(\d+)")
+
+
+@lru_cache(maxsize=2048)
+def to_sqlite_params(query: str) -> str:
+    # $1, $2 ... -> ?1, ?2 ... (numbered, so reordered/repeated params bind correctly)
+    return _PG_PARAM.sub(r"?\1", query)
+
+
+def _sqlite_status(query: str, rowcount: int) -> str:
+    # Mimic asyncpg command tags ("UPDATE 3", "INSERT 0 1") so callers can treat both alike
+    verb = query.lstrip().split(None, 1)[0].upper() if query.strip() else ""
+    if verb == "INSERT":
+        return f"INSERT 0 {max(rowcount, 0)}"
+    return f"{verb} {max(rowcount, 0)}"
+
+
+def rows_affected(status: str | None) -> int:
+    try:
+        return int((status or "").rsplit(" ", 1)[-1])
+    except ValueError:
+        return 0
+
 
 class Database:
-    def __init__(self, dsn: str):
+    def __init__(
+        self,
+        dsn: str,
+        sqlite_profile: str = "balanced",
+        group_commit_ms: float = 0,
+        group_commit_max_writes: int = 100,
+        sqlite_busy_timeout_ms: int = 5000,
+        sqlite_read_pool_size: int = 4,
+        pg_min_size: int = 1,
+        pg_max_size: int = 5,
+        pg_statement_cache_size: int = 256,
+        pg_command_timeout: float | None = None,
+        pg_max_inactive_lifetime: float = 300.0,
+    ):
         self._dsn = dsn
         self._pool: asyncpg.Pool | None = None
+        self._pg_min_size = pg_min_size
+        self._pg_max_size = pg_max_size
+        # asyncpg's per-connection prepared statement LRU; 0 disables it (pgbouncer in transaction mode)
+        self._pg_statement_cache_size = pg_statement_cache_size
+        self._pg_command_timeout = pg_command_timeout
+        self._pg_max_inactive_lifetime = pg_max_inactive_lifetime
+        self._pg_acquired = 0
+        self._pg_acquire_wait = Histogram()
+        # SQLite: one writer connection plus a pool of read-only connections
         self._sqlite: aiosqlite.Connection | None = None
+        self._read_pool_size = sqlite_read_pool_size
+        self._readers: list[aiosqlite.Connection] = []
+        self._idle_readers: asyncio.Queue | None = None
+        if sqlite_profile not in SQLITE_PROFILES:
+            raise ValueError(f"Unknown SQLite profile: {sqlite_profile}")
+        self._sqlite_profile = sqlite_profile
+        # SQLite group commit: writes within this window share one commit (0 disables)
+        self._group_commit_window = group_commit_ms / 1000.0
+        # ...or as soon as this many writes are waiting, whichever comes first
+        self._group_commit_max_writes = max(1, group_commit_max_writes)
+        self._group_writes = 0
+        self._commit_future: asyncio.Future | None = None
+        self._commit_timer: asyncio.TimerHandle | None = None
+        # Other processes (or Database instances) on the same file wait this long for its lock
+        self._busy_timeout_ms = sqlite_busy_timeout_ms
+        self._write_lock = asyncio.Lock()
+        # Connection of the transaction() block the current task is in, if any
+        self._tx: ContextVar = ContextVar(f"db_tx_{id(self)}", default=None)
+        self._schema_ready = False
+        self._schema_version = 0
 
     def _is_sqlite(self) -> bool:
         return self._dsn.startswith("sqlite:///") or self._dsn.endswith(".db")
 
+    @property
+    def dialect(self) -> str:
+        return "sqlite" if self._is_sqlite() else "postgres"
+
     def _sqlite_path(self) -> str:
         # Resolve DSN to a filesystem path relative to project root (python-bot)
         if self._dsn.startswith("sqlite:///"):
-            raw = self._dsn[len("sqlite///"):]
+            raw = self._dsn[len("sqlite:///"):]
         elif self._dsn.startswith("sqlite://"):
             raw = self._dsn[len("sqlite://"):]
         else:
@@ -25,170 +118,340 @@ class Database:
         return raw if os.path.isabs(raw) else os.path.join(base_dir, raw)
 
     def _adapt_query(self, query: str):
-        # Convert $1, $2 ... to ? placeholders for sqlite
-        def repl(m):
-            return "?"
-
-        return re.sub(r"\$\d+", repl, query)
+        return to_sqlite_params(query)
 
     async def connect(self):
         if self._is_sqlite():
+            if sqlite3.sqlite_version_info < (3, 35, 0):
+                # Repositories rely on INSERT ... RETURNING
+                raise RuntimeError(f"SQLite >= 3.35 is required, found {sqlite3.sqlite_version}")
             path = self._sqlite_path()
             dir_name = os.path.dirname(path)
             if dir_name and not os.path.exists(dir_name):
                 os.makedirs(dir_name, exist_ok=True)
             self._sqlite = await aiosqlite.connect(path)
+            await self._sqlite.execute(f"PRAGMA busy_timeout = {int(self._busy_timeout_ms)};")
             await self._sqlite.execute("PRAGMA foreign_keys = ON;")
+            journal_mode, synchronous = SQLITE_PROFILES[self._sqlite_profile]
+            await self._sqlite.execute(f"PRAGMA journal_mode = {journal_mode};")
+            await self._sqlite.execute(f"PRAGMA synchronous = {synchronous};")
+            if self._read_pool_size > 0:
+                self._idle_readers = asyncio.Queue()
+                for _ in range(self._read_pool_size):
+                    reader = await aiosqlite.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+                    await reader.execute(f"PRAGMA busy_timeout = {int(self._busy_timeout_ms)};")
+                    self._readers.append(reader)
+                    self._idle_readers.put_nowait(reader)
         else:
-            self._pool = await asyncpg.create_pool(self._dsn, max_size=5)
+            self._pool = await asyncpg.create_pool(
+                self._dsn,
+                min_size=self._pg_min_size,
+                max_size=self._pg_max_size,
+                statement_cache_size=self._pg_statement_cache_size,
+                command_timeout=self._pg_command_timeout,
+                max_inactive_connection_lifetime=self._pg_max_inactive_lifetime,
+            )
 
     async def close(self):
         if self._sqlite:
+            if self._commit_future is not None or self._sqlite.in_transaction:
+                await self._flush_group_commit()
+            for reader in self._readers:
+                await reader.close()
             await self._sqlite.close()
         if self._pool:
             await self._pool.close()
 
+    @asynccontextmanager
+    async def _sqlite_reader(self):
+        # Reads inside transaction() must see its uncommitted writes, so they stay on the writer
+        if self._tx.get() is not None:
+            yield self._sqlite
+            return
+        if self._idle_readers is None:
+            # No reader pool: share the writer, but never in the middle of another task's transaction
+            async with self._write_lock:
+                yield self._sqlite
+            return
+        conn = await self._idle_readers.get()
+        try:
+            yield conn
+        finally:
+            self._idle_readers.put_nowait(conn)
+
     async def fetch(self, query: str, *args):
         if self._sqlite:
             q = self._adapt_query(query)
-            cur = await self._sqlite.execute(q, args)
-            cols = [c[0] for c in cur.description]
-            rows = await cur.fetchall()
+            async with self._sqlite_reader() as conn:
+                cur = await conn.execute(q, args)
+                cols = [c[0] for c in cur.description]
+                rows = await cur.fetchall()
             return [dict(zip(cols, r)) for r in rows]
-        assert self._pool is not None
-        async with self._pool.acquire() as conn:
+        async with self._pg_conn() as conn:
             recs = await conn.fetch(query, *args)
             return [dict(r) for r in recs]
 
     async def fetchrow(self, query: str, *args):
         if self._sqlite:
             q = self._adapt_query(query)
-            cur = await self._sqlite.execute(q, args)
-            row = await cur.fetchone()
+            async with self._sqlite_reader() as conn:
+                cur = await conn.execute(q, args)
+                row = await cur.fetchone()
+                await cur.close()
             if row is None:
                 return None
             cols = [c[0] for c in cur.description]
             return dict(zip(cols, row))
-        assert self._pool is not None
-        async with self._pool.acquire() as conn:
+        async with self._pg_conn() as conn:
             rec = await conn.fetchrow(query, *args)
             return dict(rec) if rec else None
 
     async def execute(self, query: str, *args):
         if self._sqlite:
             q = self._adapt_query(query)
-            await self._sqlite.execute(q, args)
-            await self._sqlite.commit()
-            return "OK"
-        assert self._pool is not None
-        async with self._pool.acquire() as conn:
+            cur = await self._sqlite_write(q, args)
+            return _sqlite_status(q, cur.rowcount)
+        async with self._pg_conn() as conn:
             return await conn.execute(query, *args)
 
-    async def ensure_schema(self):
+    async def execute_returning(self, query: str, *args):
+        # Single round trip for INSERT/UPDATE ... RETURNING; returns the first row
         if self._sqlite:
-            # Use executescript to run multiple SQL statements at once
-            await self._sqlite.executescript(
-                """
-                create table if not exists users (
-                  id integer primary key autoincrement,
-                  username text,
-                  telegram_id integer,
-                  role text default 'user',
-                  referrer_id integer,
-                  bonus_balance integer default 0,
-                  created_at text default (datetime('now'))
-                );
-                create table if not exists tariffs (
-                  id integer primary key autoincrement,
-                  location text not null,
-                  specs text not null,
-                  price real not null
-                );
-                create table if not exists orders (
-                  id integer primary key autoincrement,
-                  user_id integer references users(id) on delete set null,
-                  tariff_id integer references tariffs(id) on delete set null,
-                  status text default 'created',
-                  invoice_id integer,
-                  created_at text default (datetime('now'))
-                );
-                create table if not exists user_active_promocodes (
-                  id integer primary key autoincrement,
-                  user_id integer references users(id) on delete cascade,
-                  promo_code text not null,
-                  discount_percent integer not null,
-                  min_amount integer default 0,
-                  created_at text default (datetime('now'))
-                );
-                create table if not exists referral_rewards (
-                  id integer primary key autoincrement,
-                  referrer_id integer references users(id),
-                  referred_user_id integer references users(id),
-                  order_id integer references orders(id),
-                  reward_amount integer not null,
-                  created_at text default (datetime('now'))
-                );
-                create table if not exists promocodes (
-                  id integer primary key autoincrement,
-                  code text unique not null,
-                  discount_percent integer not null,
-                  min_amount integer default 0,
-                  max_uses integer default 0,
-                  used_count integer default 0,
-                  is_active integer default 1,
-                  created_at text default (datetime('now'))
-                );
-                create table if not exists settings (
-                  key text primary key,
-                  value text not null,
-                  updated_at text default (datetime('now'))
-                );
-                """
-            )
-            # Add referrer_id column if it doesn't exist (migration)
-            try:
-                await self._sqlite.execute("ALTER TABLE users ADD COLUMN referrer_id integer")
-            except:
-                pass  # Column already exists
-            # Add bonus_balance column if it doesn't exist (migration)
+            rows = []
+
+            async def consume(cur):
+                rows.extend(await cur.fetchall())
+
+            cur = await self._sqlite_write(self._adapt_query(query), args, consume)
+            if not rows:
+                return None
+            return dict(zip([c[0] for c in cur.description], rows[0]))
+        async with self._pg_conn() as conn:
+            rec = await conn.fetchrow(query, *args)
+            return dict(rec) if rec else None
+
+    async def executemany(self, query: str, args_list):
+        # One prepared statement for many parameter rows; no per-row commit
+        args_list = [tuple(a) for a in args_list]
+        if not args_list:
+            return
+        if self._sqlite:
+            q = self._adapt_query(query)
+            if self._tx.get() is not None:
+                await self._sqlite.executemany(q, args_list)
+                return
+            async with self._write_lock:
+                await self._sqlite.executemany(q, args_list)
+                if not self._group_commit_window:
+                    await self._sqlite.commit()
+                    return
+            await self._group_commit()
+            return
+        async with self._pg_conn() as conn:
+            await conn.executemany(query, args_list)
+
+    async def _sqlite_write(self, q: str, args: tuple, consume=None):
+        # RETURNING rows must be consumed before the statement can be committed
+        if self._tx.get() is not None:
+            # Inside transaction(): the block commits
+            cur = await self._sqlite.execute(q, args)
+            if consume:
+                await consume(cur)
+            return cur
+        async with self._write_lock:
+            cur = await self._sqlite.execute(q, args)
+            if consume:
+                await consume(cur)
+            if not self._group_commit_window:
+                await self._sqlite.commit()
+                return cur
+        await self._group_commit()
+        return cur
+
+    @asynccontextmanager
+    async def _pg_conn(self):
+        conn = self._tx.get()
+        if conn is not None:
+            yield conn
+            return
+        async with self._acquire_pg() as conn:
+            yield conn
+
+    @asynccontextmanager
+    async def _acquire_pg(self):
+        assert self._pool is not None
+        started = time.perf_counter()
+        async with self._pool.acquire() as conn:
+            self._pg_acquire_wait.observe(time.perf_counter() - started)
+            self._pg_acquired += 1
             try:
-                await self._sqlite.execute("ALTER TABLE users ADD COLUMN bonus_balance integer default 0")
-            except:
-                pass  # Column already exists
-            await self._sqlite.commit()
+                yield conn
+            finally:
+                self._pg_acquired -= 1
+
+    def pool_stats(self) -> dict:
+        if self._pool is None:
+            return {}
+        return {
+            "min_size": self._pool.get_min_size(),
+            "max_size": self._pool.get_max_size(),
+            "size": self._pool.get_size(),
+            "idle": self._pool.get_idle_size(),
+            "acquired": self._pg_acquired,
+            "acquire_wait": self._pg_acquire_wait,
+        }
+
+    def metrics(self) -> list:
+        stats = self.pool_stats()
+        if not stats:
+            return []
+        samples = [
+            (f"db_pool_{key}", {}, value)
+            for key, value in stats.items()
+            if key != "acquire_wait"
+        ]
+        samples.append(("db_pool_acquire_wait_seconds", {}, stats["acquire_wait"]))
+        return samples
+
+    async def _group_commit(self):
+        # Join the pending commit (or open one) and wait until it is durable
+        if self._commit_future is None:
+            loop = asyncio.get_running_loop()
+            self._commit_future = loop.create_future()
+            self._commit_timer = loop.call_later(
+                self._group_commit_window, lambda: asyncio.ensure_future(self._flush_group_commit())
+            )
+        fut = self._commit_future
+        self._group_writes += 1
+        if self._group_writes >= self._group_commit_max_writes:
+            await self._flush_group_commit()
+        await asyncio.shield(fut)
+
+    async def _flush_group_commit(self):
+        async with self._write_lock:
+            await self._commit_group()
+
+    async def _commit_group(self):
+        # Caller holds _write_lock
+        fut, self._commit_future = self._commit_future, None
+        if self._commit_timer is not None:
+            self._commit_timer.cancel()
+            self._commit_timer = None
+        self._group_writes = 0
+        try:
+            if self._sqlite.in_transaction:
+                await self._sqlite.commit()
+        except Exception as e:
+            await self._sqlite.rollback()
+            if fut is not None and not fut.done():
+                fut.set_exception(e)
+            return
+        if fut is not None and not fut.done():
+            fut.set_result(None)
+
+    @asynccontextmanager
+    async def transaction(self):
+        # Statements issued by this task inside the block commit (or roll back) together
+        if self._tx.get() is not None:
+            # Nested block joins the outer transaction
+            yield
+            return
+        if self._sqlite:
+            async with self._write_lock:
+                # Grouped writes still waiting for their commit go first, on their own
+                await self._commit_group()
+                # immediate: take the write lock up front. A deferred begin that reads first
+                # cannot upgrade while another connection writes and fails instead of waiting.
+                await self._sqlite.execute("begin immediate")
+                token = self._tx.set(self._sqlite)
+                try:
+                    yield
+                except BaseException:
+                    await self._sqlite.rollback()
+                    raise
+                else:
+                    await self._sqlite.commit()
+                finally:
+                    self._tx.reset(token)
             return
-        await self.execute(
-            """
-            create table if not exists users (
-              id serial primary key,
-              username varchar(255),
-              telegram_id bigint,
-              role varchar(32) default 'user',
-              created_at timestamp default now()
-            );
-            create table if not exists tariffs (
-              id serial primary key,
-              location varchar(64) not null,
-              specs varchar(255) not null,
-              price numeric not null
-            );
-            create table if not exists orders (
-              id serial primary key,
-              user_id int references users(id) on delete set null,
-              tariff_id int references tariffs(id) on delete set null,
-              status varchar(32) default 'created',
-              invoice_id bigint,
-              created_at timestamp default now()
-            );
-            create table if not exists user_active_promocodes (
-              id serial primary key,
-              user_id int references users(id) on delete cascade,
-              promo_code varchar(255) not null,
-              discount_percent integer not null,
-              min_amount integer default 0,
-              created_at timestamp default now()
-            );
-            """
+        async with self._acquire_pg() as conn:
+            async with conn.transaction():
+                token = self._tx.set(conn)
+                try:
+                    yield
+                finally:
+                    self._tx.reset(token)
+
+    async def _columns(self, table: str) -> set[str]:
+        if self._sqlite:
+            cur = await self._sqlite.execute(f"pragma table_info({table})")
+            return {r[1] for r in await cur.fetchall()}
+        rows = await self.fetch(
+            "select column_name from information_schema.columns where table_name=$1",
+            table,
         )
+        return {r["column_name"] for r in rows}
+
+    async def schema_version(self) -> int:
+        row = await self.fetchrow("select max(version) as v from schema_version")
+        return int(row["v"]) if row and row["v"] is not None else 0
+
+    async def _apply_migration(self, m: Migration):
+        existing = {t: await self._columns(t) for t in {c[0] for c in m.columns}}
+        async with self.transaction():
+            for table, column, sqlite_decl, pg_decl in m.columns:
+                if column not in existing[table]:
+                    decl = sqlite_decl if self._sqlite else pg_decl
+                    await self.execute(f"alter table {table} add column {column} {decl}")
+            for stmt in m.sqlite if self._sqlite else m.postgres:
+                await self.execute(stmt)
+            await self.execute("insert into schema_version(version, name) values($1, $2)", m.version, m.name)
 
+    async def ensure_schema(self, force: bool = False):
+        # Apply pending migrations in order; each one runs in its own transaction.
+        # Runs once per process: later calls return the cached version.
+        if self._schema_ready and not force:
+            return self._schema_version
+        if self._sqlite:
+            await self._sqlite.execute(
+                "create table if not exists schema_version ("
+                "version integer primary key, name text, applied_at text default (datetime('now')))"
+            )
+            await self._sqlite.commit()
+        else:
+            await self.execute(
+                "create table if not exists schema_version ("
+                "version integer primary key, name varchar(255), applied_at timestamp default now())"
+            )
+        current = await self.schema_version()
+        for m in sorted(MIGRATIONS, key=lambda m: m.version):
+            if m.version > current:
+                await self._apply_migration(m)
+        self._schema_version = await self.schema_version()
+        self._schema_ready = True
+        return self._schema_version
 
+    async def verify_schema(self):
+        # Startup self-check: one catalog query, fails fast on missing columns
+        if self._sqlite:
+            rows = await self.fetch(
+                "select m.name as table_name, p.name as column_name "
+                "from sqlite_master m join pragma_table_info(m.name) p "
+                "where m.type='table'"
+            )
+        else:
+            rows = await self.fetch(
+                "select table_name, column_name from information_schema.columns "
+                "where table_schema=current_schema()"
+            )
+        present: dict[str, set[str]] = {}
+        for r in rows:
+            present.setdefault(r["table_name"], set()).add(r["column_name"])
+        missing = [
+            f"{table}.{column}"
+            for table, columns in EXPECTED_COLUMNS.items()
+            for column in columns
+            if column not in present.get(table, set())
+        ]
+        if missing:
+            raise RuntimeError(f"Database schema is missing columns: {', '.join(missing)}")
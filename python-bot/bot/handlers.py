@@ -2,6 +2,16 @@ from aiogram import Router, types, F
 from aiogram.types import LinkPreviewOptions
 from aiogram.utils.keyboard import InlineKeyboardBuilder, ReplyKeyboardBuilder
 
+from .broadcast import progress_line
+from .catalog import location_flag, parse_price_list
+from .checkout import CheckoutError
+
+PRICE_LIST_MAX_BYTES = 1024 * 1024
+# Page sizes keep every list well under Telegram's 4096-character message limit
+MY_ORDERS_PAGE = 5
+ADMIN_PAID_PAGE = 20
+ADMIN_ALL_PAGE = 30
+
 
 def build_main_menu() -> types.ReplyKeyboardMarkup:
     kb = ReplyKeyboardBuilder()
@@ -16,29 +26,70 @@ def build_main_menu() -> types.ReplyKeyboardMarkup:
     return kb.as_markup(resize_keyboard=True, one_time_keyboard=False)
 
 
+def page_cursor(data: str) -> tuple[int | None, int | None]:
+    # "<prefix>", "<prefix>:next:<id>" or "<prefix>:prev:<id>" -> (after_id, before_id)
+    parts = data.rsplit(":", 2)
+    if len(parts) == 3 and parts[2].isdigit():
+        if parts[1] == "next":
+            return int(parts[2]), None
+        if parts[1] == "prev":
+            return None, int(parts[2])
+    return None, None
+
+
+def split_page(rows: list, limit: int, after_id, before_id) -> tuple[list, bool, bool]:
+    # rows were fetched with limit + 1: the extra row only tells that one more page exists
+    more = len(rows) > limit
+    if before_id is not None:
+        return rows[-limit:], more, True
+    return rows[:limit], after_id is not None, more
+
+
+async def fetch_page(fetch, limit: int, after_id, before_id) -> tuple[list, bool, bool]:
+    # One keyset query per page; a cursor that points past the data (orders changed
+    # status or were removed since the button was drawn) falls back to the first page
+    rows = await fetch(after_id=after_id, before_id=before_id, limit=limit + 1)
+    if not rows and (after_id or before_id):
+        after_id = before_id = None
+        rows = await fetch(after_id=None, before_id=None, limit=limit + 1)
+    return split_page(rows, limit, after_id, before_id)
+
+
+def add_page_nav(kb: InlineKeyboardBuilder, prefix: str, rows: list, has_prev: bool, has_next: bool):
+    nav = []
+    if rows and has_prev:
+        nav.append(types.InlineKeyboardButton(text="⬅️ Новее", callback_data=f"{prefix}:prev:{rows[0]['id']}"))
+    if rows and has_next:
+        nav.append(types.InlineKeyboardButton(text="Старее ➡️", callback_data=f"{prefix}:next:{rows[-1]['id']}"))
+    if nav:
+        kb.row(*nav)
+
+
 def setup_handlers(router: Router, services):
     db = services["db"]
     tariffs = services["tariffs"]
     users = services["users"]
     orders = services["orders"]
+    stats = services["stats"]
+    profiles = services["profiles"]
+    checkout = services["checkout"]
+    promos = services["promocodes"]
+    referrals = services["referrals"]
+    app_settings = services["settings"]
+    catalog_snapshot = services["catalog"]
     cryptobot = services["cryptobot"]
-    rub_usdt_rate: float = services.get("rub_usdt_rate", 0)
-    price_markup_percent: float = services.get("price_markup_percent", 0)
+    notifier = services["notifier"]
+    broadcaster = services["broadcaster"]
+    broadcasts = broadcaster.broadcasts
     admin_ids = services["admin_ids"]
     log_channel_id = services.get("log_channel_id")
     support_contact = services.get("support_contact") or "@your_admin"
 
     def apply_markup(price_rub: float) -> int:
-        # Return integer RUB price with markup applied
-        try:
-            return int(round(price_rub * (1.0 + (price_markup_percent or 0) / 100.0)))
-        except Exception:
-            return int(round(price_rub))
+        return catalog_snapshot.price(price_rub)
 
     @router.message(F.text.startswith("/start"))
     async def start_cmd(msg: types.Message):
-        await db.ensure_schema()
-        
         # Проверяем реферальную ссылку
         ref_id = None
         if msg.text.startswith("/start ref"):
@@ -49,20 +100,19 @@ def setup_handlers(router: Router, services):
         
         # Создаем или обновляем пользователя
         user = await users.upsert(msg.from_user.username, msg.from_user.id)
+        if user.get("is_blocked"):
+            # Пользователь снова написал боту — возвращаем его в рассылки
+            await users.set_blocked(user["id"], False)
         
         # Если это реферальная регистрация
         if ref_id and ref_id != user["id"]:
-            # Проверяем, что пользователь еще не имеет реферера
-            current_user = await db.fetchrow("select referrer_id from users where id=?", user["id"])
-            if not current_user or not current_user["referrer_id"]:
-                # Устанавливаем реферера
-                await db.execute("update users set referrer_id=? where id=?", ref_id, user["id"])
-                
+            # Устанавливаем реферера, только если его еще нет (повторно проверяется в самом UPDATE)
+            if not user.get("referrer_id") and await users.set_referrer(user["id"], ref_id):
                 # Отправляем уведомление рефереру
                 try:
-                    ref_user = await db.fetchrow("select telegram_id from users where id=?", ref_id)
+                    ref_user = await db.fetchrow("select telegram_id from users where id=$1", ref_id)
                     if ref_user:
-                        await msg.bot.send_message(
+                        await notifier.send(
                             ref_user["telegram_id"],
                             f"🎉 <b>Новый реферал!</b>\n\n"
                             f"👤 Пользователь @{msg.from_user.username or msg.from_user.id} "
@@ -95,14 +145,10 @@ def setup_handlers(router: Router, services):
         user = await users.upsert(msg.from_user.username, msg.from_user.id)
         
         # Проверяем активный промокод пользователя
-        active_promo = await db.fetchrow(
-            "select * from user_active_promocodes where user_id=?",
-            user["id"]
-        )
+        active_promo = await promos.user_active(user["id"])
         
-        locs = await tariffs.list_locations()
-        kb = InlineKeyboardBuilder()
-        if not locs:
+        snap = catalog_snapshot.snapshot
+        if not snap.locations:
             return await msg.answer(
                 "😔 <b>Каталог пуст</b>\n\n"
                 "📝 <i>Администратору необходимо выполнить команду /seed для загрузки тарифов</i>\n\n"
@@ -121,21 +167,6 @@ def setup_handlers(router: Router, services):
                 promo_info += f"📊 <b>Мин. сумма заказа:</b> {active_promo['min_amount']} RUB\n"
             promo_info += "\n"
         
-        for loc in locs:
-            low = loc.lower()
-            flag = (
-                "🇷🇺" if "рос" in low else
-                ("🇺🇸" if ("сша" in low or "usa" in low) else
-                 ("🇸🇬" if ("сингап" in low or "singap" in low) else
-                  ("🇫🇮" if ("фин" in low or "finland" in low) else
-                   ("🇩🇪" if ("гер" in low or "germ" in low) else
-                    ("🇫🇷" if ("франц" in low or "france" in low) else
-                     ("🇳🇱" if ("нидер" in low or "neder" in low or "nether" in low) else
-                      ("🇧🇬" if ("болгар" in low or "bulgar" in low) else
-                       ("🇪🇸" if ("испан" in low or "spain" in low) else "📍"))))))))
-            )
-            kb.button(text=f"{flag} {loc}", callback_data=f"loc:{loc}")
-        kb.adjust(2)
         
         message_text = "🌍 <b>Выберите страну для вашего сервера:</b>\n\n"
         if active_promo:
@@ -144,47 +175,34 @@ def setup_handlers(router: Router, services):
         
         await msg.answer(
             message_text,
-            reply_markup=kb.as_markup(),
+            reply_markup=snap.locations_markup,
             parse_mode="HTML"
         )
 
     @router.callback_query(F.data.startswith("loc:"))
     async def list_tariffs(cb: types.CallbackQuery):
         loc = cb.data.split(":", 1)[1]
-        ts = await tariffs.list_by_location(loc)
-        if not ts:
+        markup = catalog_snapshot.snapshot.location_markups.get(loc)
+        if markup is None:
             return await cb.message.edit_text(
                 f"😔 <b>Тарифы для {loc} не найдены</b>\n\n"
                 "📝 <i>Возможно, администратор еще не добавил тарифы для этой локации</i>\n\n"
                 "🔄 <i>Попробуйте выбрать другую страну или обратитесь в поддержку</i>",
                 parse_mode="HTML"
             )
-        kb = InlineKeyboardBuilder()
-        for t in ts:
-            price_marked = apply_markup(float(t['price']))
-            label_full = f"{price_marked} RUB • {t['specs']}"
-            label = (label_full[:60] + '…') if len(label_full) > 60 else label_full
-            kb.button(text=label, callback_data=f"buy:{t['id']}")
-        kb.button(text="↩️ Назад", callback_data="back:catalog")
-        kb.adjust(1)
         await cb.message.edit_text(
             f"🖥️ <b>Тарифы — {loc}</b> 🖥️\n\n"
             f"💻 <i>Выберите конфигурацию сервера:</i>",
-            reply_markup=kb.as_markup(),
+            reply_markup=markup,
             parse_mode="HTML",
         )
 
     @router.callback_query(F.data == "back:catalog")
     async def back_catalog(cb: types.CallbackQuery):
-        locs = await tariffs.list_locations()
-        kb = InlineKeyboardBuilder()
-        for loc in locs:
-            kb.button(text=loc, callback_data=f"loc:{loc}")
-        kb.adjust(1)
         await cb.message.edit_text(
             "🌍 <b>Выберите страну для вашего сервера:</b>\n\n"
             "💡 <i>Каждая локация оптимизирована для максимальной производительности</i>",
-            reply_markup=kb.as_markup(),
+            reply_markup=catalog_snapshot.snapshot.back_markup,
             parse_mode="HTML"
         )
 
@@ -193,19 +211,15 @@ def setup_handlers(router: Router, services):
         t_id = int(cb.data.split(":", 1)[1])
         user = await users.upsert(cb.from_user.username, cb.from_user.id)
         
-        # Convert RUB price to USDT (simple division by rate)
-        price_row = await db.fetchrow("select price from tariffs where id=$1", t_id)
-        price_rub = float(price_row["price"]) if price_row else 0.0
-        price_rub_marked = float(apply_markup(price_rub))
-        
-        # Получаем баланс бонусов пользователя
-        user_info = await db.fetchrow("select bonus_balance from users where id=?", user["id"])
-        bonus_balance = user_info['bonus_balance'] if user_info else 0
-        
-        # Проверяем активный промокод пользователя
-        active_promo = await db.fetchrow(
-            "select * from user_active_promocodes where user_id=?",
-            user["id"]
+        # Тариф, бонусный баланс и активный промокод — одним запросом
+        quote = await checkout.quote(user["id"], t_id)
+        if quote is None:
+            return await cb.answer("Тариф не найден")
+        price_rub_marked = quote.price
+        bonus_balance = quote.bonus_balance
+        active_promo = (
+            {"promo_code": quote.promo_code, "discount_percent": quote.discount_percent, "min_amount": quote.min_amount}
+            if quote.promo_code else None
         )
         
         # Создаем клавиатуру для выбора промокода и бонусов
@@ -235,7 +249,7 @@ def setup_handlers(router: Router, services):
                 return
             else:
                 # Применяем промокод автоматически
-                discount_amount = int(price_rub_marked * active_promo['discount_percent'] / 100)
+                discount_amount = quote.promo_discount
                 final_price = price_rub_marked - discount_amount
                 
                 kb_promo.button(text=f"💳 Оплатить со скидкой ({final_price} RUB)", callback_data=f"pay_promo:{t_id}:{active_promo['promo_code']}")
@@ -294,49 +308,16 @@ def setup_handlers(router: Router, services):
     async def use_bonus(cb: types.CallbackQuery):
         t_id = int(cb.data.split(":", 1)[1])
         user = await users.upsert(cb.from_user.username, cb.from_user.id)
+        quote = await checkout.quote(user["id"], t_id)
+        if quote is None:
+            return await cb.answer("Тариф не найден")
         
-        # Получаем баланс бонусов
-        user_info = await db.fetchrow("select bonus_balance from users where id=?", user["id"])
-        bonus_balance = user_info['bonus_balance'] if user_info else 0
-        
-        if bonus_balance <= 0:
-            await cb.answer("У вас нет бонусов для использования")
-            return
-        
-        # Получаем цену тарифа
-        price_row = await db.fetchrow("select price from tariffs where id=$1", t_id)
-        price_rub = float(price_row["price"]) if price_row else 0.0
-        price_rub_marked = float(apply_markup(price_rub))
-        
-        # Определяем сколько бонусов можно использовать
-        bonus_to_use = min(bonus_balance, price_rub_marked)
-        final_price = max(0, price_rub_marked - bonus_to_use)
-        
-        # Создаем заказ с использованием бонусов
-        invoice = await cryptobot.create_invoice(
-            asset="USDT", 
-            amount=max(0.01, round((final_price / rub_usdt_rate), 2)) if rub_usdt_rate else 1, 
-            description=f"Order for tariff #{t_id} (bonus used)", 
-            payload={"tariffId": t_id, "userId": user["id"]}
-        )
-        
-        order = await orders.create(
-            user_id=user["id"], 
-            tariff_id=t_id, 
-            invoice_id=invoice["invoice_id"]
-        )
-        
-        # Обновляем дополнительные поля
-        await db.execute(
-            "update orders set discount_amount=?, final_price=? where id=?",
-            int(bonus_to_use), int(final_price), order["id"]
-        )
-        
-        # Списываем использованные бонусы
-        await db.execute(
-            "update users set bonus_balance=bonus_balance-? where id=?",
-            bonus_to_use, user["id"]
-        )
+        # Заказ и списание бонусов фиксируются одной транзакцией
+        try:
+            placed = await checkout.place(quote, use_bonus=True)
+        except CheckoutError as e:
+            return await cb.answer(str(e))
+        order, invoice = placed.order, placed.invoice
         
         # Создаем клавиатуру оплаты
         kb_pay = InlineKeyboardBuilder()
@@ -349,11 +330,11 @@ def setup_handlers(router: Router, services):
             "🎉 <b>Счет создан с использованием бонусов!</b> 🎉\n"
             "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
             f"📦 <b>Тариф:</b> <code>#{t_id}</code>\n"
-            f"💰 <b>Исходная цена:</b> <code>{int(price_rub_marked)} RUB</code>\n"
-            f"🎁 <b>Использовано бонусов:</b> <code>{int(bonus_to_use)} RUB</code>\n"
-            f"💳 <b>Итоговая цена:</b> <code>{int(final_price)} RUB</code>\n"
+            f"💰 <b>Исходная цена:</b> <code>{quote.price} RUB</code>\n"
+            f"🎁 <b>Использовано бонусов:</b> <code>{placed.bonus} RUB</code>\n"
+            f"💳 <b>Итоговая цена:</b> <code>{placed.final_price} RUB</code>\n"
             f"🔗 <b>Счет:</b> <code>{invoice['invoice_id']}</code>\n"
-            f"💵 <b>К оплате:</b> <code>~ {max(0.01, round((final_price / rub_usdt_rate), 2)) if rub_usdt_rate else 1} USDT</code>\n\n"
+            f"💵 <b>К оплате:</b> <code>~ {placed.amount_usdt} USDT</code>\n\n"
             "💳 <i>Нажмите кнопку ниже для перехода к оплате</i>\n"
             "✅ <i>После оплаты нажмите \"Я оплатил\" для уведомления администратора</i>"
         )
@@ -372,67 +353,17 @@ def setup_handlers(router: Router, services):
         promo_code = parts[2]
         
         user = await users.upsert(cb.from_user.username, cb.from_user.id)
-        
-        # Получаем активный промокод пользователя
-        active_promo = await db.fetchrow(
-            "select * from user_active_promocodes where user_id=? and promo_code=?",
-            user["id"], promo_code
-        )
-        
-        if not active_promo:
+        quote = await checkout.quote(user["id"], t_id, promo_code=promo_code)
+        if quote is None or quote.promo_code is None:
             await cb.answer("Промокод не найден или недействителен")
             return
         
-        # Convert RUB price to USDT
-        price_row = await db.fetchrow("select price from tariffs where id=$1", t_id)
-        price_rub = float(price_row["price"]) if price_row else 0.0
-        price_rub_marked = float(apply_markup(price_rub))
-        
-        # Применяем промокод
-        discount_amount = int(price_rub_marked * active_promo['discount_percent'] / 100)
-        final_price = price_rub_marked - discount_amount
-        
-        # Prefer live rate from CryptoBot; fallback to env rate if provided
-        if cryptobot:
-            try:
-                amount_usdt_exact = await cryptobot.rub_to_usdt(final_price)
-                amount_usdt = max(0.01, round(amount_usdt_exact, 2))
-            except Exception:
-                amount_usdt = max(0.01, round((final_price / rub_usdt_rate), 2)) if rub_usdt_rate else 1
-        else:
-            amount_usdt = max(0.01, round((final_price / rub_usdt_rate), 2)) if rub_usdt_rate else 1
-        
-        # Создаем заказ
-        invoice = await cryptobot.create_invoice(
-            asset="USDT", 
-            amount=amount_usdt, 
-            description=f"Order for tariff #{t_id} with promo {promo_code}", 
-            payload={"tariffId": t_id, "userId": user["id"]}
-        )
-        
-        # Создаем заказ с базовыми полями
-        order = await orders.create(
-            user_id=user["id"], 
-            tariff_id=t_id, 
-            invoice_id=invoice["invoice_id"]
-        )
-        
-        # Обновляем дополнительные поля
-        await db.execute(
-            "update orders set promo_code=?, discount_amount=?, final_price=? where id=?",
-            promo_code, discount_amount, final_price, order["id"]
-        )
-        
-        # Удаляем активный промокод пользователя (так как он использован)
-        await db.execute(
-            "delete from user_active_promocodes where user_id=? and promo_code=?",
-            user["id"], promo_code
-        )
-        
-        # Увеличиваем счетчик использований промокода
-        promo_info = await db.fetchrow("select id from promocodes where code=?", promo_code)
-        if promo_info:
-            await db.execute("update promocodes set used_count=used_count+1 where id=?", promo_info["id"])
+        # Заказ, скидка и использование промокода фиксируются одной транзакцией
+        try:
+            placed = await checkout.place(quote, use_promo=True)
+        except CheckoutError as e:
+            return await cb.answer(str(e))
+        order, invoice = placed.order, placed.invoice
         
         # Создаем клавиатуру оплаты
         kb_pay = InlineKeyboardBuilder()
@@ -445,11 +376,11 @@ def setup_handlers(router: Router, services):
             "🎉 <b>Счет успешно создан!</b> 🎉\n"
             "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
             f"📦 <b>Тариф:</b> <code>#{t_id}</code>\n"
-            f"💰 <b>Исходная цена:</b> <code>{int(price_rub_marked)} RUB</code>\n"
+            f"💰 <b>Исходная цена:</b> <code>{quote.price} RUB</code>\n"
             f"🎁 <b>Промокод:</b> <code>{promo_code}</code>\n"
-            f"💸 <b>Скидка:</b> <code>{discount_amount} RUB</code>\n"
-            f"💳 <b>Итоговая цена:</b> <code>{int(final_price)} RUB</code>\n"
-            f"💎 <b>К оплате:</b> <code>{amount_usdt} USDT</code>\n\n"
+            f"💸 <b>Скидка:</b> <code>{placed.discount} RUB</code>\n"
+            f"💳 <b>Итоговая цена:</b> <code>{placed.final_price} RUB</code>\n"
+            f"💎 <b>К оплате:</b> <code>{placed.amount_usdt} USDT</code>\n\n"
             "🔗 <i>Нажмите кнопку ниже для оплаты</i>"
         )
         
@@ -466,76 +397,16 @@ def setup_handlers(router: Router, services):
         promo_id = int(parts[2]) if len(parts) > 2 else 0
         
         user = await users.upsert(cb.from_user.username, cb.from_user.id)
+        quote = await checkout.quote(user["id"], t_id, promo_id=promo_id or None)
+        if quote is None:
+            return await cb.answer("Тариф не найден")
         
-        # Convert RUB price to USDT
-        price_row = await db.fetchrow("select price from tariffs where id=$1", t_id)
-        price_rub = float(price_row["price"]) if price_row else 0.0
-        price_rub_marked = float(apply_markup(price_rub))
-        
-        # Применяем промокод если есть
-        discount_amount = 0
-        final_price = price_rub_marked
-        promo_code = None
-        
-        if promo_id > 0:
-            promo = await db.fetchrow("select * from promocodes where id=? and is_active=1", promo_id)
-            if promo and promo['used_count'] < promo['max_uses']:
-                if price_rub_marked >= promo['min_amount']:
-                    discount_amount = int(price_rub_marked * promo['discount_percent'] / 100)
-                    final_price = price_rub_marked - discount_amount
-                    promo_code = promo['code']
-                    
-                    # Увеличиваем счетчик использований
-                    await db.execute("update promocodes set used_count=used_count+1 where id=?", promo_id)
-        
-        # Prefer live rate from CryptoBot; fallback to env rate if provided
-        if cryptobot:
-            try:
-                amount_usdt_exact = await cryptobot.rub_to_usdt(final_price)
-                amount_usdt = max(0.01, round(amount_usdt_exact, 2))
-            except Exception:
-                amount_usdt = max(0.01, round((final_price / rub_usdt_rate), 2)) if rub_usdt_rate else 1
-        else:
-            amount_usdt = max(0.01, round((final_price / rub_usdt_rate), 2)) if rub_usdt_rate else 1
-        
-        # Создаем заказ
-        order_data = {
-            "user_id": user["id"],
-            "tariff_id": t_id,
-            "promo_code": promo_code,
-            "discount_amount": discount_amount,
-            "original_price": price_rub_marked,
-            "final_price": final_price
-        }
-        
-        invoice = await cryptobot.create_invoice(
-            asset="USDT", 
-            amount=amount_usdt, 
-            description=f"Order for tariff #{t_id}", 
-            payload={"tariffId": t_id, "userId": user["id"]}
-        )
-        
-        # Создаем заказ с базовыми полями
-        order = await orders.create(
-            user_id=user["id"], 
-            tariff_id=t_id, 
-            invoice_id=invoice["invoice_id"]
-        )
-        
-        # Обновляем дополнительные поля если есть
-        if promo_code or discount_amount > 0:
-            update_fields = []
-            update_values = []
-            if promo_code:
-                update_fields.append("promo_code=?")
-                update_values.append(promo_code)
-            if discount_amount > 0:
-                update_fields.append("discount_amount=?")
-                update_values.append(discount_amount)
-            
-            if update_fields:
-                update_values.append(order["id"])
-                await db.execute(f"update orders set {', '.join(update_fields)} where id=?", *update_values)
+        # Промокод из каталога (по id) применяется, только если подходит по сумме
+        try:
+            placed = await checkout.place(quote, use_promo=promo_id > 0 and quote.promo_applies)
+        except CheckoutError as e:
+            return await cb.answer(str(e))
+        order, invoice = placed.order, placed.invoice
         
         # Создаем клавиатуру оплаты
         kb_pay = InlineKeyboardBuilder()
@@ -548,19 +419,19 @@ def setup_handlers(router: Router, services):
             "🎉 <b>Счет успешно создан!</b> 🎉\n"
             "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
             f"📦 <b>Тариф:</b> <code>#{t_id}</code>\n"
-            f"💰 <b>Исходная цена:</b> <code>{int(price_rub_marked)} RUB</code>\n"
+            f"💰 <b>Исходная цена:</b> <code>{quote.price} RUB</code>\n"
         )
         
-        if discount_amount > 0:
+        if placed.discount > 0:
             message_text += (
-                f"🎁 <b>Промокод:</b> <code>{promo_code}</code>\n"
-                f"💸 <b>Скидка:</b> <code>{discount_amount} RUB</code>\n"
-                f"💳 <b>Итоговая цена:</b> <code>{int(final_price)} RUB</code>\n"
+                f"🎁 <b>Промокод:</b> <code>{quote.promo_code}</code>\n"
+                f"💸 <b>Скидка:</b> <code>{placed.discount} RUB</code>\n"
+                f"💳 <b>Итоговая цена:</b> <code>{placed.final_price} RUB</code>\n"
             )
         
         message_text += (
             f"🔗 <b>Счет:</b> <code>{invoice['invoice_id']}</code>\n"
-            f"💵 <b>К оплате:</b> <code>~ {amount_usdt} USDT</code>\n\n"
+            f"💵 <b>К оплате:</b> <code>~ {placed.amount_usdt} USDT</code>\n\n"
             "💳 <i>Нажмите кнопку ниже для перехода к оплате</i>\n"
             "✅ <i>После оплаты нажмите \"Я оплатил\" для уведомления администратора</i>"
         )
@@ -575,22 +446,40 @@ def setup_handlers(router: Router, services):
     @router.message(F.text == "📦 Мои заказы")
     async def my_orders(msg: types.Message):
         user = await users.upsert(msg.from_user.username, msg.from_user.id)
-        os = await orders.by_user(user["id"])
-        if not os:
-            return await msg.answer(
+        text, markup = await render_my_orders(user["id"], None, None)
+        await msg.answer(text, reply_markup=markup, parse_mode="HTML")
+
+    @router.callback_query(F.data.startswith("myorders"))
+    async def my_orders_page(cb: types.CallbackQuery):
+        user = await users.upsert(cb.from_user.username, cb.from_user.id)
+        after_id, before_id = page_cursor(cb.data)
+        text, markup = await render_my_orders(user["id"], after_id, before_id)
+        await cb.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+        await cb.answer()
+
+    async def render_my_orders(user_id: int, after_id, before_id):
+        # Одна страница — один запрос по индексу (user_id, id)
+        rows, has_prev, has_next = await fetch_page(
+            lambda **cursor: orders.by_user(user_id, **cursor), MY_ORDERS_PAGE, after_id, before_id
+        )
+        if not rows:
+            return (
                 "📦 <b>Мои заказы</b>\n\n"
                 "😔 У вас пока нет заказов.\n\n"
-                "🛒 <i>Перейдите в каталог, чтобы сделать первый заказ!</i>",
-                parse_mode="HTML"
-            )
+                "🛒 <i>Перейдите в каталог, чтобы сделать первый заказ!</i>"
+            ), None
+        kb = InlineKeyboardBuilder()
+        add_page_nav(kb, "myorders", rows, has_prev, has_next)
         
         lines = []
-        for o in os:
+        for o in rows:
             price_marked = apply_markup(float(o['price']))
             status_emoji = {
+                "pending": "🕓",
                 "created": "⏳",
                 "paid": "✅", 
-                "delivered": "🎉"
+                "delivered": "🎉",
+                "cancelled": "❌",
             }.get(o['status'], "❓")
             
             lines.append(
@@ -602,10 +491,7 @@ def setup_handlers(router: Router, services):
                 "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━"
             )
         
-        await msg.answer(
-            f"📦 <b>Мои заказы</b> 📦\n\n" + "\n\n".join(lines),
-            parse_mode="HTML"
-        )
+        return f"📦 <b>Мои заказы</b> 📦\n\n" + "\n\n".join(lines), kb.as_markup()
 
     @router.callback_query(F.data.startswith("paid:"))
     async def user_paid(cb: types.CallbackQuery):
@@ -614,7 +500,7 @@ def setup_handlers(router: Router, services):
         
         # Get order details
         order_row = await db.fetchrow(
-            "select o.*, t.location, t.specs, t.price from orders o left join tariffs t on t.id=o.tariff_id where o.id=?",
+            "select o.*, t.location, t.specs, t.price from orders o left join tariffs t on t.id=o.tariff_id where o.id=$1",
             order_id
         )
         
@@ -642,7 +528,8 @@ def setup_handlers(router: Router, services):
                 f"🔗 Пользователь утверждает, что оплатил"
             )
             try:
-                await cb.bot.send_message(log_channel_id, text, reply_markup=kb.as_markup())
+                if not await notifier.send(log_channel_id, text, reply_markup=kb.as_markup()):
+                    raise RuntimeError("log channel unavailable")
                 await cb.answer("✅ Заявка отправлена администратору")
             except Exception:
                 await cb.answer("❌ Ошибка отправки заявки")
@@ -654,9 +541,7 @@ def setup_handlers(router: Router, services):
         user = await users.upsert(msg.from_user.username, msg.from_user.id)
         
         # Получаем активные промокоды
-        active_promos = await db.fetch(
-            "select code, discount_percent, min_amount, max_uses, used_count from promocodes where is_active=true and (max_uses=0 or used_count < max_uses)"
-        )
+        active_promos = await promos.list_available()
         
         if not active_promos:
             await msg.answer(
@@ -690,12 +575,11 @@ def setup_handlers(router: Router, services):
         bot_info = await msg.bot.get_me()
         ref_link = f"https://t.me/{bot_info.username}?start=ref{user['id']}"
         
-        # Получаем статистику рефералов
-        ref_users = await db.fetch("select username, telegram_id, created_at from users where referrer_id=? order by created_at desc", user["id"])
-        
-        # Получаем награды за рефералов
-        ref_rewards = await db.fetchrow("select sum(reward_amount) as total from referral_rewards where referrer_id=?", user["id"])
-        total_rewards = ref_rewards['total'] if ref_rewards and ref_rewards['total'] else 0
+        # Получаем статистику рефералов (показываем только последних 10)
+        ref_users = await referrals.referred_users(user["id"], limit=10)
+        # Счетчики хранятся в users (ref_count, ref_rewards) — без подсчета по всей таблице
+        totals = await referrals.totals(user["id"])
+        ref_total, total_rewards = totals["count"], totals["rewards"]
         
         text = (
             f"👥 <b>Реферальная система</b> 👥\n\n"
@@ -706,13 +590,13 @@ def setup_handlers(router: Router, services):
         )
         
         if ref_users:
-            for i, ref_user in enumerate(ref_users[:10], 1):  # Показываем только первые 10
+            for i, ref_user in enumerate(ref_users, 1):
                 username = f"@{ref_user['username']}" if ref_user['username'] else f"ID: {ref_user['telegram_id']}"
                 date = ref_user['created_at'].strftime("%d.%m.%Y") if ref_user['created_at'] else "N/A"
                 text += f"{i}. {username} - {date}\n"
             
-            if len(ref_users) > 10:
-                text += f"... и еще {len(ref_users) - 10} пользователей\n"
+            if ref_total > len(ref_users):
+                text += f"... и еще {ref_total - len(ref_users)} пользователей\n"
         else:
             text += "😔 <i>Пока никто не присоединился по вашей ссылке</i>\n"
         
@@ -736,10 +620,7 @@ def setup_handlers(router: Router, services):
         user = await users.upsert(msg.from_user.username, msg.from_user.id)
         
         # Проверяем, есть ли активный промокод
-        promo = await db.fetchrow(
-            "select * from promocodes where code=? and is_active=1 and (max_uses=0 or used_count < max_uses)",
-            msg.text
-        )
+        promo = await promos.get_available(msg.text)
         
         if not promo:
             await msg.answer(
@@ -750,17 +631,8 @@ def setup_handlers(router: Router, services):
             )
             return
         
-        # Удаляем предыдущий активный промокод пользователя (если есть)
-        await db.execute(
-            "delete from user_active_promocodes where user_id=?",
-            user["id"]
-        )
-        
-        # Сохраняем новый активный промокод для пользователя
-        await db.execute(
-            "insert into user_active_promocodes (user_id, promo_code, discount_percent, min_amount) values (?, ?, ?, ?)",
-            user["id"], promo['code'], promo['discount_percent'], promo['min_amount']
-        )
+        # Заменяем предыдущий активный промокод пользователя (если есть) новым
+        await promos.set_user_active(user["id"], promo)
         
         # Проверяем минимальную сумму
         if promo['min_amount'] > 0:
@@ -786,10 +658,7 @@ def setup_handlers(router: Router, services):
         user = await users.upsert(msg.from_user.username, msg.from_user.id)
         
         # Удаляем активный промокод пользователя
-        result = await db.execute(
-            "delete from user_active_promocodes where user_id=?",
-            user["id"]
-        )
+        await promos.clear_user_active(user["id"])
         
         await msg.answer(
             "🗑️ <b>Промокод очищен!</b>\n\n"
@@ -801,19 +670,8 @@ def setup_handlers(router: Router, services):
     @router.message(F.text == "👤 Мой профиль")
     async def profile(msg: types.Message):
         user = await users.upsert(msg.from_user.username, msg.from_user.id)
-        os = await orders.by_user(user["id"])
-        total = len(os)
-        paid = sum(1 for o in os if o.get("status") == "paid")
-        delivered = sum(1 for o in os if o.get("status") == "delivered")
-        created = total - paid - delivered
-        
-        # Получаем реферальную статистику
-        ref_count = await db.fetchrow("select count(*) as c from users where referrer_id=?", user["id"])
-        ref_count = ref_count['c'] if ref_count else 0
-        
-        # Получаем баланс бонусов
-        bonus_balance = await db.fetchrow("select bonus_balance from users where id=?", user["id"])
-        bonus_balance = bonus_balance['bonus_balance'] if bonus_balance else 0
+        # Один агрегирующий запрос (с коротким кэшем) вместо выборки всех заказов
+        p = await profiles.get(user["id"])
         
         text = (
             f"👤 <b>Профиль пользователя</b> 👤\n"
@@ -821,12 +679,12 @@ def setup_handlers(router: Router, services):
             f"🆔 <b>ID:</b> <code>{msg.from_user.id}</code>\n"
             f"👤 <b>Username:</b> @{msg.from_user.username or '—'}\n\n"
             f"📊 <b>Статистика заказов:</b>\n"
-            f"⏳ <b>Ожидают оплаты:</b> <code>{created}</code>\n"
-            f"✅ <b>Оплачены:</b> <code>{paid}</code>\n"
-            f"🎉 <b>Выданы:</b> <code>{delivered}</code>\n"
-            f"📈 <b>Всего заказов:</b> <code>{total}</code>\n\n"
-            f"🎁 <b>Бонусный баланс:</b> <code>{bonus_balance}</code> RUB\n"
-            f"👥 <b>Приглашено друзей:</b> <code>{ref_count}</code>"
+            f"⏳ <b>Ожидают оплаты:</b> <code>{p['created']}</code>\n"
+            f"✅ <b>Оплачены:</b> <code>{p['paid']}</code>\n"
+            f"🎉 <b>Выданы:</b> <code>{p['delivered']}</code>\n"
+            f"📈 <b>Всего заказов:</b> <code>{p['total']}</code>\n\n"
+            f"🎁 <b>Бонусный баланс:</b> <code>{p['bonus_balance']}</code> RUB\n"
+            f"👥 <b>Приглашено друзей:</b> <code>{p['ref_count']}</code>"
         )
         await msg.answer(text, parse_mode="HTML")
 
@@ -900,27 +758,9 @@ def setup_handlers(router: Router, services):
             ("Испания", "6vCPU / 6144 MB RAM / SSD 100 Gb", 1759),
             ("Испания", "8vCPU / 8192 MB RAM / SSD 200 Gb", 2399),
         ]
-        added = 0
-        updated_count = 0
-        for loc, specs, price in preset:
-            # Try to find existing by location + specs, update price; else insert
-            existing = await db.fetchrow(
-                "select id, price from tariffs where location=$1 and specs=$2 limit 1",
-                loc,
-                specs,
-            )
-            if existing:
-                if float(existing["price"]) != float(price):
-                    await db.execute(
-                        "update tariffs set price=$1 where id=$2",
-                        float(price),
-                        existing["id"],
-                    )
-                    updated_count += 1
-            else:
-                await tariffs.create(loc, specs, float(price))
-                added += 1
-        await msg.answer(f"Готово. Добавлено: {added}, обновлено цен: {updated_count}")
+        result = await tariffs.bulk_upsert(preset)
+        await catalog_snapshot.rebuild()
+        await msg.answer(f"Готово. Добавлено: {result['added']}, обновлено цен: {result['updated']}")
     
     # Команда для добавления отдельного сервера
     @router.message(F.text.startswith("/add_server"))
@@ -942,14 +782,43 @@ def setup_handlers(router: Router, services):
             location, specs, price = [p.strip() for p in parts]
             price_float = float(price)
             
-            await tariffs.create(location, specs, price_float)
-            await msg.answer(f"✅ Сервер добавлен:\n{location} • {specs} • {price} RUB")
+            result = await tariffs.bulk_upsert([(location, specs, price_float)])
+            await catalog_snapshot.rebuild()
+            if result["added"]:
+                await msg.answer(f"✅ Сервер добавлен:\n{location} • {specs} • {price} RUB")
+            else:
+                await msg.answer(f"✅ Сервер уже есть, цена обновлена:\n{location} • {specs} • {price} RUB")
             
         except ValueError:
             await msg.answer("Ошибка: цена должна быть числом")
         except Exception as e:
             await msg.answer(f"Ошибка при добавлении: {e}")
     
+    # Импорт прайс-листа поставщика: документ CSV/JSON с подписью /import_prices
+    @router.message(F.document & F.caption.startswith("/import_prices"))
+    async def import_prices(msg: types.Message):
+        if msg.from_user.id not in admin_ids:
+            return await msg.answer("Недостаточно прав.")
+        if msg.document.file_size and msg.document.file_size > PRICE_LIST_MAX_BYTES:
+            return await msg.answer("Файл слишком большой (максимум 1 МБ).")
+        try:
+            data = await msg.bot.download(msg.document)
+            items = parse_price_list(data.read(), msg.document.file_name or "")
+        except ValueError as e:
+            return await msg.answer(
+                f"Ошибка в прайс-листе: {e}\n\n"
+                "Формат CSV: Локация;Характеристики;Цена (по строке на тариф)\n"
+                'Формат JSON: [{"location": "...", "specs": "...", "price": 650}, ...]'
+            )
+        if not items:
+            return await msg.answer("Прайс-лист пуст.")
+        result = await tariffs.bulk_upsert(items)
+        await catalog_snapshot.rebuild()
+        await msg.answer(
+            f"✅ Прайс-лист загружен ({len(items)} строк).\n"
+            f"Добавлено: {result['added']}, обновлено цен: {result['updated']}, без изменений: {result['unchanged']}"
+        )
+
     # Команда для инициализации новых таблиц
     @router.message(F.text == "/init_db")
     async def init_database(msg: types.Message):
@@ -957,91 +826,12 @@ def setup_handlers(router: Router, services):
             return await msg.answer("Недостаточно прав.")
         
         try:
-            # Создаем таблицу промокодов
-            await db.execute("""
-                create table if not exists promocodes (
-                    id integer primary key autoincrement,
-                    code text unique not null,
-                    discount_percent integer not null,
-                    min_amount integer default 0,
-                    max_uses integer default 0,
-                    used_count integer default 0,
-                    is_active integer default 1,
-                    created_at timestamp default current_timestamp
-                )
-            """)
-            
-            # Создаем таблицу реферальных наград
-            await db.execute("""
-                create table if not exists referral_rewards (
-                    id integer primary key autoincrement,
-                    referrer_id integer,
-                    referred_user_id integer,
-                    order_id integer,
-                    reward_amount integer not null,
-                    created_at timestamp default current_timestamp,
-                    foreign key (referrer_id) references users(id),
-                    foreign key (referred_user_id) references users(id),
-                    foreign key (order_id) references orders(id)
-                )
-            """)
-            
-            # Создаем таблицу настроек
-            await db.execute("""
-                create table if not exists settings (
-                    key text primary key,
-                    value text not null,
-                    updated_at timestamp default current_timestamp
-                )
-            """)
-            
-            # Проверяем и добавляем поля в таблицу users
-            try:
-                await db.execute("alter table users add column referrer_id integer")
-            except:
-                pass  # Поле уже существует
-            
-            try:
-                await db.execute("alter table users add column bonus_balance integer default 0")
-            except:
-                pass  # Поле уже существует
-            
-            # Проверяем и добавляем поля в таблицу orders
-            try:
-                await db.execute("alter table orders add column promo_code text")
-            except:
-                pass  # Поле уже существует
-            
-            try:
-                await db.execute("alter table orders add column discount_amount integer default 0")
-            except:
-                pass  # Поле уже существует
-            
-            try:
-                await db.execute("alter table orders add column final_price integer")
-            except:
-                pass  # Поле уже существует
-            
-            # Устанавливаем значение по умолчанию для реферальной награды
-            try:
-                await db.execute("insert into settings (key, value) values (?, ?)", ("referral_reward", "100"))
-            except:
-                pass  # Уже существует
-            
-            # Создаем таблицу активных промокодов пользователей
-            await db.execute("""
-                create table if not exists user_active_promocodes (
-                    id integer primary key autoincrement,
-                    user_id integer references users(id) on delete cascade,
-                    promo_code text not null,
-                    discount_percent integer not null,
-                    min_amount integer default 0,
-                    created_at timestamp default current_timestamp
-                )
-            """)
+            # Все таблицы, поля и индексы создаются версионированными миграциями
+            version = await db.ensure_schema(force=True)
             
             await msg.answer(
                 "✅ <b>База данных инициализирована!</b>\n\n"
+                f"🗂 <b>Версия схемы:</b> {version}\n\n"
                 "📊 <b>Созданы таблицы:</b>\n"
                 "• promocodes - для промокодов\n"
                 "• referral_rewards - для реферальных наград\n"
@@ -1083,15 +873,11 @@ def setup_handlers(router: Router, services):
             max_uses = int(parts[4])
             
             # Проверяем, не существует ли уже такой промокод
-            existing = await db.fetchrow("select 1 from promocodes where code=?", code)
-            if existing:
+            if await promos.exists(code):
                 return await msg.answer(f"❌ Промокод {code} уже существует!")
             
             # Создаем промокод
-            await db.execute(
-                "insert into promocodes (code, discount_percent, min_amount, max_uses, is_active) values (?, ?, ?, ?, 1)",
-                code, discount, min_amount, max_uses
-            )
+            await promos.create(code, discount, min_amount, max_uses)
             
             await msg.answer(
                 f"✅ <b>Промокод создан!</b>\n\n"
@@ -1117,9 +903,7 @@ def setup_handlers(router: Router, services):
         code = parts[1].upper()
         
         # Удаляем промокод
-        result = await db.execute("delete from promocodes where code=?", code)
-        
-        if result:
+        if await promos.delete(code):
             await msg.answer(f"✅ Промокод {code} удален!")
         else:
             await msg.answer(f"❌ Промокод {code} не найден!")
@@ -1129,14 +913,14 @@ def setup_handlers(router: Router, services):
         if not is_admin(msg.from_user.id):
             return await msg.answer("Недостаточно прав.")
         
-        promos = await db.fetch("select * from promocodes order by created_at desc")
+        promo_list = await promos.list_all()
         
-        if not promos:
+        if not promo_list:
             await msg.answer("📝 Промокодов нет.")
             return
         
         text = "📝 <b>Список промокодов:</b>\n\n"
-        for promo in promos:
+        for promo in promo_list:
             status = "✅ Активен" if promo['is_active'] else "❌ Неактивен"
             remaining = "∞" if promo['max_uses'] == 0 else promo['max_uses'] - promo['used_count']
             text += (
@@ -1163,7 +947,7 @@ def setup_handlers(router: Router, services):
             reward = int(parts[1])
             
             # Обновляем настройку реферальной награды
-            await db.execute("update settings set value=? where key=?", str(reward), "referral_reward")
+            await app_settings.set("referral_reward", reward)
             
             await msg.answer(f"✅ Реферальная награда установлена: {reward} RUB")
             
@@ -1176,25 +960,17 @@ def setup_handlers(router: Router, services):
             return await msg.answer("Недостаточно прав.")
         
         # Общая статистика рефералов
-        total_users = await db.fetchrow("select count(*) as c from users")
-        users_with_refs = await db.fetchrow("select count(*) as c from users where referrer_id is not null")
-        total_rewards = await db.fetchrow("select sum(reward_amount) as total from referral_rewards")
+        overview = await referrals.overview()
         
         text = (
             "👥 <b>Статистика реферальной системы</b> 👥\n\n"
-            f"👤 <b>Всего пользователей:</b> {total_users['c']}\n"
-            f"🔗 <b>Приглашено по рефералам:</b> {users_with_refs['c']}\n"
-            f"💰 <b>Выплачено наград:</b> {total_rewards['total'] or 0} RUB\n\n"
+            f"👤 <b>Всего пользователей:</b> {overview['total_users']}\n"
+            f"🔗 <b>Приглашено по рефералам:</b> {overview['referred_users']}\n"
+            f"💰 <b>Выплачено наград:</b> {overview['total_rewards']} RUB\n\n"
         )
         
         # Топ рефереров
-        top_refs = await db.fetch(
-            "select u.username, u.telegram_id, count(r.id) as ref_count, sum(r.reward_amount) as total_reward "
-            "from users u left join users r on u.id=r.referrer_id "
-            "where u.id in (select distinct referrer_id from users where referrer_id is not null) "
-            "group by u.id, u.username, u.telegram_id "
-            "order by ref_count desc limit 5"
-        )
+        top_refs = await referrals.top_referrers(limit=5)
         
         if top_refs:
             text += "🏆 <b>Топ рефереров:</b>\n"
@@ -1219,11 +995,9 @@ def setup_handlers(router: Router, services):
             ("США", "6vCPU / 6144 MB RAM / SSD 100 Gb", 1759),
             ("США", "8vCPU / 8192 MB RAM / SSD 200 Gb", 2399),
         ]
-        cnt = 0
-        for loc, specs, price in usa_preset:
-            await tariffs.create(loc, specs, float(price))
-            cnt += 1
-        await msg.answer(f"Готово. Добавлено США тарифов: {cnt}")
+        result = await tariffs.bulk_upsert(usa_preset)
+        await catalog_snapshot.rebuild()
+        await msg.answer(f"Готово. Добавлено США тарифов: {result['added']}")
 
     @router.message(F.text.startswith("/seed_sg"))
     async def seed_singapore(msg: types.Message):
@@ -1240,11 +1014,9 @@ def setup_handlers(router: Router, services):
             ("Сингапур", "6vCPU / 6144 MB RAM / SSD 100 Gb", 1759),
             ("Сингапур", "8vCPU / 8192 MB RAM / SSD 200 Gb", 2399),
         ]
-        cnt = 0
-        for loc, specs, price in sg_preset:
-            await tariffs.create(loc, specs, float(price))
-            cnt += 1
-        await msg.answer(f"Готово. Добавлено тарифов Сингапура: {cnt}")
+        result = await tariffs.bulk_upsert(sg_preset)
+        await catalog_snapshot.rebuild()
+        await msg.answer(f"Готово. Добавлено тарифов Сингапура: {result['added']}")
 
     @router.message(F.text.startswith("/seed_fin"))
     async def seed_finland(msg: types.Message):
@@ -1261,11 +1033,9 @@ def setup_handlers(router: Router, services):
             ("Финляндия", "6vCPU / 6144 MB RAM / SSD 100 Gb", 1759),
             ("Финляндия", "8vCPU / 8192 MB RAM / SSD 200 Gb", 2399),
         ]
-        cnt = 0
-        for loc, specs, price in fin_preset:
-            await tariffs.create(loc, specs, float(price))
-            cnt += 1
-        await msg.answer(f"Готово. Добавлено тарифов Финляндии: {cnt}")
+        result = await tariffs.bulk_upsert(fin_preset)
+        await catalog_snapshot.rebuild()
+        await msg.answer(f"Готово. Добавлено тарифов Финляндии: {result['added']}")
 
     @router.message(F.text.startswith("/check"))
     async def check_invoice(msg: types.Message):
@@ -1280,14 +1050,10 @@ def setup_handlers(router: Router, services):
             return await msg.answer("Счет не найден.")
         if inv.get("status") == "paid":
             order = await orders.by_invoice_id(invoice_id)
-            if order and order.get("status") != "paid":
-                await orders.set_status(order["id"], "paid")
+            # Админов уведомляем только при первом переходе в "оплачен"
+            if order and await orders.mark_paid(order["id"]):
+                await notifier.fan_out(admin_ids, f"✅ Оплачен счет {invoice_id}")
             await msg.answer("✅ Оплата подтверждена. Ждите выдачи от администратора.")
-            for admin_id in admin_ids:
-                try:
-                    await msg.bot.send_message(admin_id, f"✅ Оплачен счет {invoice_id}")
-                except Exception:
-                    pass
         else:
             await msg.answer(f"Статус счета: {inv.get('status')}")
 
@@ -1295,18 +1061,62 @@ def setup_handlers(router: Router, services):
     def is_admin(user_id: int) -> bool:
         return user_id in admin_ids
 
-    @router.message(F.text.startswith("/orders_paid"))
-    async def orders_paid(msg: types.Message):
+    @router.message(F.text == "/cache_stats")
+    async def cache_stats(msg: types.Message):
         if not is_admin(msg.from_user.id):
             return await msg.answer("Недостаточно прав.")
-        rows = await db.fetch(
-            "select o.id, t.location, t.specs, t.price from orders o left join tariffs t on t.id=o.tariff_id where o.status='paid' order by o.id desc limit 20"
+        st = users.cache.stats()
+        await msg.answer(
+            "🗄 <b>Кэш пользователей</b>\n\n"
+            f"Записей: <code>{st['size']}/{st['maxsize']}</code>\n"
+            f"Попаданий: <code>{st['hits']}</code>\n"
+            f"Промахов: <code>{st['misses']}</code>\n"
+            f"Hit rate: <code>{st['hit_rate']:.1%}</code>",
+            parse_mode="HTML"
         )
+
+    # Рассылка всем пользователям идет фоновой задачей и переживает перезапуск
+    @router.message(F.text == "/broadcast_status")
+    async def broadcast_status(msg: types.Message):
+        if not is_admin(msg.from_user.id):
+            return await msg.answer("Недостаточно прав.")
+        rows = await broadcasts.recent(5)
         if not rows:
-            return await msg.answer("Оплаченных заказов нет.")
-        await msg.answer("\n".join(
-            f"#{r['id']} • {r['location']} • {r['specs']} • {apply_markup(float(r['price']))} RUB" for r in rows
-        ))
+            return await msg.answer("Рассылок еще не было.")
+        await msg.answer("\n\n".join(f"#{b['id']} • {b['status']}\n{progress_line(b)}" for b in rows))
+
+    @router.message(F.text.startswith("/broadcast_cancel"))
+    async def broadcast_cancel(msg: types.Message):
+        if not is_admin(msg.from_user.id):
+            return await msg.answer("Недостаточно прав.")
+        parts = msg.text.split()
+        if len(parts) < 2 or not parts[1].isdigit():
+            return await msg.answer("Использование: /broadcast_cancel <id>")
+        await broadcaster.cancel(int(parts[1]))
+        await msg.answer(f"Рассылка #{parts[1]} будет остановлена после текущей пачки.")
+
+    @router.message(F.text.startswith("/broadcast"))
+    async def broadcast(msg: types.Message):
+        if not is_admin(msg.from_user.id):
+            return await msg.answer("Недостаточно прав.")
+        text = msg.html_text.partition(" ")[2].strip()
+        if not text:
+            return await msg.answer(
+                "Использование: /broadcast <текст>\n\n"
+                "Поддерживается HTML-разметка. Прогресс: /broadcast_status"
+            )
+        b = await broadcaster.start(text, msg.chat.id)
+        await msg.answer(
+            f"📣 Рассылка #{b['id']} запущена для {b['total']} пользователей.\n"
+            "Прогресс: /broadcast_status, остановить: /broadcast_cancel " + str(b["id"])
+        )
+
+    @router.message(F.text.startswith("/orders_paid"))
+    async def orders_paid(msg: types.Message):
+        if not is_admin(msg.from_user.id):
+            return await msg.answer("Недостаточно прав.")
+        text, markup = await render_admin_paid(None, None)
+        await msg.answer(text, reply_markup=markup)
 
     @router.message(F.text.startswith("/set_delivered"))
     async def set_delivered(msg: types.Message):
@@ -1351,33 +1161,35 @@ def setup_handlers(router: Router, services):
             parse_mode="HTML"
         )
 
-    @router.callback_query(F.data == "admin:paid")
+    @router.callback_query(F.data.startswith("admin:paid"))
     async def admin_paid(cb: types.CallbackQuery):
         if not is_admin(cb.from_user.id):
             return await cb.answer("Нет прав")
-        rows = await db.fetch(
-            "select o.id, t.location, t.specs, t.price from orders o left join tariffs t on t.id=o.tariff_id where o.status='paid' order by o.id desc limit 20"
+        text, markup = await render_admin_paid(*page_cursor(cb.data))
+        await cb.message.edit_text(text, reply_markup=markup)
+
+    async def render_admin_paid(after_id, before_id):
+        # /orders_paid and the admin panel button share the same keyset pages
+        rows, has_prev, has_next = await fetch_page(
+            lambda **cursor: orders.page("paid", **cursor), ADMIN_PAID_PAGE, after_id, before_id
         )
         if not rows:
-            return await cb.message.edit_text("Оплаченных заказов нет.")
+            return "Оплаченных заказов нет.", None
         kb = InlineKeyboardBuilder()
         for r in rows:
             kb.button(text=f"Выдать #{r['id']}", callback_data=f"setdel:{r['id']}")
         kb.adjust(2)
-        await cb.message.edit_text(
-            "\n".join(
-                f"#{r['id']} • {r['location']} • {r['specs']} • {apply_markup(float(r['price']))} RUB" for r in rows
-            ),
-            reply_markup=kb.as_markup(),
-        )
+        add_page_nav(kb, "admin:paid", rows, has_prev, has_next)
+        return "\n".join(
+            f"#{r['id']} • {r['location']} • {r['specs']} • {apply_markup(float(r['price']))} RUB" for r in rows
+        ), kb.as_markup()
 
-    @router.callback_query(F.data == "admin:all")
+    @router.callback_query(F.data.startswith("admin:all"))
     async def admin_all(cb: types.CallbackQuery):
         if not is_admin(cb.from_user.id):
             return await cb.answer("Нет прав")
-        rows = await db.fetch(
-            "select o.id, o.status, t.location, t.specs, t.price from orders o left join tariffs t on t.id=o.tariff_id order by o.id desc limit 30"
-        )
+        after_id, before_id = page_cursor(cb.data)
+        rows, has_prev, has_next = await fetch_page(orders.page, ADMIN_ALL_PAGE, after_id, before_id)
         if not rows:
             return await cb.message.edit_text("Заказов нет.")
         kb = InlineKeyboardBuilder()
@@ -1387,6 +1199,7 @@ def setup_handlers(router: Router, services):
             if r["status"] == "paid":
                 kb.button(text=f"Выдать #{r['id']}", callback_data=f"setdel:{r['id']}")
         kb.adjust(2)
+        add_page_nav(kb, "admin:all", rows, has_prev, has_next)
         await cb.message.edit_text(
             "\n".join(
                 f"#{r['id']} • {r['status']} • {r['location']} • {r['specs']} • {apply_markup(float(r['price']))} RUB" for r in rows
@@ -1398,23 +1211,40 @@ def setup_handlers(router: Router, services):
     async def admin_stats(cb: types.CallbackQuery):
         if not is_admin(cb.from_user.id):
             return await cb.answer("Нет прав")
-        total = await db.fetchrow("select count(*) as c from orders")
-        paid = await db.fetchrow("select count(*) as c from orders where status='paid'")
-        delivered = await db.fetchrow("select count(*) as c from orders where status='delivered'")
+        # Сводка по rollup-таблице daily_stats: строк столько, сколько дней x тарифов, а не заказов
+        tariff_rows = await stats.by_tariff()
+        days = await stats.by_day(7)
         users_count = await db.fetchrow("select count(*) as c from users")
-        rows_am = await db.fetch(
-            "select t.price from orders o left join tariffs t on t.id=o.tariff_id where o.status in ('paid','delivered')"
-        )
-        revenue_sum = sum(apply_markup(float(r['price'])) for r in rows_am) if rows_am else 0
+        totals = {k: sum(int(r[k] or 0) for r in tariff_rows) for k in ("created", "paid", "delivered", "revenue", "discounts")}
+        by_location: dict[str, list[int]] = {}
+        for r in tariff_rows:
+            loc = by_location.setdefault(r["location"] or "—", [0, 0])
+            loc[0] += int(r["paid"] or 0)
+            loc[1] += int(r["revenue"] or 0)
         text = (
             f"📊 <b>Статистика магазина</b> 📊\n"
             "━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
-            f"📦 <b>Всего заказов:</b> <code>{total['c']}</code>\n"
-            f"✅ <b>Оплачено:</b> <code>{paid['c']}</code>\n"
-            f"🎉 <b>Выдано:</b> <code>{delivered['c']}</code>\n"
+            f"📦 <b>Всего заказов:</b> <code>{totals['created']}</code>\n"
+            f"✅ <b>Оплачено:</b> <code>{totals['paid']}</code>\n"
+            f"🎉 <b>Выдано:</b> <code>{totals['delivered']}</code>\n"
             f"👥 <b>Пользователей:</b> <code>{users_count['c']}</code>\n"
-            f"💰 <b>Выручка (RUB):</b> <code>{revenue_sum:,}</code>"
+            f"💰 <b>Выручка (RUB):</b> <code>{totals['revenue']:,}</code>\n"
+            f"🎁 <b>Скидки и бонусы (RUB):</b> <code>{totals['discounts']:,}</code>"
         )
+        if by_location:
+            text += "\n\n🌍 <b>По локациям:</b>\n" + "\n".join(
+                f"{location_flag(loc)} {loc}: {paid} опл. • {revenue:,} RUB"
+                for loc, (paid, revenue) in sorted(by_location.items(), key=lambda kv: -kv[1][1])
+            )
+        top = [r for r in tariff_rows if r["paid"]][:5]
+        if top:
+            text += "\n\n🏆 <b>Топ тарифов:</b>\n" + "\n".join(
+                f"{r['location']} • {r['specs'] or 'удален'}: {r['paid']} опл. • {int(r['revenue']):,} RUB" for r in top
+            )
+        if days:
+            text += "\n\n📅 <b>За 7 дней:</b>\n" + "\n".join(
+                f"{d['day']}: {d['created']} заказов • {d['paid']} опл. • {int(d['revenue']):,} RUB" for d in days
+            )
         await cb.message.edit_text(text, parse_mode="HTML")
 
     @router.callback_query(F.data.startswith("setdel:"))
@@ -1428,7 +1258,7 @@ def setup_handlers(router: Router, services):
             await cb.message.edit_text(cb.message.text + f"\n\n✅ Заказ #{order_id} выдан.")
             if updated.get("telegram_id"):
                 try:
-                    await cb.bot.send_message(int(updated["telegram_id"]), f"Ваш заказ №{order_id}: статус <b>Выдан</b>.", parse_mode="HTML")
+                    await notifier.send(int(updated["telegram_id"]), f"Ваш заказ №{order_id}: статус <b>Выдан</b>.", parse_mode="HTML")
                 except Exception:
                     pass
         else:
@@ -1450,7 +1280,7 @@ def setup_handlers(router: Router, services):
                         f"Статус: <b>Оплачен</b>\n"
                         f"{updated['location']} • {updated['specs']} • {apply_markup(float(updated['price']))} RUB"
                     )
-                    await cb.bot.send_message(int(updated["telegram_id"]), text, parse_mode="HTML")
+                    await notifier.send(int(updated["telegram_id"]), text, parse_mode="HTML")
                 except Exception:
                     pass
         else:
@@ -1470,32 +1300,32 @@ def setup_handlers(router: Router, services):
             try:
                 # Получаем информацию о пользователе и заказе
                 order_info = await db.fetchrow(
-                    "select o.user_id, o.final_price, u.referrer_id, u.telegram_id from orders o "
-                    "left join users u on o.user_id=u.id where o.id=?", order_id
+                    "select o.user_id, o.final_price, u.referrer_id, u.telegram_id, u.username from orders o "
+                    "left join users u on o.user_id=u.id where o.id=$1", order_id
                 )
                 
                 if order_info and order_info['referrer_id']:
                     # Получаем настройку реферальной награды
-                    ref_reward_setting = await db.fetchrow("select value from settings where key=?", "referral_reward")
-                    ref_reward_amount = int(ref_reward_setting['value']) if ref_reward_setting else 100  # По умолчанию 100 RUB
+                    ref_reward_amount = await app_settings.get_int("referral_reward", 100)  # По умолчанию 100 RUB
                     
-                    # Начисляем бонус рефереру
-                    await db.execute(
-                        "insert into referral_rewards (referrer_id, referred_user_id, order_id, reward_amount) values (?, ?, ?, ?)",
-                        order_info['referrer_id'], order_info['user_id'], order_id, ref_reward_amount
-                    )
-                    
-                    # Увеличиваем баланс бонусов реферера
-                    await db.execute(
-                        "update users set bonus_balance=bonus_balance+? where id=?",
-                        ref_reward_amount, order_info['referrer_id']
-                    )
+                    # Начисляем бонус рефереру и записываем награду одной транзакцией;
+                    # повторная отметка того же заказа второй раз не начисляет (запись в bonus_ledger уже есть)
+                    async with db.transaction():
+                        credited = await users.credit_bonus(
+                            order_info['referrer_id'], ref_reward_amount, "referral", order_id
+                        )
+                        if credited is not None:
+                            await referrals.add_reward(
+                                order_info['referrer_id'], order_info['user_id'], order_id, ref_reward_amount
+                            )
                     
                     # Уведомляем реферера о начислении бонуса
-                    ref_user = await db.fetchrow("select telegram_id, username from users where id=?", order_info['referrer_id'])
+                    ref_user = None
+                    if credited is not None:
+                        ref_user = await db.fetchrow("select telegram_id, username from users where id=$1", order_info['referrer_id'])
                     if ref_user:
                         try:
-                            await cb.bot.send_message(
+                            await notifier.send(
                                 ref_user['telegram_id'],
                                 f"🎉 <b>Реферальный бонус!</b>\n\n"
                                 f"👤 Ваш реферал @{order_info.get('username', 'пользователь')} "
@@ -1520,7 +1350,7 @@ def setup_handlers(router: Router, services):
                         f"{full['location']} • {full['specs']} • {apply_markup(float(full['price']))} RUB\n\n"
                         f"Пожалуйста, перешлите сообщение от CryptoBot с подтверждением оплаты в {support_contact} для выдачи заказа."
                     )
-                    await cb.bot.send_message(int(full["telegram_id"]), text, parse_mode="HTML")
+                    await notifier.send(int(full["telegram_id"]), text, parse_mode="HTML")
                 except Exception:
                     pass
             await cb.answer("Отмечено как оплачен")
@@ -1544,7 +1374,7 @@ def setup_handlers(router: Router, services):
                         f"{full['location']} • {full['specs']} • {apply_markup(float(full['price']))} RUB\n\n"
                         f"Если оплачивали, перешлите подтверждение в {support_contact}."
                     )
-                    await cb.bot.send_message(int(full["telegram_id"]), text, parse_mode="HTML")
+                    await notifier.send(int(full["telegram_id"]), text, parse_mode="HTML")
                 except Exception:
                     pass
             await cb.answer("Отмечено как не оплачен")
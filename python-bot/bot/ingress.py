@@ -0,0 +1,109 @@
+import asyncio
+import json
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from .db import Database
+
+
+def update_user_id(update: dict) -> int | None:
+    # The first event object of an update carries the sender ("from") or at least the chat
+    for key, value in update.items():
+        if key == "update_id" or not isinstance(value, dict):
+            continue
+        sender = value.get("from") or value.get("user") or value.get("chat")
+        if isinstance(sender, dict) and sender.get("id") is not None:
+            return int(sender["id"])
+    return None
+
+
+class UpdateQueue:
+    # Local durable queue between the ingress process and the bot workers.
+    # Updates are sharded by sender so one worker sees all of a user's updates in order.
+    def __init__(self, path: str, shards: int):
+        self.db = Database(f"sqlite:///{path}", sqlite_read_pool_size=0)
+        self.shards = max(1, shards)
+
+    async def connect(self):
+        await self.db.connect()
+        await self.db.execute(
+            """
+            create table if not exists updates (
+              id integer primary key autoincrement,
+              update_id integer unique,
+              shard integer not null,
+              payload text not null
+            )
+            """
+        )
+        await self.db.execute("create index if not exists ix_updates_shard on updates(shard, id)")
+
+    async def close(self):
+        await self.db.close()
+
+    def shard_of(self, update: dict) -> int:
+        user_id = update_user_id(update)
+        return user_id % self.shards if user_id is not None else 0
+
+    async def push(self, update: dict):
+        # Telegram redelivers unconfirmed updates after a restart; update_id dedupes them
+        await self.db.execute(
+            "insert into updates(update_id, shard, payload) values($1,$2,$3) on conflict (update_id) do nothing",
+            update.get("update_id"),
+            self.shard_of(update),
+            json.dumps(update, ensure_ascii=False),
+        )
+
+    async def pull(self, shard: int, limit: int = 100) -> list[tuple[int, dict]]:
+        rows = await self.db.fetch(
+            "select id, payload from updates where shard=$1 order by id limit $2", shard, limit
+        )
+        return [(r["id"], json.loads(r["payload"])) for r in rows]
+
+    async def ack(self, queue_id: int):
+        await self.db.execute("delete from updates where id=$1", queue_id)
+
+    async def depth(self) -> int:
+        row = await self.db.fetchrow("select count(*) as c from updates")
+        return int(row["c"])
+
+
+async def poll_to_queue(bot: Bot, queue: UpdateQueue, allowed_updates: list[str] | None = None):
+    # Ingress without a public URL: long polling, but updates only get persisted here.
+    # The offset is confirmed to Telegram by the next getUpdates, after the push.
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30, allowed_updates=allowed_updates)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"getUpdates failed: {e}")
+            await asyncio.sleep(1)
+            continue
+        for u in updates:
+            await queue.push(u.model_dump(mode="json", exclude_none=True, by_alias=True))
+            offset = u.update_id + 1
+
+
+async def run_worker(queue: UpdateQueue, shard: int, bot: Bot, dp: Dispatcher, idle_sleep: float = 0.05):
+    # Different users of the shard are handled concurrently, each user's updates strictly in order;
+    # an update is removed only after its handler finished (at-least-once)
+    async def process_user(items: list[tuple[int, dict]]):
+        for queue_id, raw in items:
+            try:
+                await dp.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+            except Exception as e:
+                print(f"Update {raw.get('update_id')} failed: {e}")
+            await queue.ack(queue_id)
+
+    while True:
+        batch = await queue.pull(shard)
+        if not batch:
+            await asyncio.sleep(idle_sleep)
+            continue
+        by_user: dict[int | None, list[tuple[int, dict]]] = {}
+        for item in batch:
+            by_user.setdefault(update_user_id(item[1]), []).append(item)
+        await asyncio.gather(*(process_user(items) for items in by_user.values()))
@@ -0,0 +1,189 @@
+import asyncio
+import json
+import random
+import time
+from typing import Awaitable, Callable
+
+from .db import Database
+
+JobHandler = Callable[[dict], Awaitable[None]]
+
+
+class JobQueue:
+    # Durable background jobs: rows in the jobs table are the source of truth,
+    # the in-memory queue only carries ids of jobs that are due
+    def __init__(
+        self,
+        db: Database,
+        workers: int = 4,
+        max_attempts: int = 5,
+        backoff_base: float = 1.0,
+        backoff_max: float = 300.0,
+        lease: float = 60.0,
+    ):
+        self.db = db
+        self._workers = workers
+        self._max_attempts = max_attempts
+        self._backoff_base = backoff_base
+        self._backoff_max = backoff_max
+        # A running job is owned until locked_until; the owner extends it every lease/3
+        self._lease = lease
+        self._handlers: dict[str, JobHandler] = {}
+        self._queue: asyncio.Queue[int] = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._timers: dict[int, asyncio.TimerHandle] = {}
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+
+    def register(self, kind: str, handler: JobHandler):
+        self._handlers[kind] = handler
+
+    async def add(self, kind: str, payload: dict, delay: float = 0.0) -> int:
+        # Persists only; call submit() once the surrounding transaction has committed
+        row = await self.db.execute_returning(
+            "insert into jobs(kind, payload, status, attempts, run_at) values($1,$2,'pending',0,$3) returning id",
+            kind,
+            json.dumps(payload, ensure_ascii=False),
+            time.time() + delay,
+        )
+        return row["id"]
+
+    def submit(self, job_id: int, delay: float = 0.0):
+        if delay > 0:
+            self._timers[job_id] = asyncio.get_running_loop().call_later(delay, self._wake, job_id)
+        else:
+            self._queue.put_nowait(job_id)
+
+    def _wake(self, job_id: int):
+        self._timers.pop(job_id, None)
+        self._queue.put_nowait(job_id)
+
+    async def enqueue(self, kind: str, payload: dict) -> int:
+        job_id = await self.add(kind, payload)
+        self.submit(job_id)
+        return job_id
+
+    async def start(self, recover: bool = True):
+        # Pending jobs are rescheduled; running ones are retried only once their lease has
+        # expired, so a restart never takes over jobs a live process is still working on.
+        # The recovering process keeps sweeping for leases lost by crashed processes.
+        if recover:
+            now = time.time()
+            for row in await self.db.fetch(
+                "select id, status, run_at from jobs where status='pending' "
+                "or (status='running' and (locked_until is null or locked_until < $1)) order by id",
+                now,
+            ):
+                delay = float(row["run_at"] or 0) - now if row["status"] == "pending" else 0.0
+                self.submit(row["id"], max(0.0, delay))
+            self._tasks.append(asyncio.create_task(self._reclaimer()))
+        for _ in range(self._workers):
+            self._tasks.append(asyncio.create_task(self._worker()))
+
+    async def _reclaimer(self):
+        while True:
+            await asyncio.sleep(self._lease)
+            try:
+                now = time.time()
+                # Expired leases, and retries whose timer died with the process that scheduled them
+                rows = await self.db.fetch(
+                    "select id from jobs where (status='running' and (locked_until is null or locked_until < $1)) "
+                    "or (status='pending' and run_at < $2)",
+                    now,
+                    now - self._lease,
+                )
+            except Exception as e:
+                print(f"Job lease sweep failed: {e}")
+                continue
+            for row in rows:
+                self.submit(row["id"])
+
+    async def _heartbeat(self, job_id: int):
+        while True:
+            await asyncio.sleep(self._lease / 3)
+            await self.db.execute(
+                "update jobs set locked_until=$2 where id=$1 and status='running'", job_id, time.time() + self._lease
+            )
+
+    async def join(self):
+        # Waits for jobs that are due now (not for scheduled retries)
+        await self._queue.join()
+
+    async def close(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def _backoff(self, attempts: int, error: Exception) -> float:
+        # Honour Telegram's retry_after when the handler surfaces it
+        retry_after = getattr(error, "retry_after", None)
+        if retry_after:
+            return float(retry_after)
+        return min(self._backoff_max, random.uniform(0, self._backoff_base * (2 ** attempts)))
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+            except Exception as e:
+                print(f"Job {job_id} bookkeeping failed: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: int):
+        # The status guard makes a duplicate id in the queue a no-op; a running job can only
+        # be taken over once its owner stopped extending the lease
+        now = time.time()
+        job = await self.db.execute_returning(
+            "update jobs set status='running', attempts=attempts+1, locked_until=$2 "
+            "where id=$1 and (status='pending' or (status='running' and (locked_until is null or locked_until < $3))) "
+            "returning *",
+            job_id,
+            now + self._lease,
+            now,
+        )
+        if job is None:
+            return
+        handler = self._handlers.get(job["kind"])
+        try:
+            if handler is None:
+                raise RuntimeError(f"no handler for job kind {job['kind']!r}")
+            heartbeat = asyncio.create_task(self._heartbeat(job_id))
+            try:
+                await handler(json.loads(job["payload"]))
+            finally:
+                heartbeat.cancel()
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:500]
+            if job["attempts"] >= self._max_attempts:
+                self.failed += 1
+                await self.db.execute("update jobs set status='failed', last_error=$2 where id=$1", job_id, error)
+                print(f"Job {job_id} ({job['kind']}) failed permanently: {error}")
+                return
+            delay = self._backoff(job["attempts"], e)
+            self.retried += 1
+            await self.db.execute(
+                "update jobs set status='pending', run_at=$2, last_error=$3 where id=$1",
+                job_id,
+                time.time() + delay,
+                error,
+            )
+            self.submit(job_id, delay)
+            return
+        self.processed += 1
+        await self.db.execute("delete from jobs where id=$1", job_id)
+
+    def metrics(self) -> list:
+        return [
+            ("jobs_queue_depth", {}, self._queue.qsize()),
+            ("jobs_scheduled", {}, len(self._timers)),
+            ("jobs_processed_total", {}, self.processed),
+            ("jobs_retried_total", {}, self.retried),
+            ("jobs_failed_total", {}, self.failed),
+        ]
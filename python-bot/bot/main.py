@@ -3,45 +3,162 @@ from aiogram import Bot, Dispatcher
 from aiohttp import web
 from .config import load_settings
 from .db import Database
-from .models import Tariffs, Users, Orders
+from .models import Tariffs, Users, Orders, Promocodes, Referrals, Settings, WebhookEvents, Broadcasts, Stats, UserProfiles
+from .broadcast import Broadcaster
+from .catalog import Catalog
+from .checkout import CheckoutService
+from .jobs import JobQueue
+from .notify import Notifier
 from .cryptobot import CryptoBot
 from .handlers import setup_handlers
+from .ingress import UpdateQueue, poll_to_queue, run_worker
 from .webhook import create_app
+from .metrics import registry as metrics
 
 
 async def main():
     settings = load_settings()
     if not settings.telegram_token:
         raise RuntimeError("TELEGRAM_BOT_TOKEN is missing")
+    # "all": one process does everything; "ingress" + N x "worker": updates go
+    # through a local durable queue sharded by user (see bot/ingress.py)
+    role = settings.bot_role
+    if role not in ("all", "ingress", "worker"):
+        raise RuntimeError(f"Unknown BOT_ROLE {role!r}")
+    clustered = role != "all"
 
-    db = Database(settings.database_url or "sqlite:///shop.sqlite3")
+    db = Database(
+        settings.database_url or "sqlite:///shop.sqlite3",
+        sqlite_profile=settings.sqlite_profile,
+        group_commit_ms=settings.sqlite_group_commit_ms,
+        group_commit_max_writes=settings.sqlite_group_commit_max_writes,
+        sqlite_busy_timeout_ms=settings.sqlite_busy_timeout_ms,
+        sqlite_read_pool_size=settings.sqlite_read_pool_size,
+        pg_min_size=settings.pg_pool_min_size,
+        pg_max_size=settings.pg_pool_max_size,
+        pg_statement_cache_size=settings.pg_statement_cache_size,
+        pg_command_timeout=settings.pg_command_timeout,
+        pg_max_inactive_lifetime=settings.pg_max_inactive_lifetime,
+    )
+    if clustered and db.dialect != "postgres":
+        # Each process has its own write lock and group commit; one SQLite file shared by
+        # ingress and workers means "database is locked" and lost group-commit batches
+        raise RuntimeError(f"BOT_ROLE={role} requires a PostgreSQL DATABASE_URL")
     await db.connect()
     await db.ensure_schema()
+    await db.verify_schema()
 
     tariffs = Tariffs(db)
-    users = Users(db)
-    orders = Orders(db)
-    cryptobot = CryptoBot(settings.cryptobot_token) if settings.cryptobot_token else None
+    profiles = UserProfiles(db, cache_size=settings.user_cache_size, cache_ttl=settings.profile_cache_ttl)
+    users = Users(db, cache_size=settings.user_cache_size, cache_ttl=settings.user_cache_ttl, profiles=profiles)
+    orders = Orders(db, markup_percent=settings.price_markup_percent, profiles=profiles)
+    stats = Stats(db, orders)
+    await stats.ensure_rollup()
+    promocodes = Promocodes(db)
+    referrals = Referrals(db)
+    referrals.start_refresh()
+    app_settings = Settings(db)
+    catalog = Catalog(tariffs, markup_percent=settings.price_markup_percent)
+    await catalog.rebuild()
+    if clustered:
+        catalog.start_refresh(settings.catalog_refresh_interval)
+
+    jobs = JobQueue(
+        db, workers=settings.job_workers, max_attempts=settings.job_max_attempts, lease=settings.job_lease
+    )
+    metrics.register("db_pool", db.metrics)
+    metrics.register("jobs", jobs.metrics)
+    metrics.register(
+        "user_cache",
+        lambda: [(f"user_cache_{key}", {}, value) for key, value in users.cache.stats().items()],
+    )
+    cryptobot = None
+    if settings.cryptobot_token:
+        cryptobot = CryptoBot(
+            settings.cryptobot_token,
+            fallback_rub_usdt_rate=settings.rub_usdt_rate,
+            max_rate_staleness=settings.rate_max_staleness,
+        )
+        cryptobot.start_rate_refresh(settings.rate_refresh_interval)
 
     bot = Bot(token=settings.telegram_token)
     dp = Dispatcher()
+    notifier = Notifier(
+        bot,
+        # Telegram's limit is per bot, so processes share it
+        global_rate=settings.notify_global_rate / (settings.worker_shards + 1 if clustered else 1),
+        per_chat_rate=settings.notify_per_chat_rate,
+    )
+    metrics.register("notifications", notifier.metrics)
+    broadcaster = Broadcaster(Broadcasts(db), users, notifier, jobs)
+
+    checkout = CheckoutService(db, orders, users, promocodes, catalog, cryptobot, rub_usdt_rate=settings.rub_usdt_rate)
 
     services = {
         "db": db,
         "tariffs": tariffs,
         "users": users,
         "orders": orders,
+        "stats": stats,
+        "profiles": profiles,
+        "checkout": checkout,
+        "promocodes": promocodes,
+        "referrals": referrals,
+        "settings": app_settings,
+        "catalog": catalog,
         "cryptobot": cryptobot,
+        "notifier": notifier,
+        "broadcaster": broadcaster,
         "admin_ids": settings.admin_ids,
-        "rub_usdt_rate": settings.rub_usdt_rate,
         "price_markup_percent": settings.price_markup_percent,
         "log_channel_id": settings.log_channel_id,
         "support_contact": settings.support_contact,
     }
     setup_handlers(dp, services)
 
-    # Start both polling and aiohttp webhook server for CryptoBot
-    app = create_app(bot, orders, settings.admin_ids, settings.webhook_secret)
+    update_queue = None
+    if clustered:
+        update_queue = UpdateQueue(settings.update_queue_path, settings.worker_shards)
+        await update_queue.connect()
+
+    if role == "worker":
+        await jobs.start(recover=False)
+        try:
+            await run_worker(update_queue, settings.worker_shard, bot, dp)
+        finally:
+            await jobs.close()
+            await catalog.close()
+            await referrals.close()
+            await update_queue.close()
+            await db.close()
+            if cryptobot:
+                await cryptobot.close()
+            await bot.session.close()
+        return
+
+    # One aiohttp server: CryptoBot webhook, /metrics and, in webhook mode, Telegram updates
+    webhook_mode = bool(settings.telegram_webhook_url)
+    if webhook_mode and not settings.telegram_webhook_secret:
+        raise RuntimeError("TELEGRAM_WEBHOOK_SECRET is required with TELEGRAM_WEBHOOK_URL")
+    app = create_app(
+        bot,
+        orders,
+        WebhookEvents(db),
+        jobs,
+        settings.admin_ids,
+        settings.webhook_secret,
+        metrics_token=settings.metrics_token,
+        notifier=notifier,
+        dp=dp if webhook_mode and not clustered else None,
+        telegram_secret=settings.telegram_webhook_secret,
+        telegram_path=settings.telegram_webhook_path,
+        telegram_max_concurrency=settings.telegram_max_concurrency,
+        update_queue=update_queue if webhook_mode else None,
+    )
+
+    await jobs.start()
+    # Releases reservations a crashed checkout left behind; safe to run in several processes
+    checkout.start_sweep(settings.checkout_pending_ttl)
 
     runner = web.AppRunner(app)
     await runner.setup()
@@ -49,11 +166,36 @@ async def main():
     await site.start()
 
     try:
-        await dp.start_polling(bot)
+        if webhook_mode:
+            await bot.set_webhook(
+                settings.telegram_webhook_url.rstrip("/") + settings.telegram_webhook_path,
+                secret_token=settings.telegram_webhook_secret,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+            await asyncio.Event().wait()
+        else:
+            # getUpdates is refused while a webhook is registered
+            await bot.delete_webhook()
+            if clustered:
+                await poll_to_queue(bot, update_queue, dp.resolve_used_update_types())
+            else:
+                await dp.start_polling(bot)
     except KeyboardInterrupt:
         # Graceful shutdown on Ctrl+C
         pass
     finally:
+        try:
+            await jobs.close()
+        except Exception:
+            pass
+        try:
+            await checkout.close()
+            await catalog.close()
+            await referrals.close()
+            if update_queue:
+                await update_queue.close()
+        except Exception:
+            pass
         try:
             await db.close()
         except Exception:
@@ -62,6 +204,11 @@ async def main():
             await runner.cleanup()
         except Exception:
             pass
+        if cryptobot:
+            try:
+                await cryptobot.close()
+            except Exception:
+                pass
         try:
             await bot.session.close()
         except Exception:
@@ -70,5 +217,3 @@ async def main():
 
 if __name__ == "__main__":
     asyncio.run(main())
-
-
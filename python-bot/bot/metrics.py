@@ -0,0 +1,59 @@
+import bisect
+from typing import Callable, Iterable
+
+
+class Histogram:
+    # Cumulative-bucket histogram in the Prometheus sense (upper bounds, seconds)
+    def __init__(self, buckets: Iterable[float] = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)):
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> list[tuple[str, int]]:
+        out = []
+        running = 0
+        for bound, n in zip(self.buckets + [float("inf")], self.counts):
+            running += n
+            out.append(("+Inf" if bound == float("inf") else repr(bound), running))
+        return out
+
+
+# A collector returns (metric name, labels, value) samples, or a Histogram as value
+Sample = tuple[str, dict, "float | Histogram"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._collectors: dict[str, Callable[[], list[Sample]]] = {}
+
+    def register(self, name: str, collector: Callable[[], list[Sample]]):
+        self._collectors[name] = collector
+
+    def render(self) -> str:
+        # Prometheus text exposition format
+        lines: list[str] = []
+        for collector in self._collectors.values():
+            for metric, labels, value in collector():
+                if isinstance(value, Histogram):
+                    for le, n in value.cumulative():
+                        lines.append(f"{metric}_bucket{_labels({**labels, 'le': le})} {n}")
+                    lines.append(f"{metric}_sum{_labels(labels)} {value.sum}")
+                    lines.append(f"{metric}_count{_labels(labels)} {value.count}")
+                else:
+                    lines.append(f"{metric}{_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels.items()) + "}"
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,559 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    sqlite: tuple[str, ...] = ()
+    postgres: tuple[str, ...] = ()
+    # (table, column, sqlite declaration, postgres declaration); added only if missing
+    columns: tuple[tuple[str, str, str, str], ...] = ()
+
+
+def _remap_duplicate_users(table: str, column: str) -> str:
+    # Point table.column from a duplicate users row to the oldest row with the same telegram_id
+    return f"""
+            update {table} set {column} = (
+              select min(d.id) from users d
+              where d.telegram_id = (select u.telegram_id from users u where u.id = {table}.{column})
+            )
+            where {column} in (
+              select id from users u
+              where id > (select min(d.id) from users d where d.telegram_id = u.telegram_id)
+            )
+            """
+
+
+# The kept row takes over a duplicate's referrer when it had none (run after the remap above)
+_INHERIT_DUPLICATE_REFERRER = """
+            update users set referrer_id = (
+              select min(d.referrer_id) from users d
+              where d.telegram_id = users.telegram_id and d.id > users.id and d.referrer_id <> users.id
+            )
+            where referrer_id is null
+              and id = (select min(d.id) from users d where d.telegram_id = users.telegram_id)
+            """
+
+
+MIGRATIONS: list[Migration] = [
+    Migration(
+        version=1,
+        name="base tables",
+        sqlite=(
+            """
+            create table if not exists users (
+              id integer primary key autoincrement,
+              username text,
+              telegram_id integer,
+              role text default 'user',
+              referrer_id integer,
+              bonus_balance integer default 0,
+              created_at text default (datetime('now'))
+            )
+            """,
+            """
+            create table if not exists tariffs (
+              id integer primary key autoincrement,
+              location text not null,
+              specs text not null,
+              price real not null
+            )
+            """,
+            """
+            create table if not exists orders (
+              id integer primary key autoincrement,
+              user_id integer references users(id) on delete set null,
+              tariff_id integer references tariffs(id) on delete set null,
+              status text default 'created',
+              invoice_id integer,
+              created_at text default (datetime('now'))
+            )
+            """,
+            """
+            create table if not exists user_active_promocodes (
+              id integer primary key autoincrement,
+              user_id integer references users(id) on delete cascade,
+              promo_code text not null,
+              discount_percent integer not null,
+              min_amount integer default 0,
+              created_at text default (datetime('now'))
+            )
+            """,
+            """
+            create table if not exists referral_rewards (
+              id integer primary key autoincrement,
+              referrer_id integer references users(id),
+              referred_user_id integer references users(id),
+              order_id integer references orders(id),
+              reward_amount integer not null,
+              created_at text default (datetime('now'))
+            )
+            """,
+            """
+            create table if not exists promocodes (
+              id integer primary key autoincrement,
+              code text unique not null,
+              discount_percent integer not null,
+              min_amount integer default 0,
+              max_uses integer default 0,
+              used_count integer default 0,
+              is_active integer default 1,
+              created_at text default (datetime('now'))
+            )
+            """,
+            """
+            create table if not exists settings (
+              key text primary key,
+              value text not null,
+              updated_at text default (datetime('now'))
+            )
+            """,
+        ),
+        postgres=(
+            """
+            create table if not exists users (
+              id serial primary key,
+              username varchar(255),
+              telegram_id bigint,
+              role varchar(32) default 'user',
+              created_at timestamp default now()
+            )
+            """,
+            """
+            create table if not exists tariffs (
+              id serial primary key,
+              location varchar(64) not null,
+              specs varchar(255) not null,
+              price numeric not null
+            )
+            """,
+            """
+            create table if not exists orders (
+              id serial primary key,
+              user_id int references users(id) on delete set null,
+              tariff_id int references tariffs(id) on delete set null,
+              status varchar(32) default 'created',
+              invoice_id bigint,
+              created_at timestamp default now()
+            )
+            """,
+            """
+            create table if not exists user_active_promocodes (
+              id serial primary key,
+              user_id int references users(id) on delete cascade,
+              promo_code varchar(255) not null,
+              discount_percent integer not null,
+              min_amount integer default 0,
+              created_at timestamp default now()
+            )
+            """,
+        ),
+    ),
+    Migration(
+        version=2,
+        name="referral, bonus and order discount columns",
+        columns=(
+            ("users", "referrer_id", "integer", "integer"),
+            ("users", "bonus_balance", "integer default 0", "integer default 0"),
+            ("orders", "promo_code", "text", "varchar(255)"),
+            ("orders", "discount_amount", "integer default 0", "integer default 0"),
+            ("orders", "final_price", "integer", "integer"),
+        ),
+        sqlite=(
+            "insert or ignore into settings (key, value) values ('referral_reward', '100')",
+        ),
+    ),
+    Migration(
+        version=3,
+        name="indexes on hot lookup columns",
+        sqlite=(
+            # Collapse duplicate telegram_id rows (left by the old racy upsert)
+            # onto the oldest one before enforcing uniqueness
+            _remap_duplicate_users("orders", "user_id"),
+            _remap_duplicate_users("users", "referrer_id"),
+            _INHERIT_DUPLICATE_REFERRER,
+            _remap_duplicate_users("referral_rewards", "referrer_id"),
+            _remap_duplicate_users("referral_rewards", "referred_user_id"),
+            """
+            delete from users
+            where id > (select min(d.id) from users d where d.telegram_id = users.telegram_id)
+            """,
+            "create unique index if not exists ux_users_telegram_id on users(telegram_id)",
+            "create index if not exists ix_users_referrer_id on users(referrer_id)",
+            "create index if not exists ix_orders_invoice_id on orders(invoice_id)",
+            "create index if not exists ix_orders_user_id on orders(user_id)",
+            "create index if not exists ix_orders_status on orders(status)",
+            "create index if not exists ix_user_active_promocodes_user_id on user_active_promocodes(user_id)",
+        ),
+        postgres=(
+            _remap_duplicate_users("orders", "user_id"),
+            _remap_duplicate_users("users", "referrer_id"),
+            _INHERIT_DUPLICATE_REFERRER,
+            # referral_rewards is created by v4 on fresh Postgres databases, older ones may already have it
+            f"""
+            do $$
+            begin
+              if to_regclass('referral_rewards') is not null then
+                {_remap_duplicate_users("referral_rewards", "referrer_id")};
+                {_remap_duplicate_users("referral_rewards", "referred_user_id")};
+              end if;
+            end $$
+            """,
+            """
+            delete from users
+            where id > (select min(d.id) from users d where d.telegram_id = users.telegram_id)
+            """,
+            "create unique index if not exists ux_users_telegram_id on users(telegram_id)",
+            "create index if not exists ix_users_referrer_id on users(referrer_id)",
+            "create index if not exists ix_orders_invoice_id on orders(invoice_id)",
+            "create index if not exists ix_orders_user_id on orders(user_id)",
+            "create index if not exists ix_orders_status on orders(status)",
+            "create index if not exists ix_user_active_promocodes_user_id on user_active_promocodes(user_id)",
+        ),
+    ),
+    Migration(
+        version=4,
+        name="promocodes, referral rewards and settings on postgres",
+        # SQLite has had these tables since v1
+        postgres=(
+            """
+            create table if not exists referral_rewards (
+              id serial primary key,
+              referrer_id int references users(id),
+              referred_user_id int references users(id),
+              order_id int references orders(id),
+              reward_amount integer not null,
+              created_at timestamp default now()
+            )
+            """,
+            """
+            create table if not exists promocodes (
+              id serial primary key,
+              code varchar(255) unique not null,
+              discount_percent integer not null,
+              min_amount integer default 0,
+              max_uses integer default 0,
+              used_count integer default 0,
+              is_active integer default 1,
+              created_at timestamp default now()
+            )
+            """,
+            """
+            create table if not exists settings (
+              key varchar(255) primary key,
+              value text not null,
+              updated_at timestamp default now()
+            )
+            """,
+            "insert into settings (key, value) values ('referral_reward', '100') on conflict (key) do nothing",
+        ),
+    ),
+    Migration(
+        version=5,
+        name="unique tariff key for bulk upserts",
+        sqlite=(
+            # Keep the oldest row per (location, specs) and repoint orders to it
+            """
+            update orders set tariff_id = (
+              select min(d.id) from tariffs d, tariffs t
+              where t.id = orders.tariff_id and d.location = t.location and d.specs = t.specs
+            )
+            where tariff_id in (
+              select id from tariffs t
+              where id > (select min(d.id) from tariffs d where d.location = t.location and d.specs = t.specs)
+            )
+            """,
+            """
+            delete from tariffs
+            where id > (
+              select min(d.id) from tariffs d
+              where d.location = tariffs.location and d.specs = tariffs.specs
+            )
+            """,
+            "create unique index if not exists ux_tariffs_location_specs on tariffs(location, specs)",
+        ),
+        postgres=(
+            """
+            update orders set tariff_id = (
+              select min(d.id) from tariffs d, tariffs t
+              where t.id = orders.tariff_id and d.location = t.location and d.specs = t.specs
+            )
+            where tariff_id in (
+              select id from tariffs t
+              where id > (select min(d.id) from tariffs d where d.location = t.location and d.specs = t.specs)
+            )
+            """,
+            """
+            delete from tariffs
+            where id > (
+              select min(d.id) from tariffs d
+              where d.location = tariffs.location and d.specs = tariffs.specs
+            )
+            """,
+            "create unique index if not exists ux_tariffs_location_specs on tariffs(location, specs)",
+        ),
+    ),
+    Migration(
+        version=6,
+        name="processed webhook events",
+        sqlite=(
+            """
+            create table if not exists processed_events (
+              event_key text primary key,
+              processed_at text default (datetime('now'))
+            )
+            """,
+        ),
+        postgres=(
+            """
+            create table if not exists processed_events (
+              event_key varchar(255) primary key,
+              processed_at timestamp default now()
+            )
+            """,
+        ),
+    ),
+    Migration(
+        version=7,
+        name="durable background jobs",
+        sqlite=(
+            """
+            create table if not exists jobs (
+              id integer primary key autoincrement,
+              kind text not null,
+              payload text not null,
+              status text not null default 'pending',
+              attempts integer not null default 0,
+              run_at real not null default 0,
+              last_error text,
+              created_at text default (datetime('now'))
+            )
+            """,
+            "create index if not exists ix_jobs_status on jobs(status)",
+        ),
+        postgres=(
+            """
+            create table if not exists jobs (
+              id bigserial primary key,
+              kind varchar(64) not null,
+              payload text not null,
+              status varchar(16) not null default 'pending',
+              attempts integer not null default 0,
+              run_at double precision not null default 0,
+              last_error text,
+              created_at timestamp default now()
+            )
+            """,
+            "create index if not exists ix_jobs_status on jobs(status)",
+        ),
+    ),
+    Migration(
+        version=8,
+        name="broadcasts and blocked users",
+        columns=(
+            ("users", "is_blocked", "integer default 0", "integer default 0"),
+        ),
+        sqlite=(
+            """
+            create table if not exists broadcasts (
+              id integer primary key autoincrement,
+              text text not null,
+              status text not null default 'running',
+              admin_chat_id integer,
+              last_user_id integer not null default 0,
+              total integer not null default 0,
+              sent integer not null default 0,
+              failed integer not null default 0,
+              blocked integer not null default 0,
+              created_at text default (datetime('now')),
+              finished_at text
+            )
+            """,
+        ),
+        postgres=(
+            """
+            create table if not exists broadcasts (
+              id serial primary key,
+              text text not null,
+              status varchar(16) not null default 'running',
+              admin_chat_id bigint,
+              last_user_id integer not null default 0,
+              total integer not null default 0,
+              sent integer not null default 0,
+              failed integer not null default 0,
+              blocked integer not null default 0,
+              created_at timestamp default now(),
+              finished_at timestamp
+            )
+            """,
+        ),
+    ),
+    Migration(
+        version=9,
+        name="keyset pagination indexes on orders",
+        sqlite=(
+            # Keyset pages filter by user/status and walk id; composite indexes replace the single-column ones
+            "create index if not exists ix_orders_user_id_id on orders(user_id, id)",
+            "create index if not exists ix_orders_status_id on orders(status, id)",
+            "drop index if exists ix_orders_user_id",
+            "drop index if exists ix_orders_status",
+        ),
+        postgres=(
+            "create index if not exists ix_orders_user_id_id on orders(user_id, id)",
+            "create index if not exists ix_orders_status_id on orders(status, id)",
+            "drop index if exists ix_orders_user_id",
+            "drop index if exists ix_orders_status",
+        ),
+    ),
+    Migration(
+        version=10,
+        name="daily order stats rollup",
+        # Filled incrementally by Orders on status transitions; Stats.ensure_rollup backfills old orders
+        sqlite=(
+            """
+            create table if not exists daily_stats (
+              day text not null,
+              tariff_id integer not null default 0,
+              location text not null default '',
+              created integer not null default 0,
+              paid integer not null default 0,
+              delivered integer not null default 0,
+              revenue integer not null default 0,
+              discounts integer not null default 0,
+              primary key (day, tariff_id)
+            )
+            """,
+        ),
+        postgres=(
+            """
+            create table if not exists daily_stats (
+              day varchar(10) not null,
+              tariff_id integer not null default 0,
+              location varchar(64) not null default '',
+              created integer not null default 0,
+              paid integer not null default 0,
+              delivered integer not null default 0,
+              revenue bigint not null default 0,
+              discounts bigint not null default 0,
+              primary key (day, tariff_id)
+            )
+            """,
+        ),
+    ),
+    Migration(
+        version=11,
+        name="denormalized referral counters",
+        # Kept in step by Users.set_referrer and Referrals.add_reward
+        columns=(
+            ("users", "ref_count", "integer not null default 0", "integer not null default 0"),
+            ("users", "ref_rewards", "integer not null default 0", "integer not null default 0"),
+        ),
+        sqlite=(
+            """
+            update users set
+              ref_count = (select count(*) from users r where r.referrer_id = users.id),
+              ref_rewards = (select coalesce(sum(rr.reward_amount), 0) from referral_rewards rr where rr.referrer_id = users.id)
+            """,
+            "create index if not exists ix_users_ref_count on users(ref_count)",
+        ),
+        postgres=(
+            """
+            update users set
+              ref_count = (select count(*) from users r where r.referrer_id = users.id),
+              ref_rewards = (select coalesce(sum(rr.reward_amount), 0) from referral_rewards rr where rr.referrer_id = users.id)
+            """,
+            "create index if not exists ix_users_ref_count on users(ref_count)",
+        ),
+    ),
+    Migration(
+        version=12,
+        name="bonus ledger",
+        # users.bonus_balance stays the cached balance; every change to it is a ledger row
+        # carrying the resulting balance. Existing balances become 'opening' entries.
+        sqlite=(
+            """
+            create table if not exists bonus_ledger (
+              id integer primary key autoincrement,
+              user_id integer not null,
+              amount integer not null,
+              balance_after integer not null,
+              reason text not null,
+              order_id integer,
+              created_at text default (datetime('now'))
+            )
+            """,
+            # One entry per (user, reason, order): a repeated credit or debit for the same order is refused
+            "create unique index if not exists ux_bonus_ledger_user_reason_order on bonus_ledger(user_id, reason, order_id)",
+            "insert into bonus_ledger(user_id, amount, balance_after, reason) "
+            "select id, bonus_balance, bonus_balance, 'opening' from users where bonus_balance <> 0",
+        ),
+        postgres=(
+            """
+            create table if not exists bonus_ledger (
+              id serial primary key,
+              user_id integer not null,
+              amount integer not null,
+              balance_after integer not null,
+              reason varchar(32) not null,
+              order_id integer,
+              created_at timestamp default now()
+            )
+            """,
+            "create unique index if not exists ux_bonus_ledger_user_reason_order on bonus_ledger(user_id, reason, order_id)",
+            "insert into bonus_ledger(user_id, amount, balance_after, reason) "
+            "select id, bonus_balance, bonus_balance, 'opening' from users where bonus_balance <> 0",
+        ),
+    ),
+    Migration(
+        version=13,
+        name="job leases",
+        # A running job belongs to its process until locked_until; the worker heartbeats it
+        columns=(
+            ("jobs", "locked_until", "real", "double precision"),
+        ),
+    ),
+    Migration(
+        version=14,
+        name="order payment time for the stats rollup",
+        # daily_stats books paid/revenue on the UTC day of paid_at; the old rollup used the local
+        # day of the transition and is rebuilt by Stats.ensure_rollup on the next start
+        columns=(
+            ("orders", "paid_at", "text", "timestamp"),
+        ),
+        sqlite=(
+            "update orders set paid_at = created_at where status in ('paid', 'delivered')",
+            "delete from daily_stats",
+        ),
+        postgres=(
+            "update orders set paid_at = created_at where status in ('paid', 'delivered')",
+            "delete from daily_stats",
+        ),
+    ),
+]
+
+
+# Columns the application relies on; checked once at startup by Database.verify_schema
+EXPECTED_COLUMNS: dict[str, tuple[str, ...]] = {
+    "users": (
+        "id", "username", "telegram_id", "role", "referrer_id", "bonus_balance", "is_blocked",
+        "ref_count", "ref_rewards", "created_at",
+    ),
+    "tariffs": ("id", "location", "specs", "price"),
+    "orders": (
+        "id", "user_id", "tariff_id", "status", "invoice_id", "created_at",
+        "promo_code", "discount_amount", "final_price", "paid_at",
+    ),
+    "user_active_promocodes": ("id", "user_id", "promo_code", "discount_percent", "min_amount"),
+    "promocodes": ("id", "code", "discount_percent", "min_amount", "max_uses", "used_count", "is_active", "created_at"),
+    "referral_rewards": ("id", "referrer_id", "referred_user_id", "order_id", "reward_amount", "created_at"),
+    "settings": ("key", "value", "updated_at"),
+    "processed_events": ("event_key", "processed_at"),
+    "jobs": ("id", "kind", "payload", "status", "attempts", "run_at", "last_error", "created_at", "locked_until"),
+    "broadcasts": (
+        "id", "text", "status", "admin_chat_id", "last_user_id", "total", "sent", "failed", "blocked",
+        "created_at", "finished_at",
+    ),
+    "bonus_ledger": ("id", "user_id", "amount", "balance_after", "reason", "order_id", "created_at"),
+    "daily_stats": ("day", "tariff_id", "location", "created", "paid", "delivered", "revenue", "discounts"),
+}
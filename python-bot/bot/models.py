@@ -1,4 +1,35 @@
-from .db import Database
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+
+from .cache import TTLCache
+from .catalog import apply_markup
+from .db import Database, rows_affected
+
+
+def _insert_sql(table: str, columns: list[str]) -> str:
+    # Numbered placeholders work on asyncpg directly and are translated for SQLite
+    values = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+    return f"insert into {table} ({', '.join(columns)}) values ({values})"
+
+
+def _to_datetime(value):
+    # SQLite stores timestamps as text, asyncpg returns datetime
+    if value is None or isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+
+def _utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+def _day(value) -> str:
+    # Rollup day of a stored timestamp; incremental updates and Stats.rebuild both go through here
+    moment = _to_datetime(value)
+    return (moment or _utc_now()).date().isoformat()
 
 
 class Tariffs:
@@ -19,55 +50,414 @@ class Tariffs:
     async def create(self, location: str, specs: str, price: float):
         # Ensure SQLite gets a native float
         price_val = float(price)
-        await self.db.execute(
-            "insert into tariffs(location,specs,price) values($1,$2,$3)",
+        return await self.db.execute_returning(
+            "insert into tariffs(location,specs,price) values($1,$2,$3) returning *",
             location,
             specs,
             price_val,
         )
-        return await self.db.fetchrow("select * from tariffs where location=$1 and specs=$2 and price=$3", location, specs, price_val)
+
+    async def bulk_upsert(self, items) -> dict:
+        # items: (location, specs, price); (location, specs) is unique, last duplicate wins
+        wanted: dict[tuple[str, str], float] = {}
+        for location, specs, price in items:
+            wanted[(location, specs)] = float(price)
+        added = updated = 0
+        changed = []
+        async with self.db.transaction():
+            rows = await self.db.fetch("select location, specs, price from tariffs")
+            current = {(r["location"], r["specs"]): float(r["price"]) for r in rows}
+            for (location, specs), price in wanted.items():
+                old = current.get((location, specs))
+                if old is None:
+                    added += 1
+                elif old != price:
+                    updated += 1
+                else:
+                    continue
+                changed.append((location, specs, price))
+            await self.db.executemany(
+                """
+                insert into tariffs(location,specs,price) values($1,$2,$3)
+                on conflict (location, specs) do update set price=excluded.price
+                """,
+                changed,
+            )
+        return {"added": added, "updated": updated, "unchanged": len(wanted) - added - updated}
+
+
+class UserProfiles:
+    # "My profile" summary: order counts by status, referrals and bonus balance in one
+    # aggregate over users + orders(user_id, id). Entries are short-lived and dropped by
+    # Users/Orders whenever the user's bonus, referrals or orders change.
+    def __init__(self, db: Database, cache_size: int = 10000, cache_ttl: float = 30.0):
+        self.db = db
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def invalidate(self, user_id: int):
+        self.cache.pop(user_id)
+
+    async def get(self, user_id: int) -> dict | None:
+        cached = self.cache.get(user_id)
+        if cached is not None:
+            return cached
+        row = await self.db.fetchrow(
+            """
+            select u.bonus_balance, u.ref_count,
+                   count(o.id) as total,
+                   coalesce(sum(case when o.status='paid' then 1 else 0 end), 0) as paid,
+                   coalesce(sum(case when o.status='delivered' then 1 else 0 end), 0) as delivered
+            from users u left join orders o on o.user_id = u.id
+            where u.id=$1
+            group by u.id, u.bonus_balance, u.ref_count
+            """,
+            user_id,
+        )
+        if row is None:
+            return None
+        profile = {k: int(v or 0) for k, v in row.items()}
+        profile["created"] = profile["total"] - profile["paid"] - profile["delivered"]
+        self.cache.set(user_id, profile)
+        return profile
 
 
 class Users:
-    def __init__(self, db: Database):
+    def __init__(
+        self,
+        db: Database,
+        cache_size: int = 10000,
+        cache_ttl: float = 300.0,
+        profiles: UserProfiles | None = None,
+    ):
         self.db = db
+        self.profiles = profiles
+        # telegram_id -> user row; rows are write-through on insert and dropped
+        # whenever referrer_id / bonus_balance change. _tg_by_id (user id -> telegram_id,
+        # for invalidation) holds exactly the cached rows: it shrinks as the cache evicts.
+        self.cache = TTLCache(maxsize=cache_size, ttl=cache_ttl, on_evict=self._forget)
+        self._tg_by_id: dict[int, int] = {}
+
+    def _remember(self, row):
+        if row and self.cache.maxsize > 0:
+            self.cache.set(row["telegram_id"], row)
+            self._tg_by_id[row["id"]] = row["telegram_id"]
+        return row
+
+    def _forget(self, telegram_id, row):
+        if self._tg_by_id.get(row["id"]) == telegram_id:
+            del self._tg_by_id[row["id"]]
+
+    def invalidate(self, user_id: int):
+        if self.profiles:
+            self.profiles.invalidate(user_id)
+        tg_id = self._tg_by_id.pop(user_id, None)
+        if tg_id is not None:
+            self.cache.pop(tg_id)
 
     async def upsert(self, username: str | None, telegram_id: int):
+        cached = self.cache.get(telegram_id)
+        if cached is not None:
+            return cached
         row = await self.db.fetchrow("select * from users where telegram_id=$1", telegram_id)
         if row:
-            return row
-        await self.db.execute(
-            "insert into users(username, telegram_id) values($1,$2)",
+            return self._remember(row)
+        # A concurrent /start for the same account lands on the unique index
+        row = await self.db.execute_returning(
+            """
+            insert into users(username, telegram_id) values($1,$2)
+            on conflict (telegram_id) do update set username=coalesce(excluded.username, users.username)
+            returning *
+            """,
             username,
             telegram_id,
         )
-        return await self.db.fetchrow("select * from users where telegram_id=$1", telegram_id)
+        return self._remember(row)
+
+    async def set_referrer(self, user_id: int, referrer_id: int) -> bool:
+        # First referrer wins; the referrer's ref_count moves with it in one transaction
+        async with self.db.transaction():
+            status = await self.db.execute(
+                "update users set referrer_id=$1 where id=$2 and referrer_id is null", referrer_id, user_id
+            )
+            changed = rows_affected(status) == 1
+            if changed:
+                await self.db.execute("update users set ref_count=ref_count+1 where id=$1", referrer_id)
+        self.invalidate(user_id)
+        self.invalidate(referrer_id)
+        return changed
+
+    async def credit_bonus(self, user_id: int, amount: int, reason: str, order_id: int | None = None) -> int | None:
+        # New balance; None if this (reason, order) was already credited
+        return await self._post_bonus(user_id, amount, reason, order_id)
+
+    async def debit_bonus(self, user_id: int, amount: int, reason: str, order_id: int | None = None) -> int | None:
+        # New balance; None if the balance does not cover the amount (or it was already debited)
+        return await self._post_bonus(user_id, -amount, reason, order_id)
+
+    async def _post_bonus(self, user_id: int, amount: int, reason: str, order_id: int | None):
+        # users.bonus_balance is the cached balance, bonus_ledger the append-only history with
+        # the balance after each entry. The conditional update makes a debit race-free; it joins
+        # the caller's transaction (checkout). On Postgres only the user's row is locked; SQLite
+        # holds the database write lock (and _write_lock) for the whole transaction.
+        async with self.db.transaction():
+            if order_id is not None and await self.db.fetchrow(
+                "select 1 as x from bonus_ledger where user_id=$1 and reason=$2 and order_id=$3",
+                user_id,
+                reason,
+                order_id,
+            ):
+                return None
+            if amount < 0:
+                row = await self.db.execute_returning(
+                    "update users set bonus_balance=bonus_balance-$1 where id=$2 and bonus_balance >= $1 "
+                    "returning bonus_balance",
+                    -amount,
+                    user_id,
+                )
+            else:
+                row = await self.db.execute_returning(
+                    "update users set bonus_balance=bonus_balance+$1 where id=$2 returning bonus_balance",
+                    amount,
+                    user_id,
+                )
+            if row is None:
+                return None
+            await self.db.execute(
+                _insert_sql("bonus_ledger", ["user_id", "amount", "balance_after", "reason", "order_id"]),
+                user_id,
+                amount,
+                row["bonus_balance"],
+                reason,
+                order_id,
+            )
+        self.invalidate(user_id)
+        return int(row["bonus_balance"])
+
+    async def set_blocked(self, user_id: int, blocked: bool):
+        await self.db.execute("update users set is_blocked=$1 where id=$2", int(blocked), user_id)
+        self.invalidate(user_id)
+
+    async def mark_blocked(self, telegram_ids: list[int]):
+        # Users who blocked the bot are skipped by broadcasts until they /start again
+        await self.db.executemany("update users set is_blocked=1 where telegram_id=$1", [(t,) for t in telegram_ids])
+        for t in telegram_ids:
+            cached = self.cache.pop(t)
+            if cached is not None:
+                self._tg_by_id.pop(cached["id"], None)
+
+    async def count_reachable(self) -> int:
+        row = await self.db.fetchrow("select count(*) as c from users where coalesce(is_blocked, 0)=0")
+        return int(row["c"]) if row else 0
+
+    async def reachable_page(self, after_id: int, limit: int):
+        # Keyset pagination over the primary key: constant cost per page at any offset
+        return await self.db.fetch(
+            "select id, telegram_id from users where id > $1 and coalesce(is_blocked, 0)=0 order by id limit $2",
+            after_id,
+            limit,
+        )
 
 
 class Orders:
-    def __init__(self, db: Database):
+    # Orders in paid/delivered count towards revenue
+    REVENUE_STATUSES = ("paid", "delivered")
+
+    def __init__(self, db: Database, markup_percent: float = 0, profiles: UserProfiles | None = None):
         self.db = db
+        self.markup_percent = markup_percent
+        self.profiles = profiles
 
-    async def create(self, user_id: int, tariff_id: int, invoice_id: int | None):
-        await self.db.execute(
-            "insert into orders(user_id, tariff_id, status, invoice_id) values($1,$2,'created',$3)",
-            user_id,
-            tariff_id,
+    def _changed(self, user_id):
+        if self.profiles and user_id is not None:
+            self.profiles.invalidate(user_id)
+
+    async def create(
+        self,
+        user_id: int,
+        tariff_id: int,
+        invoice_id: int | None,
+        promo_code: str | None = None,
+        discount_amount: int = 0,
+        final_price: int | None = None,
+        status: str = "created",
+    ):
+        async with self.db.transaction():
+            # created_at is written in UTC like paid_at: Postgres' now() default is session-local
+            order = await self.db.execute_returning(
+                "insert into orders(user_id, tariff_id, status, invoice_id, promo_code, discount_amount, final_price, "
+                "created_at) values($1,$2,$3,$4,$5,$6,$7,$8) returning *",
+                user_id,
+                tariff_id,
+                status,
+                invoice_id,
+                promo_code,
+                discount_amount,
+                final_price,
+                _utc_now(),
+            )
+            await self._roll(_day(order["created_at"]), tariff_id, created=1)
+        self._changed(user_id)
+        return order
+
+    async def attach_invoice(self, order_id: int, invoice_id: int):
+        # A checkout reservation ('pending', no invoice yet) becomes a payable order
+        order = await self.db.execute_returning(
+            "update orders set invoice_id=$2, status='created' where id=$1 and status='pending' returning *",
+            order_id,
             invoice_id,
         )
-        return await self.db.fetchrow("select * from orders where user_id=$1 and tariff_id=$2 and invoice_id=$3", user_id, tariff_id, invoice_id)
+        if order:
+            self._changed(order["user_id"])
+        return order
+
+    async def cancel_pending(self, order_id: int) -> bool:
+        # Only a reservation is cancelled; an order that already moved on is left alone
+        return await self._transition(order_id, "cancelled", only_from=("pending",))
 
-    async def by_user(self, user_id: int):
+    async def stale_pending(self, max_age: float, limit: int = 100):
+        # Reservations older than max_age seconds, with the bonus their checkout debited
         return await self.db.fetch(
-            "select o.*, t.location, t.specs, t.price from orders o left join tariffs t on t.id=o.tariff_id where user_id=$1 order by o.id desc",
-            user_id,
+            "select o.id, o.user_id, o.promo_code, coalesce(-l.amount, 0) as bonus from orders o "
+            "left join bonus_ledger l on l.user_id=o.user_id and l.reason='checkout' and l.order_id=o.id "
+            "where o.status='pending' and o.created_at < $1 order by o.id limit $2",
+            _utc_now() - timedelta(seconds=max_age),
+            limit,
+        )
+
+    async def mark_paid(self, order_id: int) -> bool:
+        # Conditional transition: repeated confirmations (and late ones for delivered orders) are no-ops
+        return await self._transition(order_id, "paid", skip_from=self.REVENUE_STATUSES)
+
+    async def _transition(self, order_id: int, status: str, skip_from: tuple = (), only_from: tuple = ()) -> bool:
+        # Status change plus its daily_stats delta in one transaction. The update is guarded by
+        # the status we read, so a concurrent transition of the same order is counted once.
+        async with self.db.transaction():
+            cur = await self.db.fetchrow(
+                "select o.user_id, o.status, o.tariff_id, o.final_price, o.discount_amount, o.created_at, "
+                "o.paid_at, t.price from orders o left join tariffs t on t.id=o.tariff_id where o.id=$1",
+                order_id,
+            )
+            if cur is None or cur["status"] == status or cur["status"] in skip_from:
+                return False
+            if only_from and cur["status"] not in only_from:
+                return False
+            was, now = cur["status"] in self.REVENUE_STATUSES, status in self.REVENUE_STATUSES
+            # paid_at is set on entering paid/delivered and cleared on leaving them
+            paid_at = cur["paid_at"]
+            if now and not was:
+                paid_at = _utc_now()
+            elif was and not now:
+                paid_at = None
+            result = await self.db.execute(
+                "update orders set status=$2, paid_at=$4 where id=$1 and status=$3",
+                order_id,
+                status,
+                cur["status"],
+                paid_at,
+            )
+            if rows_affected(result) != 1:
+                return False
+            sign = (1 if now else 0) - (1 if was else 0)
+            delivered = (1 if status == "delivered" else 0) - (1 if cur["status"] == "delivered" else 0)
+            if sign or delivered:
+                # Booked on the payment day; a reversal takes back what that day was given
+                await self._roll(
+                    self.paid_day(cur) if was else _day(paid_at),
+                    cur["tariff_id"],
+                    paid=sign,
+                    delivered=delivered,
+                    revenue=sign * self.revenue_of(cur),
+                    discounts=sign * int(cur["discount_amount"] or 0),
+                )
+        # After commit, so a concurrent profile read cannot cache the old counts again
+        self._changed(cur["user_id"])
+        return True
+
+    def revenue_of(self, order) -> int:
+        # What the customer pays: final_price once a discount or bonus was applied, the marked-up tariff price otherwise
+        if order["final_price"] is not None:
+            return int(order["final_price"])
+        if order["price"] is None:
+            return 0
+        return apply_markup(float(order["price"]), self.markup_percent)
+
+    @staticmethod
+    def paid_day(order) -> str:
+        # Orders paid before v14 have no paid_at and fall back to their creation day
+        return _day(order["paid_at"] or order.get("created_at"))
+
+    ROLL_SQL = """
+        insert into daily_stats(day, tariff_id, location, created, paid, delivered, revenue, discounts)
+        values($1, $2, coalesce((select location from tariffs where id=$2), ''), $3, $4, $5, $6, $7)
+        on conflict (day, tariff_id) do update set
+          created = daily_stats.created + excluded.created,
+          paid = daily_stats.paid + excluded.paid,
+          delivered = daily_stats.delivered + excluded.delivered,
+          revenue = daily_stats.revenue + excluded.revenue,
+          discounts = daily_stats.discounts + excluded.discounts
+    """
+
+    async def _roll(self, day: str, tariff_id, created=0, paid=0, delivered=0, revenue=0, discounts=0):
+        await self.db.execute(self.ROLL_SQL, day, tariff_id or 0, created, paid, delivered, revenue, discounts)
+        if min(created, paid, delivered, revenue, discounts) < 0:
+            # A fully reversed day leaves no row behind, as in Stats.rebuild
+            await self.db.execute(
+                "delete from daily_stats where day=$1 and tariff_id=$2 "
+                "and created=0 and paid=0 and delivered=0 and revenue=0 and discounts=0",
+                day,
+                tariff_id or 0,
+            )
+
+    async def _keyset(self, base: str, conds: list[str], args: list, after_id, before_id, limit):
+        # Newest first. after_id: the next (older) page, id < after_id; before_id: the
+        # previous (newer) page, id > before_id. Both walk the (filter, id) index.
+        conds, args = list(conds), list(args)
+        order = "desc"
+        if before_id is not None:
+            args.append(before_id)
+            conds.append(f"o.id > ${len(args)}")
+            order = "asc"
+        elif after_id is not None:
+            args.append(after_id)
+            conds.append(f"o.id < ${len(args)}")
+        sql = base
+        if conds:
+            sql += " where " + " and ".join(conds)
+        sql += f" order by o.id {order}"
+        if limit is not None:
+            args.append(limit)
+            sql += f" limit ${len(args)}"
+        rows = await self.db.fetch(sql, *args)
+        if order == "asc":
+            rows.reverse()
+        return rows
+
+    async def by_user(self, user_id: int, after_id: int | None = None, limit: int | None = None, before_id: int | None = None):
+        return await self._keyset(
+            "select o.*, t.location, t.specs, t.price from orders o left join tariffs t on t.id=o.tariff_id",
+            ["o.user_id=$1"],
+            [user_id],
+            after_id,
+            before_id,
+            limit,
+        )
+
+    async def page(self, status: str | None = None, after_id: int | None = None, limit: int = 20, before_id: int | None = None):
+        # Admin lists: all orders or one status
+        return await self._keyset(
+            "select o.id, o.status, t.location, t.specs, t.price from orders o left join tariffs t on t.id=o.tariff_id",
+            ["o.status=$1"] if status else [],
+            [status] if status else [],
+            after_id,
+            before_id,
+            limit,
         )
 
     async def by_invoice_id(self, invoice_id: int):
         return await self.db.fetchrow("select * from orders where invoice_id=$1", invoice_id)
 
     async def set_status(self, order_id: int, status: str):
-        await self.db.execute("update orders set status=$2 where id=$1", order_id, status)
+        await self._transition(order_id, status)
         return await self.with_user_by_id(order_id)
 
     async def with_user_by_id(self, order_id: int):
@@ -95,3 +485,332 @@ class Orders:
         )
 
 
+class Stats:
+    # Admin dashboard over the daily_stats rollup: O(days x tariffs) rows, independent of order count
+    def __init__(self, db: Database, orders: Orders):
+        self.db = db
+        self.orders = orders
+
+    async def ensure_rollup(self):
+        # Databases upgraded to v10 already have orders but an empty rollup
+        if await self.db.fetchrow("select 1 as x from daily_stats limit 1"):
+            return
+        if await self.db.fetchrow("select 1 as x from orders limit 1"):
+            await self.rebuild()
+
+    async def rebuild(self):
+        # Recompute from orders: created on the creation day, paid/delivered/revenue on the payment day.
+        # Read and rewrite in one transaction, so a concurrent transition is either in the read or
+        # rolled on top of the rebuilt rows. SQLite's write lock already excludes other writers;
+        # on Postgres the share lock makes transitions wait until the rebuild commits.
+        async with self.db.transaction():
+            if self.db.dialect == "postgres":
+                await self.db.execute("lock table orders in share mode")
+            rows = await self.db.fetch(
+                "select o.status, o.created_at, o.paid_at, o.tariff_id, o.final_price, o.discount_amount, t.price "
+                "from orders o left join tariffs t on t.id=o.tariff_id"
+            )
+            buckets: dict[tuple, list[int]] = {}
+
+            def bucket(day, tariff_id):
+                return buckets.setdefault((day, tariff_id or 0), [0, 0, 0, 0, 0])
+
+            for r in rows:
+                bucket(_day(r["created_at"]), r["tariff_id"])[0] += 1
+                if r["status"] not in Orders.REVENUE_STATUSES:
+                    continue
+                b = bucket(Orders.paid_day(r), r["tariff_id"])
+                b[1] += 1
+                b[3] += self.orders.revenue_of(r)
+                b[4] += int(r["discount_amount"] or 0)
+                if r["status"] == "delivered":
+                    b[2] += 1
+            await self.db.execute("delete from daily_stats")
+            await self.db.executemany(Orders.ROLL_SQL, [(day, t, *b) for (day, t), b in buckets.items()])
+
+    async def by_tariff(self):
+        # One grouped query; per-location and overall totals are folded from these rows
+        return await self.db.fetch(
+            """
+            select s.tariff_id, max(s.location) as location, t.specs,
+                   sum(s.created) as created, sum(s.paid) as paid, sum(s.delivered) as delivered,
+                   sum(s.revenue) as revenue, sum(s.discounts) as discounts
+            from daily_stats s left join tariffs t on t.id = s.tariff_id
+            group by s.tariff_id, t.specs
+            order by sum(s.revenue) desc
+            """
+        )
+
+    async def by_day(self, days: int = 7):
+        since = date.fromordinal(_utc_now().date().toordinal() - days + 1).isoformat()
+        return await self.db.fetch(
+            """
+            select day, sum(created) as created, sum(paid) as paid, sum(revenue) as revenue
+            from daily_stats where day >= $1 group by day order by day
+            """,
+            since,
+        )
+
+
+class Promocodes:
+    # Promo code catalogue plus the per-user "active" promo chosen before checkout
+    def __init__(self, db: Database):
+        self.db = db
+
+    async def get_available(self, code: str):
+        return await self.db.fetchrow(
+            "select * from promocodes where code=$1 and is_active=1 and (max_uses=0 or used_count < max_uses)",
+            code,
+        )
+
+    async def list_available(self):
+        return await self.db.fetch(
+            "select code, discount_percent, min_amount, max_uses, used_count from promocodes "
+            "where is_active=1 and (max_uses=0 or used_count < max_uses)"
+        )
+
+    async def list_all(self):
+        return await self.db.fetch("select * from promocodes order by created_at desc")
+
+    async def exists(self, code: str) -> bool:
+        return await self.db.fetchrow("select 1 as x from promocodes where code=$1", code) is not None
+
+    async def create(self, code: str, discount_percent: int, min_amount: int, max_uses: int):
+        await self.db.execute(
+            _insert_sql("promocodes", ["code", "discount_percent", "min_amount", "max_uses", "is_active"]),
+            code,
+            discount_percent,
+            min_amount,
+            max_uses,
+            1,
+        )
+
+    async def delete(self, code: str) -> bool:
+        return rows_affected(await self.db.execute("delete from promocodes where code=$1", code)) > 0
+
+    async def consume(self, code: str) -> bool:
+        # Conditional use: false once the code is disabled or out of uses
+        status = await self.db.execute(
+            "update promocodes set used_count=used_count+1 "
+            "where code=$1 and is_active=1 and (max_uses=0 or used_count < max_uses)",
+            code,
+        )
+        return rows_affected(status) == 1
+
+    async def release(self, code: str):
+        # Gives back a use taken by consume() for an order that was never placed
+        await self.db.execute("update promocodes set used_count=used_count-1 where code=$1 and used_count > 0", code)
+
+    async def user_active(self, user_id: int, code: str | None = None):
+        if code is None:
+            return await self.db.fetchrow("select * from user_active_promocodes where user_id=$1", user_id)
+        return await self.db.fetchrow(
+            "select * from user_active_promocodes where user_id=$1 and promo_code=$2", user_id, code
+        )
+
+    async def set_user_active(self, user_id: int, promo):
+        # A user holds at most one active promo code
+        async with self.db.transaction():
+            await self.db.execute("delete from user_active_promocodes where user_id=$1", user_id)
+            await self.db.execute(
+                _insert_sql("user_active_promocodes", ["user_id", "promo_code", "discount_percent", "min_amount"]),
+                user_id,
+                promo["code"],
+                promo["discount_percent"],
+                promo["min_amount"],
+            )
+
+    async def clear_user_active(self, user_id: int, code: str | None = None):
+        if code is None:
+            await self.db.execute("delete from user_active_promocodes where user_id=$1", user_id)
+        else:
+            await self.db.execute(
+                "delete from user_active_promocodes where user_id=$1 and promo_code=$2", user_id, code
+            )
+
+
+class Referrals:
+    # Per-user counters live on users (ref_count, ref_rewards); the admin leaderboard
+    # is a cached snapshot, kept warm by start_refresh() so admins never wait on the
+    # full users scan; without the loop it is recomputed lazily after leaderboard_ttl
+    def __init__(self, db: Database, leaderboard_ttl: float = 300.0):
+        self.db = db
+        self.leaderboard = TTLCache(maxsize=16, ttl=leaderboard_ttl)
+        self._top_limits = {5}
+        self._refresh_task: asyncio.Task | None = None
+
+    async def referred_users(self, referrer_id: int, limit: int = 10):
+        rows = await self.db.fetch(
+            "select username, telegram_id, created_at from users where referrer_id=$1 "
+            "order by created_at desc, id desc limit $2",
+            referrer_id,
+            limit,
+        )
+        for r in rows:
+            r["created_at"] = _to_datetime(r["created_at"])
+        return rows
+
+    async def totals(self, referrer_id: int) -> dict:
+        row = await self.db.fetchrow("select ref_count, ref_rewards from users where id=$1", referrer_id)
+        return {"count": int(row["ref_count"] or 0), "rewards": int(row["ref_rewards"] or 0)} if row else {"count": 0, "rewards": 0}
+
+    async def add_reward(self, referrer_id: int, referred_user_id: int, order_id: int, amount: int):
+        async with self.db.transaction():
+            await self.db.execute(
+                _insert_sql("referral_rewards", ["referrer_id", "referred_user_id", "order_id", "reward_amount"]),
+                referrer_id,
+                referred_user_id,
+                order_id,
+                amount,
+            )
+            await self.db.execute("update users set ref_rewards=ref_rewards+$1 where id=$2", amount, referrer_id)
+
+    async def overview(self) -> dict:
+        cached = self.leaderboard.get("overview")
+        if cached is not None:
+            return cached
+        return await self._load_overview()
+
+    async def top_referrers(self, limit: int = 5):
+        cached = self.leaderboard.get(("top", limit))
+        if cached is not None:
+            return cached
+        self._top_limits.add(limit)
+        return await self._load_top(limit)
+
+    async def _load_overview(self) -> dict:
+        row = await self.db.fetchrow(
+            "select count(*) as total_users, "
+            "coalesce(sum(ref_count), 0) as referred_users, "
+            "coalesce(sum(ref_rewards), 0) as total_rewards from users"
+        )
+        result = {k: int(v or 0) for k, v in row.items()}
+        self.leaderboard.set("overview", result)
+        return result
+
+    async def _load_top(self, limit: int):
+        rows = await self.db.fetch(
+            "select username, telegram_id, ref_count, ref_rewards as total_reward from users "
+            "where ref_count > 0 order by ref_count desc, id asc limit $1",
+            limit,
+        )
+        for r in rows:
+            r["ref_count"] = int(r["ref_count"])
+            r["total_reward"] = int(r["total_reward"])
+        self.leaderboard.set(("top", limit), rows)
+        return rows
+
+    async def refresh(self):
+        await self._load_overview()
+        for limit in sorted(self._top_limits):
+            await self._load_top(limit)
+
+    def start_refresh(self, interval: float | None = None):
+        # Twice per TTL by default, so a cached entry is replaced before it expires
+        interval = interval or self.leaderboard.ttl / 2
+
+        async def loop():
+            while True:
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    print(f"Leaderboard refresh failed: {e}")
+                await asyncio.sleep(interval)
+
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(loop())
+
+    async def close(self):
+        if self._refresh_task:
+            self._refresh_task.cancel()
+            try:
+                await self._refresh_task
+            except asyncio.CancelledError:
+                pass
+            self._refresh_task = None
+
+
+class Settings:
+    # Runtime key/value settings stored in the DB (not to be confused with config.Settings)
+    def __init__(self, db: Database):
+        self.db = db
+
+    async def get(self, key: str, default: str | None = None) -> str | None:
+        row = await self.db.fetchrow("select value from settings where key=$1", key)
+        return row["value"] if row else default
+
+    async def get_int(self, key: str, default: int) -> int:
+        value = await self.get(key)
+        try:
+            return int(value) if value is not None else default
+        except ValueError:
+            return default
+
+    async def set(self, key: str, value):
+        await self.db.execute(
+            "insert into settings (key, value) values ($1, $2) "
+            "on conflict (key) do update set value=excluded.value, updated_at=current_timestamp",
+            key,
+            str(value),
+        )
+
+
+class WebhookEvents:
+    def __init__(self, db: Database, cache_size: int = 10000, cache_ttl: float = 86400.0):
+        self.db = db
+        # Recently processed keys, so retried deliveries are answered without touching the DB
+        self.recent = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    def seen(self, key: str) -> bool:
+        return self.recent.get(key) is not None
+
+    def remember(self, key: str):
+        self.recent.set(key, True)
+
+    async def claim(self, key: str) -> bool:
+        # True only for the first delivery; run inside the transaction that applies the event
+        status = await self.db.execute(
+            "insert into processed_events(event_key) values($1) on conflict (event_key) do nothing",
+            key,
+        )
+        return rows_affected(status) == 1
+
+
+class Broadcasts:
+    def __init__(self, db: Database):
+        self.db = db
+
+    async def create(self, text: str, admin_chat_id: int, total: int):
+        return await self.db.execute_returning(
+            "insert into broadcasts(text, status, admin_chat_id, total) values($1,'running',$2,$3) returning *",
+            text,
+            admin_chat_id,
+            total,
+        )
+
+    async def get(self, broadcast_id: int):
+        return await self.db.fetchrow("select * from broadcasts where id=$1", broadcast_id)
+
+    async def recent(self, limit: int = 5):
+        return await self.db.fetch("select * from broadcasts order by id desc limit $1", limit)
+
+    async def advance(self, broadcast_id: int, last_user_id: int, sent: int, failed: int, blocked: int):
+        # Cursor and counters move together so a resumed run neither skips nor repeats a page
+        await self.db.execute(
+            """
+            update broadcasts set last_user_id=$2, sent=sent+$3, failed=failed+$4, blocked=blocked+$5
+            where id=$1
+            """,
+            broadcast_id,
+            last_user_id,
+            sent,
+            failed,
+            blocked,
+        )
+
+    async def finish(self, broadcast_id: int, status: str):
+        await self.db.execute(
+            "update broadcasts set status=$2, finished_at=current_timestamp where id=$1 and status='running'",
+            broadcast_id,
+            status,
+        )
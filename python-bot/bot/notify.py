@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from .cache import TTLCache
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters are served in arrival order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        # After a flood-control reply nobody may send until the window has passed
+        self._tokens = min(self._tokens, 0.0) - seconds * self.rate
+
+
+class Notifier:
+    # Telegram allows ~30 messages/s per bot and ~1 message/s per chat
+    def __init__(
+        self,
+        bot: Bot,
+        global_rate: float = 25.0,
+        per_chat_rate: float = 1.0,
+        per_chat_burst: float = 3.0,
+        max_retries: int = 3,
+    ):
+        self.bot = bot
+        self._global = TokenBucket(global_rate, capacity=global_rate)
+        self._per_chat_rate = per_chat_rate
+        self._per_chat_burst = per_chat_burst
+        # Idle chats drop out; a fresh bucket starts full, which is what an idle one would be
+        self._chats = TTLCache(maxsize=50000, ttl=max(60.0, per_chat_burst / per_chat_rate))
+        self._max_retries = max_retries
+        self.sent = 0
+        self.retry_after = 0
+        self.failed: dict[str, int] = {}
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self._per_chat_rate, capacity=self._per_chat_burst)
+            self._chats.set(chat_id, bucket)
+        return bucket
+
+    def _fail(self, reason: str):
+        self.failed[reason] = self.failed.get(reason, 0) + 1
+
+    async def send(self, chat_id: int, text: str, **kwargs) -> bool:
+        # False when Telegram refuses the chat for good (blocked bot, chat not found);
+        # other errors are raised so the caller (e.g. a job) can retry
+        return await self.deliver(chat_id, text, **kwargs) == "sent"
+
+    async def deliver(self, chat_id: int, text: str, **kwargs) -> str:
+        # "sent", "forbidden" or "bad_request"
+        bucket = self._bucket(chat_id)
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            await self._global.acquire()
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                self.sent += 1
+                return "sent"
+            except TelegramRetryAfter as e:
+                self.retry_after += 1
+                if attempt >= self._max_retries:
+                    self._fail("retry_after")
+                    raise
+                # Flood control applies to the bot as a whole, not only to this chat;
+                # the next acquire() waits the window out
+                bucket.pause(e.retry_after)
+                self._global.pause(e.retry_after)
+                attempt += 1
+            except TelegramForbiddenError:
+                self._fail("forbidden")
+                return "forbidden"
+            except TelegramBadRequest:
+                self._fail("bad_request")
+                return "bad_request"
+            except Exception:
+                self._fail("error")
+                raise
+
+    async def fan_out(self, chat_ids, text: str, **kwargs) -> int:
+        # Concurrent send to every chat; returns how many got the message
+        results = await asyncio.gather(
+            *(self.send(chat_id, text, **kwargs) for chat_id in chat_ids if chat_id),
+            return_exceptions=True,
+        )
+        return sum(1 for r in results if r is True)
+
+    def metrics(self) -> list:
+        samples = [
+            ("notifications_sent_total", {}, self.sent),
+            ("notifications_retry_after_total", {}, self.retry_after),
+        ]
+        samples += [("notifications_failed_total", {"reason": r}, n) for r, n in self.failed.items()]
+        return samples
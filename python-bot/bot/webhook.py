@@ -1,9 +1,15 @@
+import asyncio
 import hashlib
 import hmac
 import json
 from aiohttp import web
-from aiogram import Bot
-from .models import Orders
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from .ingress import UpdateQueue
+from .jobs import JobQueue
+from .metrics import registry as metrics
+from .models import Orders, WebhookEvents
+from .notify import Notifier
 
 
 def verify_signature(secret: str | None, body: bytes, signature_header: str | None) -> bool:
@@ -15,8 +21,112 @@ def verify_signature(secret: str | None, body: bytes, signature_header: str | No
     return signature_header == digest
 
 
-def create_app(bot: Bot, orders: Orders, admin_ids: list[int], secret: str | None):
+def register_payment_jobs(jobs: JobQueue, notifier: Notifier, orders: Orders, admin_ids: list[int]):
+    async def invoice_paid(payload: dict):
+        # Status change and the notifications it triggers commit together;
+        # each message is its own job so a retry never resends the others
+        notify_ids = []
+        async with orders.db.transaction():
+            order = await orders.with_user_by_invoice(int(payload["invoice_id"]))
+            if order and await orders.mark_paid(order["id"]):
+                text_admin = f"✅ Оплачен заказ #{order['id']}\n{order['location']} • {order['specs']} • {order['price']} RUB\nВыдайте товар."
+                for admin_id in admin_ids:
+                    notify_ids.append(await jobs.add("notify", {"chat_id": admin_id, "text": text_admin}))
+                if order.get("telegram_id"):
+                    notify_ids.append(await jobs.add("notify", {
+                        "chat_id": int(order["telegram_id"]),
+                        "text": "✅ Оплата подтверждена. Ждите выдачи от администратора.",
+                    }))
+        for job_id in notify_ids:
+            jobs.submit(job_id)
+
+    async def notify(payload: dict):
+        # Rate limited; a blocked chat is dropped, anything else fails the job for a retry
+        await notifier.send(payload["chat_id"], payload["text"])
+
+    jobs.register("invoice_paid", invoice_paid)
+    jobs.register("notify", notify)
+
+
+def add_telegram_webhook(
+    app: web.Application,
+    bot: Bot,
+    dp: Dispatcher | None,
+    secret: str,
+    path: str = "/telegram-webhook",
+    max_concurrency: int = 64,
+    update_queue: UpdateQueue | None = None,
+):
+    # Telegram waits for our 200 before sending the next batch, so updates are
+    # acked once scheduled; the semaphore caps in-flight handlers and pushes back
+    # on Telegram (the request waits) when all slots are busy
+    slots = asyncio.Semaphore(max_concurrency)
+    in_flight: set[asyncio.Task] = set()
+
+    async def process(update: Update):
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            print(f"Telegram update {update.update_id} failed: {e}")
+        finally:
+            slots.release()
+
+    async def handle(request: web.Request):
+        if not secret or not hmac.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), secret
+        ):
+            return web.Response(status=401)
+        try:
+            raw = await request.json()
+            update = Update.model_validate(raw, context={"bot": bot})
+        except Exception:
+            return web.Response(status=400)
+        if update_queue is not None:
+            # Ingress mode: persist for the bot workers and ack
+            await update_queue.push(raw)
+            return web.Response()
+        await slots.acquire()
+        task = asyncio.create_task(process(update))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+        return web.Response()
+
+    async def drain(app: web.Application):
+        if in_flight:
+            await asyncio.gather(*in_flight, return_exceptions=True)
+
+    app.router.add_post(path, handle)
+    app.on_shutdown.append(drain)
+
+
+def create_app(
+    bot: Bot,
+    orders: Orders,
+    events: WebhookEvents,
+    jobs: JobQueue,
+    admin_ids: list[int],
+    secret: str | None,
+    metrics_token: str | None = None,
+    notifier: Notifier | None = None,
+    dp: Dispatcher | None = None,
+    telegram_secret: str | None = None,
+    telegram_path: str = "/telegram-webhook",
+    telegram_max_concurrency: int = 64,
+    update_queue: UpdateQueue | None = None,
+):
     app = web.Application()
+    register_payment_jobs(jobs, notifier or Notifier(bot), orders, admin_ids)
+    if dp is not None or update_queue is not None:
+        add_telegram_webhook(
+            app, bot, dp, telegram_secret, telegram_path, telegram_max_concurrency, update_queue=update_queue
+        )
+
+    async def metrics_endpoint(request: web.Request):
+        if not hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {metrics_token}"
+        ):
+            return web.Response(status=401)
+        return web.Response(text=metrics.render(), content_type="text/plain")
 
     async def handle(request: web.Request):
         raw = await request.read()
@@ -35,23 +145,22 @@ def create_app(bot: Bot, orders: Orders, admin_ids: list[int], secret: str | Non
         if not invoice_id:
             return web.json_response({"ok": True})
 
-        order = await orders.with_user_by_invoice(int(invoice_id))
-        if order:
-            await orders.set_status(order["id"], "paid")
-            text_admin = f"✅ Оплачен заказ #{order['id']}\n{order['location']} • {order['specs']} • {order['price']} RUB\nВыдайте товар."
-            for admin_id in admin_ids:
-                try:
-                    await bot.send_message(admin_id, text_admin)
-                except Exception:
-                    pass
-            if order.get("telegram_id"):
-                try:
-                    await bot.send_message(int(order["telegram_id"]), "✅ Оплата подтверждена. Ждите выдачи от администратора.")
-                except Exception:
-                    pass
+        # CryptoBot retries a delivery until it gets 200; an invoice is paid only once.
+        # Ack as soon as the event is durable, the job queue does the rest
+        key = f"invoice_paid:{int(invoice_id)}"
+        if events.seen(key):
+            return web.json_response({"ok": True})
+        job_id = None
+        async with orders.db.transaction():
+            if await events.claim(key):
+                job_id = await jobs.add("invoice_paid", {"invoice_id": int(invoice_id)})
+        events.remember(key)
+        if job_id is not None:
+            jobs.submit(job_id)
         return web.json_response({"ok": True})
 
     app.add_routes([web.post("/cryptobot-webhook", handle)])
+    # Pool and queue internals are not public: without a token /metrics is not served at all
+    if metrics_token:
+        app.add_routes([web.get("/metrics", metrics_endpoint)])
     return app
-
-
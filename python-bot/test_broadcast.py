@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Проверка рассылки (bot/broadcast.py): постраничный обход пользователей,
+продолжение с сохраненного курсора после перезапуска и пометка
+пользователей, заблокировавших бота.
+"""
+
+import asyncio
+import os
+import tempfile
+
+from aiogram.exceptions import TelegramForbiddenError
+
+from bot.broadcast import Broadcaster
+from bot.db import Database
+from bot.jobs import JobQueue
+from bot.models import Broadcasts, Users
+from bot.notify import Notifier
+
+BLOCKED = {1005, 1017}
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id in BLOCKED:
+            raise TelegramForbiddenError(None, "bot was blocked by the user")
+        self.sent.append(chat_id)
+
+
+async def scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "broadcast.sqlite3")
+    db = Database(f"sqlite:///{path}")
+    await db.connect()
+    try:
+        await db.ensure_schema()
+        users = Users(db, cache_size=0)
+        for tg in range(1001, 1026):
+            await users.upsert(f"user{tg}", tg)
+
+        bot = FakeBot()
+        jobs = JobQueue(db)
+        broadcaster = Broadcaster(Broadcasts(db), users, Notifier(bot, global_rate=1000, per_chat_rate=1000), jobs, page_size=10)
+        b = await broadcaster.start("Новые локации!", admin_chat_id=1)
+
+        # Процесс "упал" после первой страницы: курсор и счетчики уже сохранены
+        await broadcaster.broadcasts.advance(b["id"], 10, 10, 0, 0)
+        await jobs.start()
+        await jobs.join()
+        await jobs.close()
+
+        final = await broadcaster.broadcasts.get(b["id"])
+        blocked = await db.fetch("select telegram_id from users where is_blocked=1 order by telegram_id")
+        return {
+            "total": b["total"],
+            "recipients": sorted(bot.sent),
+            "final": final,
+            "blocked": [r["telegram_id"] for r in blocked],
+            "reachable_after": await users.count_reachable(),
+        }
+    finally:
+        await db.close()
+
+
+def test_broadcast():
+    result = asyncio.run(scenario())
+    final = result["final"]
+    assert result["total"] == 25
+    # Первые 10 пользователей уже получили сообщение до "падения"; админ получает итог
+    assert [t for t in result["recipients"] if t != 1] == [t for t in range(1011, 1026) if t not in BLOCKED]
+    assert 1 in result["recipients"]
+    assert final["status"] == "done"
+    assert (final["sent"], final["blocked"], final["failed"]) == (24, 1, 0)
+    assert final["last_user_id"] == 25
+    assert result["blocked"] == [1017]
+    assert result["reachable_after"] == 24
+
+
+if __name__ == "__main__":
+    test_broadcast()
+    print("✅ Рассылка продолжается с курсора и чистит заблокировавших")
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Проверка снимка каталога (bot/catalog.py): rebuild() целиком подменяет
+снимок (уже выданный читателю старый снимок не меняется), клавиатуры
+строятся с наценкой, локации идут по алфавиту, тарифы — от дешевых к
+дорогим, а длинные подписи обрезаются.
+"""
+
+import asyncio
+import os
+import tempfile
+
+from bot.catalog import Catalog
+from bot.db import Database
+from bot.models import Tariffs
+
+
+def buttons(markup) -> list:
+    return [(b.text, b.callback_data) for row in markup.inline_keyboard for b in row]
+
+
+async def scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "catalog.sqlite3")
+    db = Database(f"sqlite:///{path}")
+    await db.connect()
+    try:
+        await db.ensure_schema()
+        tariffs = Tariffs(db)
+        catalog = Catalog(tariffs, markup_percent=10)
+        out = {"empty": (catalog.snapshot.locations, catalog.snapshot.locations_markup)}
+
+        await tariffs.create("США", "2vCPU / 2048 MB RAM / SSD 20 Gb", 759)
+        ru_big = await tariffs.create("Россия", "4 Gb RAM / 2 Core CPU / SSD 40 Gb", 1000)
+        ru_small = await tariffs.create("Россия", "1 Gb RAM / 1 Core CPU / SSD 10 Gb", 300)
+        before = catalog.snapshot
+        first = await catalog.rebuild()
+        out["swapped"] = (first is catalog.snapshot, before is not first, before.locations)
+        out["locations"] = first.locations
+        out["locations_kb"] = buttons(first.locations_markup)
+        out["back_kb"] = buttons(first.back_markup)
+        out["ru_kb"] = buttons(first.location_markups["Россия"])
+        out["ids"] = (ru_small["id"], ru_big["id"])
+
+        # Новый тариф и длинная подпись: старый снимок остается прежним
+        await tariffs.create("Германия", "8 Gb RAM / 4 Core CPU / NVMe 160 Gb / 1 Gbit/s безлимитный трафик", 2000)
+        second = await catalog.rebuild()
+        out["old_kept"] = first.locations
+        out["rebuilt"] = second.locations
+        out["long_label"] = buttons(second.location_markups["Германия"])[0][0]
+        out["prices"] = [t["price_marked"] for t in second.tariffs_by_location["Россия"]]
+        return out
+    finally:
+        await db.close()
+
+
+def test_catalog_snapshot():
+    result = asyncio.run(scenario())
+    small, big = result["ids"]
+    assert result["empty"] == ([], None)
+    assert result["swapped"] == (True, True, [])
+    assert result["locations"] == ["Россия", "США"]
+    assert result["locations_kb"] == [("🇷🇺 Россия", "loc:Россия"), ("🇺🇸 США", "loc:США")]
+    assert result["back_kb"] == [("Россия", "loc:Россия"), ("США", "loc:США")]
+    # 300 и 1000 RUB +10%, дешевый первым, кнопка "Назад" последней
+    assert result["ru_kb"] == [
+        ("330 RUB • 1 Gb RAM / 1 Core CPU / SSD 10 Gb", f"buy:{small}"),
+        ("1100 RUB • 4 Gb RAM / 2 Core CPU / SSD 40 Gb", f"buy:{big}"),
+        ("↩️ Назад", "back:catalog"),
+    ]
+    assert result["old_kept"] == ["Россия", "США"]
+    assert result["rebuilt"] == ["Германия", "Россия", "США"]
+    assert len(result["long_label"]) == 61 and result["long_label"].startswith("2200 RUB • ")
+    assert result["long_label"].endswith("…")
+    assert result["prices"] == [330, 1100]
+
+
+if __name__ == "__main__":
+    test_catalog_snapshot()
+    print("✅ Снимок каталога подменяется целиком, клавиатуры с наценкой")
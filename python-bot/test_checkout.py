@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Проверка оформления заказа (bot/checkout.py): контекст цены читается одним
+запросом, заказ со скидкой, списание бонусов и использование промокода
+фиксируются одной транзакцией, а исчерпанный промокод не оставляет
+"половины" заказа. Бонусы списываются условно (двойное нажатие не уводит
+баланс в минус), каждое движение пишется в bonus_ledger. Счет создается
+только после резервирования заказа: откат не оставляет оплачиваемого счета
+без заказа, а ошибка CryptoBot возвращает бонусы и промокод. Резерв упавшего
+процесса снимает release_stale(), а счет, который не удалось привязать к
+заказу, удаляется вместе с резервом.
+"""
+
+import asyncio
+import os
+import tempfile
+
+from bot.catalog import Catalog
+from bot.checkout import CheckoutError, CheckoutService
+from bot.db import Database
+from bot.models import Orders, Promocodes, Tariffs, Users
+
+
+class Crash(BaseException):
+    # Процесс умер посреди оформления: обработчики Exception его не видят
+    pass
+
+
+class FakeCryptoBot:
+    def __init__(self):
+        self.invoices = 0
+        self.down = False
+        self.crash = False
+        self.on_invoice = None
+        self.deleted = []
+
+    async def rub_to_usdt(self, amount_rub: float) -> float:
+        return amount_rub / 100
+
+    async def create_invoice(self, asset, amount, description, payload=None):
+        if self.down:
+            raise RuntimeError("CryptoBot API error: 503")
+        if self.crash:
+            raise Crash()
+        if self.on_invoice:
+            await self.on_invoice()
+        self.invoices += 1
+        return {"invoice_id": 9000 + self.invoices, "pay_url": "https://pay.example/i"}
+
+    async def delete_invoice(self, invoice_id, timeout=None):
+        self.deleted.append(invoice_id)
+        return True
+
+
+async def scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "checkout.sqlite3")
+    db = Database(f"sqlite:///{path}")
+    await db.connect()
+    try:
+        await db.ensure_schema()
+        tariffs, users, promos = Tariffs(db), Users(db, cache_size=0), Promocodes(db)
+        orders = Orders(db, markup_percent=10)
+        catalog = Catalog(tariffs, markup_percent=10)
+        cryptobot = FakeCryptoBot()
+        checkout = CheckoutService(db, orders, users, promos, catalog, cryptobot)
+
+        tariff = await tariffs.create("Россия", "4 Gb RAM / 2 Core CPU / SSD 40 Gb", 1000)
+        alice = await users.upsert("alice", 3001)
+        bob = await users.upsert("bob", 3002)
+        await users.credit_bonus(alice["id"], 300, "manual")
+        await promos.create("ONCE", 20, 0, 1)
+        promo = await promos.get_available("ONCE")
+        await promos.set_user_active(alice["id"], promo)
+        await promos.set_user_active(bob["id"], promo)
+        out = {}
+
+        quote = await checkout.quote(alice["id"], tariff["id"])
+        out["quote"] = (quote.price, quote.bonus_balance, quote.promo_code, quote.promo_discount)
+        out["missing"] = await checkout.quote(alice["id"], 999)
+
+        placed = await checkout.place(quote, use_promo=True)
+        out["promo_order"] = await db.fetchrow(
+            "select status, invoice_id, promo_code, discount_amount, final_price from orders where id=$1",
+            placed.order["id"],
+        )
+        out["alice_active"] = await promos.user_active(alice["id"])
+
+        # Последнее использование уже забрал другой заказ: откатывается всё
+        bob_quote = await checkout.quote(bob["id"], tariff["id"])
+        try:
+            await checkout.place(bob_quote, use_promo=True)
+            out["bob_error"] = None
+        except CheckoutError as e:
+            out["bob_error"] = str(e)
+        out["bob_orders"] = len(await orders.by_user(bob["id"]))
+        out["bob_active"] = (await promos.user_active(bob["id"]))["promo_code"]
+
+        # Двойное нажатие: обе котировки видят 300 бонусов, списаться они могут только один раз
+        quotes = [await checkout.quote(alice["id"], tariff["id"]) for _ in range(2)]
+        tapped = await asyncio.gather(*(checkout.place(q, use_bonus=True) for q in quotes), return_exceptions=True)
+        bonus = next(p for p in tapped if not isinstance(p, Exception))
+        out["bonus"] = (bonus.bonus, bonus.final_price, bonus.amount_usdt)
+        out["tap_errors"] = [str(p) for p in tapped if isinstance(p, Exception)]
+        out["alice_orders"] = len(await orders.by_user(alice["id"]))
+        # Откатившиеся оформления (промокод, двойное нажатие) не создали ни одного счета
+        out["invoices"] = cryptobot.invoices
+
+        # Реферальное начисление за один и тот же заказ — только однажды
+        out["referral"] = [
+            await users.credit_bonus(bob["id"], 100, "referral", placed.order["id"]) for _ in range(2)
+        ]
+        out["ledger"] = [
+            (r["user_id"], r["amount"], r["balance_after"], r["reason"])
+            for r in await db.fetch("select * from bonus_ledger order by id")
+        ]
+        out["alice_balance"] = (await db.fetchrow("select bonus_balance from users where id=$1", alice["id"]))["bonus_balance"]
+        out["used_count"] = (await db.fetchrow("select used_count from promocodes where code='ONCE'"))["used_count"]
+
+        # CryptoBot недоступен: резерв снимается — заказ отменен, бонусы и промокод возвращены
+        carol = await users.upsert("carol", 3003)
+        await users.credit_bonus(carol["id"], 100, "manual")
+        await promos.create("SPRING", 10, 0, 5)
+        await promos.set_user_active(carol["id"], await promos.get_available("SPRING"))
+        cryptobot.down = True
+        carol_quote = await checkout.quote(carol["id"], tariff["id"])
+        try:
+            await checkout.place(carol_quote, use_promo=True, use_bonus=True)
+            out["down_error"] = None
+        except CheckoutError as e:
+            out["down_error"] = str(e)
+        out["down_orders"] = [(o["status"], o["invoice_id"]) for o in await orders.by_user(carol["id"])]
+        out["down_balance"] = (await db.fetchrow("select bonus_balance from users where id=$1", carol["id"]))["bonus_balance"]
+        out["down_ledger"] = [
+            (r["amount"], r["reason"])
+            for r in await db.fetch("select * from bonus_ledger where user_id=$1 order by id", carol["id"])
+        ]
+        out["down_promo"] = (
+            (await db.fetchrow("select used_count from promocodes where code='SPRING'"))["used_count"],
+            (await promos.user_active(carol["id"]))["promo_code"],
+        )
+        out["down_invoices"] = cryptobot.invoices
+        return out
+    finally:
+        await db.close()
+
+
+def test_checkout():
+    result = asyncio.run(scenario())
+    # 1000 RUB +10% = 1100, промокод 20% = 220
+    assert result["quote"] == (1100, 300, "ONCE", 220)
+    assert result["missing"] is None
+    assert result["promo_order"] == {
+        "status": "created", "invoice_id": 9001, "promo_code": "ONCE", "discount_amount": 220, "final_price": 880,
+    }
+    assert result["alice_active"] is None
+    assert result["bob_error"] == "Промокод больше недоступен"
+    assert result["bob_orders"] == 0
+    assert result["bob_active"] == "ONCE"
+    assert result["bonus"] == (300, 800, 8.0)
+    assert result["tap_errors"] == ["Недостаточно бонусов на балансе"]
+    assert result["alice_orders"] == 2
+    assert result["invoices"] == 2
+    assert result["referral"] == [100, None]
+    assert result["ledger"] == [(1, 300, 300, "manual"), (1, -300, 0, "checkout"), (2, 100, 100, "referral")]
+    assert result["alice_balance"] == 0
+    assert result["used_count"] == 1
+    assert result["down_error"] == "Не удалось создать счет, попробуйте позже"
+    assert result["down_orders"] == [("cancelled", None)]
+    assert result["down_balance"] == 100
+    assert result["down_ledger"] == [(100, "manual"), (-100, "checkout"), (100, "checkout_refund")]
+    assert result["down_promo"] == (0, "SPRING")
+    assert result["down_invoices"] == 2
+
+
+async def release_scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "checkout_release.sqlite3")
+    db = Database(f"sqlite:///{path}")
+    await db.connect()
+    try:
+        await db.ensure_schema()
+        tariffs, users, promos = Tariffs(db), Users(db, cache_size=0), Promocodes(db)
+        orders = Orders(db)
+        cryptobot = FakeCryptoBot()
+        checkout = CheckoutService(db, orders, users, promos, Catalog(tariffs), cryptobot)
+        tariff = await tariffs.create("Россия", "4 Gb RAM / 2 Core CPU / SSD 40 Gb", 1000)
+        dave = await users.upsert("dave", 3004)
+        await users.credit_bonus(dave["id"], 100, "manual")
+        await promos.create("AUTUMN", 10, 0, 5)
+        out = {}
+
+        async def state() -> tuple:
+            return (
+                [o["status"] for o in await orders.by_user(dave["id"])],
+                (await db.fetchrow("select bonus_balance from users where id=$1", dave["id"]))["bonus_balance"],
+                (await db.fetchrow("select used_count from promocodes where code='AUTUMN'"))["used_count"],
+            )
+
+        # Процесс упал после резервирования, до счета: заказ остается pending
+        await promos.set_user_active(dave["id"], await promos.get_available("AUTUMN"))
+        cryptobot.crash = True
+        try:
+            await checkout.place(await checkout.quote(dave["id"], tariff["id"]), use_promo=True, use_bonus=True)
+        except Crash:
+            pass
+        cryptobot.crash = False
+        out["crashed"] = await state()
+        out["fresh_sweep"] = await checkout.release_stale(600)
+        async with db.transaction():
+            await db.execute("update orders set created_at=$1 where user_id=$2", "2000-01-01 00:00:00", dave["id"])
+        out["sweep"] = (await checkout.release_stale(600), await checkout.release_stale(600))
+        out["swept"] = await state()
+
+        # Резерв снят, пока создавался счет: attach_invoice вернул None
+        await users.credit_bonus(dave["id"], 100, "manual")
+
+        async def sweep_now():
+            await checkout.release_stale(-1)
+
+        cryptobot.on_invoice = sweep_now
+        try:
+            await checkout.place(await checkout.quote(dave["id"], tariff["id"]), use_bonus=True)
+            out["released_error"] = None
+        except CheckoutError as e:
+            out["released_error"] = str(e)
+        cryptobot.on_invoice = None
+        out["released"] = await state()
+
+        # Сбой базы при привязке счета
+        async def broken_attach(order_id, invoice_id):
+            raise RuntimeError("database is locked")
+
+        orders.attach_invoice = broken_attach
+        try:
+            await checkout.place(await checkout.quote(dave["id"], tariff["id"]), use_bonus=True)
+            out["attach_error"] = None
+        except CheckoutError as e:
+            out["attach_error"] = str(e)
+        out["attached"] = await state()
+        out["deleted"] = (cryptobot.invoices, cryptobot.deleted)
+        out["ledger"] = [
+            (r["amount"], r["reason"])
+            for r in await db.fetch("select * from bonus_ledger where user_id=$1 order by id", dave["id"])
+        ]
+
+        checkout.start_sweep(600, interval=0.01)
+        await asyncio.sleep(0.05)
+        await checkout.close()
+        out["closed"] = checkout._sweep_task
+        return out
+    finally:
+        await db.close()
+
+
+def test_release_reservations():
+    result = asyncio.run(release_scenario())
+    assert result["crashed"] == (["pending"], 0, 1)
+    # Свежий резерв не трогается: оформление может еще идти
+    assert result["fresh_sweep"] == 0
+    assert result["sweep"] == (1, 0)
+    assert result["swept"] == (["cancelled"], 100, 0)
+    assert result["released_error"] == "Не удалось оформить заказ, попробуйте еще раз"
+    assert result["released"] == (["cancelled", "cancelled"], 200, 0)
+    assert result["attach_error"] == "Не удалось оформить заказ, попробуйте еще раз"
+    assert result["attached"] == (["cancelled", "cancelled", "cancelled"], 200, 0)
+    assert result["deleted"] == (2, [9001, 9002])
+    # Каждый резерв возвращен ровно один раз, даже когда sweep и оформление снимают его наперегонки
+    assert result["ledger"] == [
+        (100, "manual"), (-100, "checkout"), (100, "checkout_refund"),
+        (100, "manual"), (-200, "checkout"), (200, "checkout_refund"),
+        (-200, "checkout"), (200, "checkout_refund"),
+    ]
+    assert result["closed"] is None
+
+
+if __name__ == "__main__":
+    test_checkout()
+    test_release_reservations()
+    print("✅ Оформление заказа атомарно")
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Проверка клиента CryptoBot (bot/cryptobot.py) на httpx.MockTransport:
+429 и 5xx повторяются с backoff (Retry-After учитывается), 4xx и сбои
+неидемпотентного createInvoice после отправки не повторяются, клиент
+закрывается при остановке. Кэш курсов: попадание в пределах TTL, обновление
+после него, обратная пара USDT→RUB и последний удачный курс при сбое API.
+"""
+
+import asyncio
+
+import httpx
+
+from bot.cryptobot import CryptoBot
+
+
+def ok(result) -> httpx.Response:
+    return httpx.Response(200, json={"ok": True, "result": result})
+
+
+def client(responses: list, **kwargs) -> tuple[CryptoBot, list, list]:
+    # Отвечает по очереди из responses; элемент-исключение выбрасывается транспортом
+    requests, delays = [], []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append(request.url.path)
+        item = responses.pop(0)
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    cb = CryptoBot("token", retries=2, backoff_base=0.01, transport=httpx.MockTransport(handler), **kwargs)
+    backoff = cb._backoff
+
+    def record(attempt, response):
+        delays.append(backoff(attempt, response))
+        return 0
+
+    cb._backoff = record
+    return cb, requests, delays
+
+
+async def call(cb: CryptoBot, coro):
+    try:
+        return await coro
+    except Exception as e:
+        return type(e).__name__
+    finally:
+        await cb.close()
+
+
+async def retry_scenario() -> dict:
+    out = {}
+
+    cb, requests, delays = client([httpx.Response(429, headers={"Retry-After": "3"}), httpx.Response(503), ok([])])
+    out["retried"] = (await call(cb, cb.get_exchange_rates()), len(requests), delays[0], delays[1] <= 0.02)
+
+    cb, requests, delays = client([httpx.Response(502)] * 3)
+    out["exhausted"] = (await call(cb, cb.get_exchange_rates()), len(requests))
+
+    cb, requests, delays = client([httpx.Response(400), ok([])])
+    out["bad_request"] = (await call(cb, cb.get_exchange_rates()), len(requests))
+
+    cb, requests, delays = client([httpx.ConnectError("refused"), ok([])])
+    out["connect_error"] = (await call(cb, cb.get_exchange_rates()), len(requests))
+
+    # createInvoice: 5xx и таймаут чтения могли уже создать счет — повтор дал бы второй
+    invoice = {"invoice_id": 1, "pay_url": "https://pay.example/i"}
+    cb, requests, delays = client([httpx.Response(500), ok(invoice)])
+    out["invoice_5xx"] = (await call(cb, cb.create_invoice("USDT", 1, "x")), len(requests))
+
+    cb, requests, delays = client([httpx.ReadTimeout("slow"), ok(invoice)])
+    out["invoice_timeout"] = (await call(cb, cb.create_invoice("USDT", 1, "x")), len(requests))
+
+    cb, requests, delays = client([httpx.Response(429), httpx.ConnectError("refused"), ok(invoice)])
+    out["invoice_429"] = (await call(cb, cb.create_invoice("USDT", 1, "x")), len(requests))
+
+    cb, requests, delays = client([httpx.Response(200, json={"ok": False, "error": {"code": 400}})])
+    out["not_ok"] = (await call(cb, cb.get_exchange_rates()), len(requests))
+
+    cb, requests, delays = client([])
+    cb.start_rate_refresh(60)
+    await cb.close()
+    out["closed"] = (cb._client.is_closed, cb._refresh_task)
+    return out
+
+
+def test_retries():
+    result = asyncio.run(retry_scenario())
+    assert result["retried"] == ([], 3, 3.0, True)
+    assert result["exhausted"] == ("HTTPStatusError", 3)
+    assert result["bad_request"] == ("HTTPStatusError", 1)
+    assert result["connect_error"] == ([], 2)
+    assert result["invoice_5xx"] == ("HTTPStatusError", 1)
+    assert result["invoice_timeout"] == ("ReadTimeout", 1)
+    assert result["invoice_429"] == ({"invoice_id": 1, "pay_url": "https://pay.example/i"}, 3)
+    assert result["not_ok"] == ("RuntimeError", 1)
+    assert result["closed"] == (True, None)
+
+
+def rates(*pairs) -> httpx.Response:
+    return ok([{"source": s, "target": t, "rate": str(r)} for s, t, r in pairs])
+
+
+async def rate_scenario() -> dict:
+    out = {}
+    down = [httpx.Response(503)] * 3
+    cb, requests, _ = client([rates(("USDT", "RUB", 80)), rates(("USDT", "RUB", 100)), *down], max_rate_staleness=0.2)
+    try:
+        # Курс есть только как USDT→RUB: RUB→USDT считается обратным
+        out["first"] = (await cb.rub_to_usdt(800), len(requests))
+        out["cached"] = (await cb.rub_to_usdt(1600), len(requests))
+        await asyncio.sleep(0.25)
+        out["refreshed"] = (await cb.rub_to_usdt(1000), len(requests))
+        await asyncio.sleep(0.25)
+        # API лежит: остается последний удачный курс
+        out["api_down"] = (await cb.rub_to_usdt(500), len(requests))
+    finally:
+        await cb.close()
+
+    # Прямая котировка не перезаписывается обратной, в каком бы порядке они ни пришли
+    cb, requests, _ = client([rates(("RUB", "USDT", 0.0125), ("USDT", "RUB", 90))])
+    try:
+        await cb.refresh_rates()
+        out["pairs"] = (cb.rate("RUB", "USDT"), cb.rate("USDT", "RUB"), cb.rate("TON", "RUB"))
+    finally:
+        await cb.close()
+
+    # Устаревший кэш при заданном RUB_USDT_RATE: курс из настроек, без запроса к API
+    cb, requests, _ = client([rates(("USDT", "RUB", 80))], max_rate_staleness=0.1, fallback_rub_usdt_rate=50)
+    try:
+        await cb.refresh_rates()
+        await asyncio.sleep(0.15)
+        out["settings_fallback"] = (await cb.rub_to_usdt(500), len(requests))
+    finally:
+        await cb.close()
+
+    cb, requests, _ = client(list(down))
+    out["no_rate"] = (await call(cb, cb.rub_to_usdt(100)), len(requests))
+    return out
+
+
+def test_rate_cache():
+    result = asyncio.run(rate_scenario())
+    assert result["first"] == (10.0, 1)
+    assert result["cached"] == (20.0, 1)
+    assert result["refreshed"] == (10.0, 2)
+    assert result["api_down"] == (5.0, 5)
+    assert result["pairs"] == (0.0125, 90.0, None)
+    assert result["settings_fallback"] == (10.0, 1)
+    assert result["no_rate"] == ("RuntimeError", 3)
+
+
+if __name__ == "__main__":
+    test_retries()
+    test_rate_cache()
+    print("✅ Повторы запросов и кэш курсов CryptoBot работают")
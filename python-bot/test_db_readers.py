@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Проверка пула читающих соединений SQLite (bot/db.py): чтения идут через
+соединения mode=ro, чтения внутри transaction() видят свои же
+незафиксированные записи, а чтение из другой задачи никогда не видит
+чужую незафиксированную транзакцию — и с пулом, и без него (pool size 0).
+"""
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+from bot.db import Database
+
+
+async def scenario(pool_size: int) -> dict:
+    path = os.path.join(tempfile.mkdtemp(), f"readers{pool_size}.sqlite3")
+    db = Database(f"sqlite:///{path}", sqlite_read_pool_size=pool_size)
+    await db.connect()
+    try:
+        async with db.transaction():
+            await db.execute("create table t (id integer primary key, v text)")
+            await db.execute("insert into t(v) values('committed')")
+        out = {"readers": len(db._readers)}
+
+        if pool_size:
+            # Запись через fetch уходит в read-only соединение и отклоняется
+            try:
+                await db.fetch("insert into t(v) values('via reader') returning id")
+                out["ro_write"] = "allowed"
+            except sqlite3.OperationalError as e:
+                out["ro_write"] = str(e)
+
+        in_tx = asyncio.Event()
+        release = asyncio.Event()
+
+        async def writer():
+            async with db.transaction():
+                await db.execute("insert into t(v) values('uncommitted')")
+                out["own_read"] = [r["v"] for r in await db.fetch("select v from t order by id")]
+                in_tx.set()
+                await release.wait()
+
+        async def reader():
+            await in_tx.wait()
+            read = asyncio.create_task(db.fetch("select v from t order by id"))
+            await asyncio.sleep(0.1)
+            # Пул отвечает сразу; без пула чтение ждет конца транзакции
+            out["read_done_during_tx"] = read.done()
+            release.set()
+            out["other_read"] = [r["v"] for r in await read]
+
+        await asyncio.gather(writer(), reader())
+        out["after"] = [r["v"] for r in await db.fetch("select v from t order by id")]
+        return out
+    finally:
+        await db.close()
+
+
+def test_reader_pool():
+    result = asyncio.run(scenario(2))
+    assert result["readers"] == 2
+    assert "readonly" in result["ro_write"]
+    assert result["own_read"] == ["committed", "uncommitted"]
+    assert result["read_done_during_tx"] is True
+    assert result["other_read"] == ["committed"]
+    assert result["after"] == ["committed", "uncommitted"]
+
+
+def test_without_reader_pool():
+    result = asyncio.run(scenario(0))
+    assert result["readers"] == 0
+    assert result["own_read"] == ["committed", "uncommitted"]
+    assert result["read_done_during_tx"] is False
+    assert result["other_read"] == ["committed", "uncommitted"]
+
+
+if __name__ == "__main__":
+    test_reader_pool()
+    test_without_reader_pool()
+    print("✅ Пул читающих соединений SQLite изолирован от записи")
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Проверка транзакций и группового коммита SQLite (bot/db.py): откат
+отбрасывает записи, группа коммитится по числу записей и по таймеру,
+transaction() внутри открытой группы сначала фиксирует группу, а два
+Database на одном файле пишут одновременно без "database is locked".
+"""
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+from bot.db import Database
+from bot.models import Orders, Tariffs, Users
+
+
+def committed(path: str, query: str):
+    # Отдельное соединение видит только зафиксированные данные
+    with sqlite3.connect(path) as conn:
+        return conn.execute(query).fetchall()
+
+
+async def open_db(path: str, **kwargs) -> Database:
+    db = Database(f"sqlite:///{path}", **kwargs)
+    await db.connect()
+    # transaction() коммитит сразу, не дожидаясь окна группы
+    async with db.transaction():
+        await db.execute("create table if not exists t (id integer primary key, v text)")
+    return db
+
+
+async def rollback_scenario(path: str) -> list:
+    db = await open_db(path)
+    try:
+        try:
+            async with db.transaction():
+                await db.execute("insert into t(v) values('lost')")
+                async with db.transaction():
+                    await db.execute("insert into t(v) values('lost too')")
+                raise RuntimeError("boom")
+        except RuntimeError:
+            pass
+        async with db.transaction():
+            await db.execute("insert into t(v) values('kept')")
+        return [r[0] for r in committed(path, "select v from t order by id")]
+    finally:
+        await db.close()
+
+
+async def group_size_scenario(path: str) -> tuple:
+    # Окно 10 секунд, но третья запись закрывает группу сразу
+    db = await open_db(path, group_commit_ms=10_000, group_commit_max_writes=3)
+    try:
+        started = time.monotonic()
+        await asyncio.wait_for(
+            asyncio.gather(*(db.execute("insert into t(v) values($1)", f"g{i}") for i in range(3))), 2
+        )
+        return time.monotonic() - started, committed(path, "select count(*) from t")[0][0]
+    finally:
+        await db.close()
+
+
+async def group_timer_scenario(path: str) -> tuple:
+    db = await open_db(path, group_commit_ms=100, group_commit_max_writes=100)
+    try:
+        started = time.monotonic()
+        await db.execute("insert into t(v) values('timer')")
+        return time.monotonic() - started, committed(path, "select count(*) from t")[0][0]
+    finally:
+        await db.close()
+
+
+async def nested_group_scenario(path: str) -> tuple:
+    db = await open_db(path, group_commit_ms=5_000, group_commit_max_writes=100)
+    try:
+        started = time.monotonic()
+        grouped = asyncio.create_task(db.execute("insert into t(v) values('grouped')"))
+        await asyncio.sleep(0.05)
+        async with db.transaction():
+            await db.execute("insert into t(v) values('tx')")
+        # Группа зафиксирована транзакцией — ждать 5 секунд таймера не нужно
+        await asyncio.wait_for(grouped, 2)
+        return time.monotonic() - started, [r[0] for r in committed(path, "select v from t order by id")]
+    finally:
+        await db.close()
+
+
+async def two_writers_scenario(path: str) -> dict:
+    # Два процесса на одном файле: у каждого свой _write_lock, ждать друг друга должна сама SQLite
+    first = Database(f"sqlite:///{path}")
+    await first.connect()
+    second = Database(f"sqlite:///{path}")
+    await second.connect()
+    try:
+        await first.ensure_schema()
+        await second.ensure_schema()
+        tariff = await Tariffs(first).create("Россия", "4 Gb RAM / 2 Core CPU / SSD 40 Gb", 650)
+        user = await Users(first, cache_size=0).upsert("buyer", 4001)
+        await Users(first, cache_size=0).credit_bonus(user["id"], 100, "manual")
+        orders = [Orders(first), Orders(second)]
+        users = [Users(first, cache_size=0), Users(second, cache_size=0)]
+        created = [await orders[0].create(user["id"], tariff["id"], None) for _ in range(100)]
+
+        async def pay(i, order):
+            return await orders[i % 2].mark_paid(order["id"])
+
+        async def debit(i):
+            return await users[i % 2].debit_bonus(user["id"], 1, "checkout", 10_000 + i)
+
+        results = await asyncio.gather(
+            *(pay(i, o) for i, o in enumerate(created)),
+            *(debit(i) for i in range(100)),
+            return_exceptions=True,
+        )
+        return {
+            "errors": [repr(r) for r in results if isinstance(r, Exception)],
+            "paid": committed(path, "select count(*) from orders where status='paid'")[0][0],
+            "balance": committed(path, f"select bonus_balance from users where id={user['id']}")[0][0],
+        }
+    finally:
+        await first.close()
+        await second.close()
+
+
+def path_for(name: str) -> str:
+    return os.path.join(tempfile.mkdtemp(), name)
+
+
+def test_rollback_discards_writes():
+    assert asyncio.run(rollback_scenario(path_for("rollback.sqlite3"))) == ["kept"]
+
+
+def test_group_commit_flushes_on_size_limit():
+    elapsed, count = asyncio.run(group_size_scenario(path_for("size.sqlite3")))
+    assert count == 3
+    assert elapsed < 2
+
+
+def test_group_commit_flushes_on_timer():
+    elapsed, count = asyncio.run(group_timer_scenario(path_for("timer.sqlite3")))
+    assert count == 1
+    assert 0.09 <= elapsed < 2
+
+
+def test_transaction_inside_open_group():
+    elapsed, values = asyncio.run(nested_group_scenario(path_for("nested.sqlite3")))
+    assert values == ["grouped", "tx"]
+    assert elapsed < 2
+
+
+def test_two_writers_on_one_file():
+    result = asyncio.run(two_writers_scenario(path_for("writers.sqlite3")))
+    assert result["errors"] == []
+    assert result["paid"] == 100
+    assert result["balance"] == 0
+
+
+if __name__ == "__main__":
+    test_rollback_discards_writes()
+    test_group_commit_flushes_on_size_limit()
+    test_group_commit_flushes_on_timer()
+    test_transaction_inside_open_group()
+    test_two_writers_on_one_file()
+    print("✅ Транзакции и групповой коммит SQLite работают")
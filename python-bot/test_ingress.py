@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Проверка очереди апдейтов между ingress и воркерами (bot/ingress.py):
+шардирование по from_user.id, порядок апдейтов одного пользователя,
+удаление апдейта из очереди только после обработки. Относительный
+UPDATE_QUEUE_PATH лежит в каталоге проекта, а не в корне файловой системы.
+"""
+
+import asyncio
+import os
+import random
+import tempfile
+
+from aiogram import Bot, Dispatcher, F, types
+
+from bot.db import Database
+from bot.ingress import UpdateQueue, run_worker
+
+
+def update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "U"},
+            "text": text,
+        },
+    }
+
+
+async def scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "updates.sqlite3")
+    ingress = UpdateQueue(path, shards=2)
+    await ingress.connect()
+    update_id = 0
+    for i in range(10):
+        for user_id in (100, 101, 102, 103):
+            update_id += 1
+            await ingress.push(update(update_id, user_id, str(i)))
+    await ingress.push(update(1, 100, "duplicate"))
+    pushed = await ingress.depth()
+
+    bot = Bot(token="123456:TEST")
+    dp = Dispatcher()
+    seen: dict[int, list[str]] = {}
+    shard_users: dict[int, set[int]] = {0: set(), 1: set()}
+
+    @dp.message(F.text)
+    async def record(msg: types.Message):
+        await asyncio.sleep(random.uniform(0, 0.01))
+        seen.setdefault(msg.from_user.id, []).append(msg.text)
+
+    # Каждый воркер — отдельное подключение к файлу очереди, как отдельный процесс
+    workers = []
+    for shard in (0, 1):
+        q = UpdateQueue(path, shards=2)
+        await q.connect()
+        workers.append((q, asyncio.create_task(run_worker(q, shard, bot, dp))))
+    for _ in range(200):
+        if not await ingress.depth():
+            break
+        await asyncio.sleep(0.02)
+    for q, task in workers:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        await q.close()
+    for user_id in seen:
+        shard_users[ingress.shard_of(update(0, user_id, ""))].add(user_id)
+    left = await ingress.depth()
+    await ingress.close()
+    await bot.session.close()
+    return {"pushed": pushed, "left": left, "seen": seen, "shard_users": shard_users}
+
+
+def test_ingress_queue():
+    result = asyncio.run(scenario())
+    assert result["pushed"] == 40
+    assert result["left"] == 0
+    for user_id in (100, 101, 102, 103):
+        assert result["seen"][user_id] == [str(i) for i in range(10)]
+    assert result["shard_users"] == {0: {100, 102}, 1: {101, 103}}
+
+
+def test_queue_path_resolution():
+    project = os.path.dirname(os.path.abspath(__file__))
+    assert UpdateQueue("updates.sqlite3", shards=1).db._sqlite_path() == os.path.join(project, "updates.sqlite3")
+    assert Database("sqlite:///shop.sqlite3")._sqlite_path() == os.path.join(project, "shop.sqlite3")
+    absolute = os.path.join(tempfile.mkdtemp(), "updates.sqlite3")
+    assert UpdateQueue(absolute, shards=1).db._sqlite_path() == absolute
+
+
+if __name__ == "__main__":
+    test_ingress_queue()
+    test_queue_path_resolution()
+    print("✅ Очередь апдейтов сохраняет порядок для каждого пользователя")
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Проверка аренды задач (bot/jobs.py): перезапуск процесса с recover=True
+не забирает задачу, которую живой процесс еще выполняет (аренда продлевается
+heartbeat'ом), а задачу упавшего процесса подхватывает после истечения
+locked_until.
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from bot.db import Database
+from bot.jobs import JobQueue
+
+
+async def scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "leases.sqlite3")
+    db = Database(f"sqlite:///{path}")
+    await db.connect()
+    try:
+        await db.ensure_schema()
+        runs: list[str] = []
+
+        async def slow(payload: dict):
+            runs.append(payload["name"])
+            await asyncio.sleep(0.6)
+
+        async def fast(payload: dict):
+            runs.append(payload["name"])
+
+        # Задача упавшего процесса: running, аренда уже истекла
+        async with db.transaction():
+            await db.execute(
+                "insert into jobs(kind, payload, status, attempts, run_at, locked_until) values($1,$2,'running',1,0,$3)",
+                "fast",
+                json.dumps({"name": "orphan"}),
+                time.time() - 1,
+            )
+
+        live = JobQueue(db, lease=0.15)
+        live.register("slow", slow)
+        await live.start(recover=False)
+        await live.enqueue("slow", {"name": "broadcast"})
+        # Аренда 0.15 с уже трижды истекла бы без heartbeat
+        await asyncio.sleep(0.45)
+
+        restarted = JobQueue(db, lease=0.15)
+        restarted.register("slow", slow)
+        restarted.register("fast", fast)
+        await restarted.start()
+        await restarted.join()
+        await live.join()
+        # Sweep задач с истекшей арендой не трогает задачу, которую продлевает heartbeat
+        await asyncio.sleep(0.3)
+        await restarted.close()
+        await live.close()
+        return {
+            "runs": sorted(runs),
+            "left": (await db.fetchrow("select count(*) as c from jobs"))["c"],
+        }
+    finally:
+        await db.close()
+
+
+def test_job_leases():
+    result = asyncio.run(scenario())
+    assert result["runs"] == ["broadcast", "orphan"]
+    assert result["left"] == 0
+
+
+if __name__ == "__main__":
+    test_job_leases()
+    print("✅ Перезапуск не дублирует выполняющиеся задачи")
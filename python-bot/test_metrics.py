@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Проверка метрик (bot/metrics.py, bot/db.py, bot/webhook.py): рендер в
+текстовом формате Prometheus (метки, накопительные бакеты гистограммы),
+статистика пула Database.metrics() и доступ к /metrics — без METRICS_TOKEN
+эндпоинт не отдается, с ним требуется Bearer-токен.
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from bot.db import Database
+from bot.jobs import JobQueue
+from bot.metrics import Histogram, MetricsRegistry
+from bot.models import Orders, WebhookEvents
+from bot.webhook import create_app
+
+
+class FakePool:
+    # Тот же интерфейс размеров и acquire(), что у asyncpg.Pool
+    def __init__(self):
+        self.idle = 4
+
+    def get_min_size(self):
+        return 2
+
+    def get_max_size(self):
+        return 10
+
+    def get_size(self):
+        return 5
+
+    def get_idle_size(self):
+        return self.idle
+
+    @asynccontextmanager
+    async def acquire(self):
+        self.idle -= 1
+        try:
+            yield object()
+        finally:
+            self.idle += 1
+
+
+def test_render():
+    registry = MetricsRegistry()
+    hist = Histogram(buckets=(0.1, 0.5))
+    for value in (0.05, 0.1, 0.3, 2.0):
+        hist.observe(value)
+    registry.register("queue", lambda: [("jobs_pending", {}, 3), ("jobs_done", {"kind": "invoice_paid"}, 7)])
+    registry.register("latency", lambda: [("handler_seconds", {"route": "buy"}, hist)])
+    registry.register("empty", lambda: [])
+    # Повторная регистрация под тем же именем заменяет коллектор
+    registry.register("queue", lambda: [("jobs_pending", {}, 4)])
+    assert registry.render() == (
+        "jobs_pending 4\n"
+        'handler_seconds_bucket{route="buy",le="0.1"} 2\n'
+        'handler_seconds_bucket{route="buy",le="0.5"} 3\n'
+        'handler_seconds_bucket{route="buy",le="+Inf"} 4\n'
+        'handler_seconds_sum{route="buy"} 2.45\n'
+        'handler_seconds_count{route="buy"} 4\n'
+    )
+
+
+async def pool_scenario() -> dict:
+    db = Database("postgresql://localhost/unused")
+    out = {"no_pool": (db.pool_stats(), db.metrics())}
+    db._pool = FakePool()
+    async with db._acquire_pg():
+        async with db._acquire_pg():
+            out["busy"] = {k: v for k, v in db.pool_stats().items() if k != "acquire_wait"}
+    metrics = {name: value for name, _, value in db.metrics()}
+    wait = metrics.pop("db_pool_acquire_wait_seconds")
+    out["idle"] = (metrics, wait.count)
+    registry = MetricsRegistry()
+    registry.register("db_pool", db.metrics)
+    out["rendered"] = registry.render().splitlines()
+    db._pool = None
+    return out
+
+
+def test_pool_metrics():
+    result = asyncio.run(pool_scenario())
+    assert result["no_pool"] == ({}, [])
+    assert result["busy"] == {"min_size": 2, "max_size": 10, "size": 5, "idle": 2, "acquired": 2}
+    assert result["idle"] == (
+        {"db_pool_min_size": 2, "db_pool_max_size": 10, "db_pool_size": 5, "db_pool_idle": 4, "db_pool_acquired": 0},
+        2,
+    )
+    assert result["rendered"][:5] == [
+        "db_pool_min_size 2", "db_pool_max_size 10", "db_pool_size 5", "db_pool_idle 4", "db_pool_acquired 0",
+    ]
+    assert 'db_pool_acquire_wait_seconds_bucket{le="+Inf"} 2' in result["rendered"]
+
+
+async def endpoint_scenario() -> dict:
+    db = Database("sqlite:///:memory:")
+    out = {}
+    for token in (None, "s3cret"):
+        app = create_app(None, Orders(db), WebhookEvents(db), JobQueue(db), [1], "secret", metrics_token=token)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            statuses = []
+            for headers in ({}, {"Authorization": "Bearer wrong"}, {"Authorization": "Bearer s3cret"}):
+                resp = await client.get("/metrics", headers=headers)
+                statuses.append(resp.status)
+            out[token] = statuses
+        finally:
+            await client.close()
+    return out
+
+
+def test_metrics_endpoint():
+    result = asyncio.run(endpoint_scenario())
+    assert result[None] == [404, 404, 404]
+    assert result["s3cret"] == [401, 401, 200]
+
+
+if __name__ == "__main__":
+    test_render()
+    test_pool_metrics()
+    test_metrics_endpoint()
+    print("✅ Метрики рендерятся в формате Prometheus, /metrics закрыт токеном")
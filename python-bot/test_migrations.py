@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Проверка миграции v3 (bot/migrations.py): дубликаты пользователей с одним
+telegram_id (наследие старого гоночного upsert) схлопываются в самую старую
+запись, а заказы, реферер и реферальные начисления переносятся на нее.
+Повторный ensure_schema() в том же процессе не обращается к базе, а
+verify_schema() падает, если в схеме не хватает колонки или таблицы.
+"""
+
+import asyncio
+import os
+import tempfile
+
+from bot.db import Database
+from bot.migrations import MIGRATIONS
+
+
+async def scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "legacy.sqlite3")
+    db = Database(f"sqlite:///{path}")
+    await db.connect()
+    try:
+        # База в состоянии до v3
+        async with db.transaction():
+            await db.execute(
+                "create table schema_version (version integer primary key, name text, applied_at text)"
+            )
+        for m in MIGRATIONS[:2]:
+            await db._apply_migration(m)
+        async with db.transaction():
+            for user_id, telegram_id, referrer_id in (
+                (1, 500, None),  # реферер
+                (2, 600, None),  # приглашенный
+                (3, 500, None),  # дубликат реферера
+                (4, 600, 3),  # дубликат приглашенного, реферер — дубликат
+                (5, 700, 4),  # приглашен дубликатом
+            ):
+                await db.execute(
+                    "insert into users(id, username, telegram_id, referrer_id) values($1,$2,$3,$4)",
+                    user_id, f"u{user_id}", telegram_id, referrer_id,
+                )
+            await db.execute("insert into tariffs(id, location, specs, price) values(1,'Россия','4 Gb RAM',650)")
+            await db.execute("insert into orders(id, user_id, tariff_id, status) values(1,4,1,'paid')")
+            await db.execute(
+                "insert into referral_rewards(referrer_id, referred_user_id, order_id, reward_amount) values(3,4,1,100)"
+            )
+
+        version = await db.ensure_schema()
+        return {
+            "version": version,
+            "users": [
+                (r["id"], r["telegram_id"], r["referrer_id"])
+                for r in await db.fetch("select id, telegram_id, referrer_id from users order by id")
+            ],
+            "orders": [r["user_id"] for r in await db.fetch("select user_id from orders")],
+            "rewards": [
+                (r["referrer_id"], r["referred_user_id"])
+                for r in await db.fetch("select referrer_id, referred_user_id from referral_rewards")
+            ],
+            "ref_count": {
+                r["id"]: (r["ref_count"], r["ref_rewards"])
+                for r in await db.fetch("select id, ref_count, ref_rewards from users order by id")
+            },
+        }
+    finally:
+        await db.close()
+
+
+def test_duplicate_users_keep_referrals():
+    result = asyncio.run(scenario())
+    assert result["version"] == max(m.version for m in MIGRATIONS)
+    assert result["users"] == [(1, 500, None), (2, 600, 1), (5, 700, 2)]
+    assert result["orders"] == [2]
+    assert result["rewards"] == [(1, 2)]
+    # Счетчики v11 считаются уже по схлопнутым строкам
+    assert result["ref_count"] == {1: (1, 100), 2: (1, 0), 5: (0, 0)}
+
+
+async def ensure_verify_scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "schema.sqlite3")
+    db = Database(f"sqlite:///{path}")
+    await db.connect()
+    try:
+        out = {"first": await db.ensure_schema()}
+        await db.verify_schema()
+        # Все SQL-запросы к файлу базы: писатель и пул читателей
+        statements: list[str] = []
+        for conn in [db._sqlite, *db._readers]:
+            await conn.set_trace_callback(statements.append)
+        out["second"] = (await db.ensure_schema(), len(statements))
+        out["forced"] = (await db.ensure_schema(force=True), len(statements) > 0)
+
+        async def verify_error() -> str | None:
+            try:
+                await db.verify_schema()
+            except RuntimeError as e:
+                return str(e)
+            return None
+
+        async with db.transaction():
+            await db.execute("alter table broadcasts drop column blocked")
+        out["missing_column"] = await verify_error()
+        async with db.transaction():
+            await db.execute("drop table daily_stats")
+        out["missing_table"] = await verify_error()
+        return out
+    finally:
+        await db.close()
+
+
+def test_ensure_and_verify_schema():
+    result = asyncio.run(ensure_verify_scenario())
+    latest = max(m.version for m in MIGRATIONS)
+    assert result["first"] == latest
+    assert result["second"] == (latest, 0)
+    assert result["forced"] == (latest, True)
+    assert result["missing_column"] == "Database schema is missing columns: broadcasts.blocked"
+    assert result["missing_table"].startswith("Database schema is missing columns: broadcasts.blocked, daily_stats.day,")
+    assert result["missing_table"].endswith("daily_stats.discounts")
+
+
+if __name__ == "__main__":
+    test_duplicate_users_keep_referrals()
+    test_ensure_and_verify_schema()
+    print("✅ Миграции применяются один раз, verify_schema() находит недостающие колонки")
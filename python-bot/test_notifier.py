@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Проверка рассылки уведомлений (bot/notify.py): лимит сообщений в чат,
+повтор после flood control (RetryAfter), счетчики ошибок для заблокировавших бота.
+"""
+
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+from bot.notify import Notifier
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+        self.flood_once = {2}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == 3:
+            raise TelegramForbiddenError(None, "bot was blocked by the user")
+        if chat_id in self.flood_once:
+            self.flood_once.discard(chat_id)
+            raise TelegramRetryAfter(None, "Too Many Requests", 0.2)
+        self.sent.append((chat_id, time.monotonic()))
+
+
+async def scenario() -> dict:
+    bot = FakeBot()
+    notifier = Notifier(bot, global_rate=1000, per_chat_rate=20, per_chat_burst=1)
+
+    started = time.monotonic()
+    delivered = await notifier.fan_out([1, 2, 3], "✅ Оплачен счет 1")
+    fan_out_time = time.monotonic() - started
+
+    bot.sent.clear()
+    for _ in range(5):
+        await notifier.send(10, "ping")
+    gaps = [b[1] - a[1] for a, b in zip(bot.sent, bot.sent[1:])]
+
+    return {
+        "delivered": delivered,
+        "fan_out_time": fan_out_time,
+        "min_gap": min(gaps),
+        "failed": notifier.failed,
+        "retry_after": notifier.retry_after,
+    }
+
+
+def test_notifier():
+    result = asyncio.run(scenario())
+    # Чат 2 получает сообщение после паузы, чат 3 заблокировал бота
+    assert result["delivered"] == 2
+    assert result["retry_after"] == 1
+    assert result["fan_out_time"] >= 0.2
+    assert result["failed"] == {"forbidden": 1}
+    # 20 сообщений/сек в один чат — не чаще одного раза в 50 мс
+    assert result["min_gap"] >= 0.045
+
+
+if __name__ == "__main__":
+    test_notifier()
+    print("✅ Лимиты и повторы уведомлений работают")
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Проверка keyset-пагинации списков заказов (bot/models.py, bot/handlers.py):
+Orders.by_user и Orders.page листаются вперед и назад через границу страниц
+без пропусков и повторов, has_prev/has_next верны на обоих концах, курсор
+за пределами данных возвращает первую страницу, а фильтр по статусу
+соблюдается на каждой странице.
+"""
+
+import asyncio
+import os
+import tempfile
+
+from bot.db import Database
+from bot.handlers import fetch_page, page_cursor
+from bot.models import Orders, Tariffs, Users
+
+
+def ids(page: tuple) -> tuple:
+    rows, has_prev, has_next = page
+    return [r["id"] for r in rows], has_prev, has_next
+
+
+async def scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "pages.sqlite3")
+    db = Database(f"sqlite:///{path}")
+    await db.connect()
+    try:
+        await db.ensure_schema()
+        orders, users = Orders(db), Users(db, cache_size=0)
+        tariff = await Tariffs(db).create("Россия", "4 Gb RAM / 2 Core CPU / SSD 40 Gb", 1000)
+        buyer = await users.upsert("buyer", 6001)
+        other = await users.upsert("other", 6002)
+        # Заказы buyer: 1..7, между ними чужие — id пользователя идут с разрывами
+        created = []
+        for i in range(7):
+            created.append(await orders.create(buyer["id"], tariff["id"], i))
+            await orders.create(other["id"], tariff["id"], 100 + i)
+        mine = [o["id"] for o in created]
+        for o in created[::2]:
+            await orders.set_status(o["id"], "paid")
+
+        def by_user(**cursor):
+            return orders.by_user(buyer["id"], **cursor)
+
+        def paid(**cursor):
+            return orders.page("paid", **cursor)
+
+        out = {"mine": mine}
+        first = await fetch_page(by_user, 3, None, None)
+        second = await fetch_page(by_user, 3, first[0][-1]["id"], None)
+        last = await fetch_page(by_user, 3, second[0][-1]["id"], None)
+        out["forward"] = [ids(first), ids(second), ids(last)]
+        back = await fetch_page(by_user, 3, None, last[0][0]["id"])
+        out["back"] = [ids(back), ids(await fetch_page(by_user, 3, None, back[0][0]["id"]))]
+        # Курсор старее последнего заказа (или новее первого): первая страница
+        out["past_end"] = ids(await fetch_page(by_user, 3, mine[0], None))
+        out["past_start"] = ids(await fetch_page(by_user, 3, None, mine[-1] + 100))
+        out["exact"] = ids(await fetch_page(by_user, 7, None, None))
+
+        paid_first = await fetch_page(paid, 2, None, None)
+        paid_next = await fetch_page(paid, 2, paid_first[0][-1]["id"], None)
+        out["paid"] = [ids(paid_first), ids(paid_next)]
+        out["statuses"] = {r["status"] for r in paid_first[0] + paid_next[0]}
+        out["empty"] = ids(await fetch_page(lambda **c: orders.page("delivered", **c), 2, 5, None))
+        return out
+    finally:
+        await db.close()
+
+
+def test_keyset_pages():
+    result = asyncio.run(scenario())
+    m = result["mine"][::-1]
+    assert result["forward"] == [(m[0:3], False, True), (m[3:6], True, True), (m[6:7], True, False)]
+    assert result["back"] == [(m[3:6], True, True), (m[0:3], False, True)]
+    assert result["past_end"] == (m[0:3], False, True)
+    assert result["past_start"] == (m[0:3], False, True)
+    assert result["exact"] == (m, False, False)
+    paid = result["mine"][::2][::-1]
+    assert result["paid"] == [(paid[0:2], False, True), (paid[2:4], True, False)]
+    assert result["statuses"] == {"paid"}
+    assert result["empty"] == ([], False, False)
+
+
+def test_page_cursor():
+    assert page_cursor("myorders") == (None, None)
+    assert page_cursor("admin:paid") == (None, None)
+    assert page_cursor("admin:paid:next:15") == (15, None)
+    assert page_cursor("myorders:prev:7") == (None, 7)
+    assert page_cursor("admin:all:next:x") == (None, None)
+
+
+if __name__ == "__main__":
+    test_keyset_pages()
+    test_page_cursor()
+    print("✅ Keyset-пагинация листается в обе стороны без пропусков")
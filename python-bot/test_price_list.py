@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Проверка разбора прайс-листа поставщика (bot/catalog.py): CSV с заголовком
+и JSON принимаются, а битый файл отклоняется целиком с номером строки и
+причиной — без необработанных TypeError/UnicodeDecodeError и без молча
+потерянных строк.
+"""
+
+import json
+
+from bot.catalog import parse_price_list
+
+
+def error_of(data: bytes, filename: str = "") -> str | None:
+    try:
+        parse_price_list(data, filename)
+    except ValueError as e:
+        return str(e)
+    return None
+
+
+def test_price_list():
+    csv_text = "Локация;Характеристики;Цена\nРоссия;4 Gb RAM;650\nСША;1vCPU;299,5\n"
+    assert parse_price_list(csv_text.encode()) == [("Россия", "4 Gb RAM", 650.0), ("США", "1vCPU", 299.5)]
+    rows = [{"location": "Россия", "specs": "4 Gb RAM", "price": 650}, ["США", "1vCPU", "299"]]
+    assert parse_price_list(json.dumps(rows).encode(), "prices.json") == [
+        ("Россия", "4 Gb RAM", 650.0), ("США", "1vCPU", 299.0),
+    ]
+
+    assert error_of(b"[1, 2]") == "row 1: expected an object or [location, specs, price], got int"
+    assert error_of("Россия;4 Gb RAM;650".encode("cp1251")) == "file is not UTF-8 text (byte 0)"
+    # Первый объект без цены — не заголовок: ошибка, а не пустой результат
+    assert error_of(json.dumps([{"location": "Россия", "specs": "4 Gb RAM"}]).encode()) == "row 1: missing price"
+    assert error_of(json.dumps([rows[0], {"location": "США"}]).encode()) == "row 2: missing specs, price"
+    assert error_of(b'[["A", "B", "x"]]') == "row 1: bad price 'x'"
+    assert error_of(b'{"location": "A"}', "prices.json") == "JSON price list must be an array"
+    assert error_of(b"A;B;650\nC;D;-1\n") == "row 2: empty location/specs or non-positive price"
+
+
+if __name__ == "__main__":
+    test_price_list()
+    print("✅ Прайс-лист разбирается и проверяется построчно")
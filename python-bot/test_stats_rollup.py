@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Проверка rollup-таблицы daily_stats (bot/models.py): инкрементальные
+обновления при смене статуса дают ровно те же строки, что Stats.rebuild().
+Созданные заказы считаются по дню created_at, оплаты, выручка и выдача — по
+UTC-дню paid_at (оба пишутся приложением в UTC), а откат оплаты забирает свое
+у того же дня, а не у сегодняшнего. rebuild() во время оплат ничего не теряет.
+"""
+
+import asyncio
+import os
+import tempfile
+from datetime import datetime, timedelta
+
+from bot import models
+from bot.db import Database
+from bot.models import Orders, Stats, Tariffs, Users
+
+
+async def snapshot(db: Database) -> list:
+    return [
+        (r["day"], r["tariff_id"], r["created"], r["paid"], r["delivered"], r["revenue"], r["discounts"])
+        for r in await db.fetch("select * from daily_stats order by day, tariff_id")
+    ]
+
+
+async def scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "stats.sqlite3")
+    db = Database(f"sqlite:///{path}")
+    await db.connect()
+    real_now = models._utc_now
+    try:
+        await db.ensure_schema()
+        tariffs, users = Tariffs(db), Users(db, cache_size=0)
+        orders = Orders(db, markup_percent=10)
+        stats = Stats(db, orders)
+        ru = await tariffs.create("Россия", "4 Gb RAM / 2 Core CPU / SSD 40 Gb", 1000)
+        us = await tariffs.create("США", "1vCPU / 768 MB RAM / SSD 5 Gb", 300)
+        user = await users.upsert("buyer", 5001)
+
+        a = await orders.create(user["id"], ru["id"], 1)
+        b = await orders.create(user["id"], ru["id"], 2)
+        c = await orders.create(user["id"], us["id"], 3, discount_amount=30, final_price=300)
+        await orders.create(user["id"], us["id"], 4)
+        created_day = datetime.fromisoformat(a["created_at"]).replace(hour=23, minute=59)
+
+        def at(days: int):
+            # Оплаты и откаты в другие дни, у самой границы UTC-суток
+            models._utc_now = lambda: created_day + timedelta(days=days)
+
+        at(1)
+        await orders.mark_paid(a["id"])
+        await orders.mark_paid(b["id"])
+        await orders.mark_paid(c["id"])
+        at(2)
+        await orders.set_status(b["id"], "created")
+        await orders.set_status(c["id"], "cancelled")
+        at(3)
+        await orders.set_status(a["id"], "delivered")
+        at(4)
+        await orders.mark_paid(b["id"])
+        await orders.set_status(b["id"], "delivered")
+        await orders.set_status(b["id"], "paid")
+        at(5)
+        # created_at пишется тем же UTC-временем приложения, что и paid_at
+        await orders.create(user["id"], ru["id"], 5)
+
+        incremental = await snapshot(db)
+        await stats.rebuild()
+        return {
+            "days": [(created_day + timedelta(days=d)).date().isoformat() for d in range(6)],
+            "incremental": incremental,
+            "rebuilt": await snapshot(db),
+        }
+    finally:
+        models._utc_now = real_now
+        await db.close()
+
+
+def test_incremental_matches_rebuild():
+    result = asyncio.run(scenario())
+    d = result["days"]
+    assert result["incremental"] == result["rebuilt"]
+    # 1000 +10% = 1100; заказ c отменен, его оплата и скидка списаны с дня оплаты
+    assert result["rebuilt"] == [
+        (d[0], 1, 2, 0, 0, 0, 0),
+        (d[0], 2, 2, 0, 0, 0, 0),
+        (d[1], 1, 0, 1, 1, 1100, 0),
+        (d[4], 1, 0, 1, 0, 1100, 0),
+        (d[5], 1, 1, 0, 0, 0, 0),
+    ]
+
+
+async def concurrent_scenario() -> tuple:
+    # Оплаты идут, пока rebuild() пересчитывает сводку
+    path = os.path.join(tempfile.mkdtemp(), "stats_race.sqlite3")
+    db = Database(f"sqlite:///{path}")
+    await db.connect()
+    try:
+        await db.ensure_schema()
+        orders = Orders(db)
+        stats = Stats(db, orders)
+        tariff = await Tariffs(db).create("Россия", "4 Gb RAM / 2 Core CPU / SSD 40 Gb", 1000)
+        user = await Users(db, cache_size=0).upsert("buyer", 5002)
+        created = [await orders.create(user["id"], tariff["id"], i) for i in range(40)]
+        await asyncio.gather(
+            *(orders.mark_paid(o["id"]) for o in created[:20]),
+            stats.rebuild(),
+            *(orders.mark_paid(o["id"]) for o in created[20:]),
+        )
+        during = await snapshot(db)
+        await stats.rebuild()
+        return during, await snapshot(db)
+    finally:
+        await db.close()
+
+
+def test_rebuild_during_transitions():
+    during, fresh = asyncio.run(concurrent_scenario())
+    assert during == fresh
+    assert [(r[2], r[3], r[5]) for r in fresh] == [(40, 40, 40000)]
+
+
+if __name__ == "__main__":
+    test_incremental_matches_rebuild()
+    test_rebuild_during_transitions()
+    print("✅ Инкрементальный rollup совпадает с rebuild()")
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Проверка приема апдейтов Telegram через webhook (bot/webhook.py):
+проверка секретного токена и передача апдейта в Dispatcher.
+"""
+
+import asyncio
+
+from aiogram import Bot, Dispatcher, F, types
+from aiohttp.test_utils import TestClient, TestServer
+
+from bot.jobs import JobQueue
+from bot.webhook import create_app
+
+SECRET = "tg-secret"
+
+
+def update(update_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": 42, "type": "private"},
+            "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+            "text": text,
+        },
+    }
+
+
+async def scenario() -> dict:
+    bot = Bot(token="123456:TEST")
+    dp = Dispatcher()
+    seen = []
+
+    @dp.message(F.text)
+    async def record(msg: types.Message):
+        await asyncio.sleep(0.01)
+        seen.append(msg.text)
+
+    app = create_app(
+        bot, None, None, JobQueue(None), [], None,
+        dp=dp, telegram_secret=SECRET, telegram_max_concurrency=2,
+    )
+    client = TestClient(TestServer(app))
+    await client.start_server()
+    try:
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        statuses = []
+        for i in range(5):
+            resp = await client.post("/telegram-webhook", json=update(i + 1, f"msg{i}"), headers=headers)
+            statuses.append(resp.status)
+        wrong = await client.post("/telegram-webhook", json=update(99, "evil"), headers={"X-Telegram-Bot-Api-Secret-Token": "x"})
+        missing = await client.post("/telegram-webhook", json=update(100, "evil"))
+    finally:
+        # Остановка сервера дожидается обработки принятых апдейтов
+        await client.close()
+        await bot.session.close()
+    return {"statuses": statuses, "wrong": wrong.status, "missing": missing.status, "seen": sorted(seen)}
+
+
+def test_telegram_webhook():
+    result = asyncio.run(scenario())
+    assert result["statuses"] == [200] * 5
+    assert (result["wrong"], result["missing"]) == (401, 401)
+    assert result["seen"] == [f"msg{i}" for i in range(5)]
+
+
+if __name__ == "__main__":
+    test_telegram_webhook()
+    print("✅ Webhook Telegram принимает только апдейты с верным секретом")
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Проверка кэша пользователей (bot/models.py, bot/cache.py): индекс
+id -> telegram_id для инвалидации ограничен тем же LRU/TTL, что и сам кэш
+(вытесненные и истекшие строки уходят из обоих), а начисление бонусов и
+смена реферера сбрасывают закэшированную строку.
+"""
+
+import asyncio
+import os
+import tempfile
+
+from bot.db import Database
+from bot.models import Users
+
+
+async def scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "cache.sqlite3")
+    db = Database(f"sqlite:///{path}")
+    await db.connect()
+    try:
+        await db.ensure_schema()
+        users = Users(db, cache_size=2, cache_ttl=0.2)
+        out = {}
+
+        first = [await users.upsert(f"u{i}", 7000 + i) for i in range(5)]
+        out["evicted"] = (len(users.cache), sorted(users._tg_by_id.values()))
+
+        # Обновление сбрасывает строку, следующий upsert читает свежий баланс
+        await users.upsert("u3", 7003)
+        await users.credit_bonus(first[3]["id"], 70, "manual")
+        out["after_credit"] = (first[3]["id"] in users._tg_by_id, (await users.upsert("u3", 7003))["bonus_balance"])
+        await users.set_referrer(first[4]["id"], first[3]["id"])
+        out["after_referrer"] = (await users.upsert("u4", 7004))["referrer_id"]
+
+        # Истекшая запись уходит из кэша и из индекса при следующем обращении
+        await asyncio.sleep(0.25)
+        users.cache.get(7004)
+        out["expired"] = first[4]["id"] in users._tg_by_id
+
+        users.cache.clear()
+        out["cleared"] = len(users._tg_by_id)
+
+        # Без кэша индекс не растет вовсе
+        uncached = Users(db, cache_size=0)
+        for i in range(5):
+            await uncached.upsert(f"u{i}", 7000 + i)
+        out["uncached"] = len(uncached._tg_by_id)
+        return out
+    finally:
+        await db.close()
+
+
+def test_user_cache_eviction():
+    result = asyncio.run(scenario())
+    assert result["evicted"] == (2, [7003, 7004])
+    assert result["after_credit"] == (False, 70)
+    assert result["after_referrer"] is not None
+    assert result["expired"] is False
+    assert result["cleared"] == 0
+    assert result["uncached"] == 0
+
+
+if __name__ == "__main__":
+    test_user_cache_eviction()
+    print("✅ Кэш пользователей и его индекс вытесняются вместе")
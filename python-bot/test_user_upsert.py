@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Проверка upsert пользователей (bot/models.py, bot/db.py): одновременные
+/start одного аккаунта — в том числе из двух процессов с общей базой —
+дают ровно одну строку, а username без ника не затирается. На SQLite
+старше 3.35 (нет INSERT ... RETURNING) Database.connect() отказывается
+запускаться до создания файла базы.
+"""
+
+import asyncio
+import os
+import sqlite3
+import tempfile
+
+from bot.db import Database
+from bot.models import Users
+
+
+async def scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "upsert.sqlite3")
+    first, second = Database(f"sqlite:///{path}"), Database(f"sqlite:///{path}")
+    await first.connect()
+    await second.connect()
+    try:
+        await first.ensure_schema()
+        await second.ensure_schema()
+        # Без кэша: каждый вызов доходит до базы, как в разных процессах
+        a, b = Users(first, cache_size=0), Users(second, cache_size=0)
+        rows = await asyncio.gather(*(
+            (a if i % 2 else b).upsert(None if i % 3 else "eve", 4001) for i in range(20)
+        ))
+        stored = await first.fetch("select id, username from users where telegram_id=4001")
+        return {
+            "ids": {r["id"] for r in rows},
+            "stored": [(r["id"], r["username"]) for r in stored],
+            "renamed": (await a.upsert("eve_new", 4002))["username"],
+        }
+    finally:
+        await first.close()
+        await second.close()
+
+
+def test_concurrent_upsert_single_row():
+    result = asyncio.run(scenario())
+    assert len(result["ids"]) == 1
+    assert result["stored"] == [(next(iter(result["ids"])), "eve")]
+    assert result["renamed"] == "eve_new"
+
+
+async def old_sqlite_scenario() -> tuple:
+    path = os.path.join(tempfile.mkdtemp(), "nested", "old.sqlite3")
+    real = (sqlite3.sqlite_version_info, sqlite3.sqlite_version)
+    sqlite3.sqlite_version_info, sqlite3.sqlite_version = (3, 34, 1), "3.34.1"
+    try:
+        await Database(f"sqlite:///{path}").connect()
+        error = None
+    except RuntimeError as e:
+        error = str(e)
+    finally:
+        sqlite3.sqlite_version_info, sqlite3.sqlite_version = real
+    return error, os.path.exists(os.path.dirname(path))
+
+
+def test_old_sqlite_refused():
+    error, created = asyncio.run(old_sqlite_scenario())
+    assert error == "SQLite >= 3.35 is required, found 3.34.1"
+    assert created is False
+
+
+if __name__ == "__main__":
+    test_concurrent_upsert_single_row()
+    test_old_sqlite_refused()
+    print("✅ Одновременный /start дает одну строку, старый SQLite отклоняется")
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Проверка вебхука CryptoBot (bot/webhook.py) и очереди задач (bot/jobs.py):
+вебхук отвечает 200 до обработки, событие переживает перезапуск,
+неудачная отправка повторяется, а повторная доставка того же invoice_paid
+не меняет заказ и не рассылает уведомления повторно.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from bot.db import Database
+from bot.jobs import JobQueue
+from bot.models import Orders, Tariffs, Users, WebhookEvents
+from bot.notify import Notifier
+from bot.webhook import create_app, register_payment_jobs
+
+SECRET = "test-secret"
+
+
+class FakeBot:
+    def __init__(self, fail_first: int = 0):
+        self.sent = []
+        self.fail_first = fail_first
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.fail_first:
+            self.fail_first -= 1
+            raise ConnectionError("telegram is down")
+        self.sent.append((chat_id, text))
+
+
+def signed(body: dict) -> tuple[bytes, dict]:
+    raw = json.dumps(body).encode()
+    return raw, {"X-Signature": hmac.new(SECRET.encode(), raw, hashlib.sha256).hexdigest()}
+
+
+async def scenario() -> dict:
+    path = os.path.join(tempfile.mkdtemp(), "webhook.sqlite3")
+    db = Database(f"sqlite:///{path}")
+    await db.connect()
+    try:
+        await db.ensure_schema()
+        tariff = await Tariffs(db).create("Россия", "4 Gb RAM / 2 Core CPU / SSD 40 Gb", 650)
+        user = await Users(db, cache_size=0).upsert("buyer", 2001)
+        orders = Orders(db)
+        await orders.create(user["id"], tariff["id"], 555)
+
+        bot = FakeBot(fail_first=1)
+        events = WebhookEvents(db)
+        # Воркеры не запущены: вебхук только сохраняет событие и отвечает
+        crashed = JobQueue(db, backoff_base=0.01)
+        client = TestClient(TestServer(create_app(bot, orders, events, crashed, [1], SECRET)))
+        await client.start_server()
+        try:
+            raw, headers = signed({"update_id": 1, "update_type": "invoice_paid", "payload": {"invoice_id": 555}})
+            statuses = []
+            for _ in range(3):
+                resp = await client.post("/cryptobot-webhook", data=raw, headers=headers)
+                statuses.append(resp.status)
+            status_before_workers = (await orders.by_invoice_id(555))["status"]
+
+            # "Перезапуск": новая очередь поднимает сохраненную задачу из таблицы jobs
+            jobs = JobQueue(db, backoff_base=0.01)
+            register_payment_jobs(jobs, Notifier(bot), orders, [1])
+            await jobs.start()
+            for _ in range(50):
+                await jobs.join()
+                if not (await db.fetchrow("select count(*) as c from jobs"))["c"]:
+                    break
+                await asyncio.sleep(0.05)
+            await jobs.close()
+            sent_after_retries = len(bot.sent)
+
+            # После рестарта (пустой LRU) дубликат отсекается таблицей processed_events
+            events.recent.clear()
+            resp = await client.post("/cryptobot-webhook", data=raw, headers=headers)
+            statuses.append(resp.status)
+
+            bad = await client.post("/cryptobot-webhook", data=raw, headers={"X-Signature": "nope"})
+        finally:
+            await client.close()
+
+        return {
+            "statuses": statuses,
+            "status_before_workers": status_before_workers,
+            "retried": jobs.retried,
+            "bad_signature": bad.status,
+            "sent_after_retries": sent_after_retries,
+            "sent_total": len(bot.sent),
+            "order_status": (await orders.by_invoice_id(555))["status"],
+            "events": (await db.fetchrow("select count(*) as c from processed_events"))["c"],
+        }
+    finally:
+        await db.close()
+
+
+def test_webhook_idempotency():
+    result = asyncio.run(scenario())
+    assert result["statuses"] == [200, 200, 200, 200]
+    assert result["bad_signature"] == 401
+    assert result["status_before_workers"] == "created"
+    assert result["retried"] == 1
+    # Одно сообщение админу и одно покупателю — только на первую доставку
+    assert result["sent_after_retries"] == 2
+    assert result["sent_total"] == 2
+    assert result["order_status"] == "paid"
+    assert result["events"] == 1
+
+
+if __name__ == "__main__":
+    test_webhook_idempotency()
+    print("✅ Повторные доставки вебхука не дают побочных эффектов")